@@ -0,0 +1,36 @@
+"""
+The 16 ADTI personality types.
+
+Results store the short type code (e.g. "DSTA"). Older results stored the
+full type name instead; migration 10 converted those, and to_adti_type_code
+keeps new writes on codes.
+"""
+
+ADTI_TYPE_NAMES = {
+    "DSTA": "Data Strategist",
+    "DVRT": "Data Virtuoso",
+    "DLOG": "Data Logician",
+    "DVIS": "Data Visionary",
+    "DCOL": "Data Collaborator",
+    "DSUP": "Data Supporter",
+    "DADV": "Data Advocate",
+    "DINT": "Data Integrator",
+    "DCOM": "Data Commander",
+    "DEXE": "Data Executive",
+    "DINN": "Data Innovator",
+    "DPRO": "Data Protagonist",
+    "DCRT": "Data Creator",
+    "DCOMM": "Data Communicator",
+    "DENT": "Data Entrepreneur",
+    "DACT": "Data Activist"
+}
+
+ADTI_TYPE_CODES = {name: code for code, name in ADTI_TYPE_NAMES.items()}
+
+def to_adti_type_code(value):
+    """Return the type code for a type code or full type name, raising ValueError for anything else"""
+    if value in ADTI_TYPE_NAMES:
+        return value
+    if value in ADTI_TYPE_CODES:
+        return ADTI_TYPE_CODES[value]
+    raise ValueError(f"Unknown ADTI personality type: {value!r}")
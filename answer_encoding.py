@@ -0,0 +1,74 @@
+"""
+Compact encodings for stored answers.
+
+ASK option selections are stored as integer bitmasks (bit i set when option i
+of the question's option set was selected); option sets have at most
+MAX_OPTIONS entries. Result answer blobs are stored as a version byte followed
+by zlib-compressed compact JSON, and decode_answers still reads the JSON text
+and str(dict) blobs written by older versions.
+"""
+
+import ast
+import json
+import zlib
+
+# Largest option set in option_sets.json (masks themselves allow up to 63 options)
+MAX_OPTIONS = 20
+
+ANSWERS_ENCODING_VERSION = 1
+
+def encode_options(indices):
+    """Encode a list of selected option indices as a bitmask"""
+    mask = 0
+    for index in indices or []:
+        index = int(index)
+        if not 0 <= index < 63:
+            raise ValueError(f"Option index out of range: {index}")
+        mask |= 1 << index
+    return mask
+
+def decode_options(mask):
+    """Decode a bitmask into the sorted list of selected option indices"""
+    mask = mask or 0
+    indices = []
+    while mask:
+        lowest = mask & -mask
+        indices.append(lowest.bit_length() - 1)
+        mask ^= lowest
+    return indices
+
+def count_selected(mask):
+    """Number of options selected in a bitmask"""
+    return int(mask or 0).bit_count()
+
+def decode_option_masks(masks, width=MAX_OPTIONS):
+    """Decode many bitmasks at once into a (len(masks), width) boolean matrix"""
+    # numpy comes with pandas on the pages; keep it out of the database layer's import path
+    import numpy as np
+    
+    masks = np.asarray([mask or 0 for mask in masks], dtype=np.int64).reshape(-1, 1)
+    return ((masks >> np.arange(width, dtype=np.int64)) & 1).astype(bool)
+
+def selected_option_names(mask, option_list):
+    """Names of the options selected in a bitmask"""
+    return [option_list[index] for index in decode_options(mask) if index < len(option_list)]
+
+def encode_answers(answers):
+    """Encode JSON-compatible answer data as a versioned, compressed blob"""
+    payload = json.dumps(answers, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return bytes([ANSWERS_ENCODING_VERSION]) + zlib.compress(payload)
+
+def decode_answers(blob):
+    """Decode an answers blob written by encode_answers or by older versions (JSON or str(dict) text)"""
+    if blob is None:
+        return None
+    if isinstance(blob, bytes):
+        if blob[:1] == bytes([ANSWERS_ENCODING_VERSION]):
+            return json.loads(zlib.decompress(blob[1:]).decode('utf-8'))
+        raise ValueError(f"Unsupported answers encoding version: {blob[:1]!r}")
+    
+    # Legacy text blobs
+    try:
+        return json.loads(blob)
+    except ValueError:
+        return ast.literal_eval(blob)
@@ -8,7 +8,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'src', 'pages'))
 
 # Import database and page modules
 from database import Database
-from session_manager import SessionManager
+from session_manager import SESSION_QUERY_PARAM, SessionManager, start_session_reaper
 from src.pages.login import login_page
 from src.pages.home import home_page
 from src.pages.admin import admin_page
@@ -97,9 +97,9 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 def main():
-    # Initialize session manager and cleanup expired sessions
+    # Initialize session manager; expired sessions are deleted by the background reaper
     session_manager = SessionManager()
-    session_manager.cleanup_expired_sessions()
+    start_session_reaper()
     
     # Initialize session state
     if 'logged_in' not in st.session_state:
@@ -113,10 +113,11 @@ def main():
     if 'page' not in st.session_state:
         st.session_state.page = "login"
     
-    # Check for existing session token from file storage
+    # Check for an existing session stored in the database
     if not st.session_state.logged_in:
-        # Try to restore session from file
-        current_session = session_manager.get_current_session()
+        # Try to restore this browser's session from the token in its URL
+        session_token = st.experimental_get_query_params().get(SESSION_QUERY_PARAM, [None])[0]
+        current_session = session_manager.get_current_session(session_token)
         if current_session:
             # Restore session
             st.session_state.logged_in = True
@@ -125,6 +126,27 @@ def main():
             st.session_state.session_token = current_session['token']
             # Restore the last page visited
             st.session_state.page = current_session.get('current_page', 'home')
+            # The restored session has a new token; the one in the URL no longer works
+            st.experimental_set_query_params(**{SESSION_QUERY_PARAM: current_session['token']})
+        elif session_token:
+            st.experimental_set_query_params()
+    elif st.session_state.session_token:
+        user_info = session_manager.validate_session(st.session_state.session_token)
+        if not user_info:
+            # The session expired or was logged out elsewhere (answered from the session cache when fresh)
+            st.experimental_set_query_params()
+            st.session_state.logged_in = False
+            st.session_state.username = None
+            st.session_state.is_admin = False
+            st.session_state.session_token = None
+            st.session_state.page = "login"
+        elif session_manager.needs_rotation(user_info):
+            # Swap the token in the URL before it ages out of the restore window
+            new_token = session_manager.rotate_session(st.session_state.session_token, st.session_state.username,
+                                                       st.session_state.is_admin, st.session_state.page)
+            if new_token:
+                st.session_state.session_token = new_token
+                st.experimental_set_query_params(**{SESSION_QUERY_PARAM: new_token})
     
     # Sidebar navigation
     with st.sidebar:
@@ -169,16 +191,18 @@ def main():
                     if st.session_state.session_token:
                         session_manager.update_current_page(st.session_state.session_token, "admin")
                     st.rerun()
-                
-
+            
+            
             
             st.markdown("---")
             
             # Account section
             st.subheader("Conta")
             if st.button("Sair", key="sidebar_logout"):
-                # Clear all sessions
-                session_manager.clear_all_sessions()
+                # End this browser's session only
+                if st.session_state.session_token:
+                    session_manager.delete_session(st.session_state.session_token)
+                st.experimental_set_query_params()
                 
                 # Clear session state
                 for key in ['logged_in', 'username', 'is_admin', 'session_token']:
@@ -205,7 +229,7 @@ def main():
         admin_page()
     elif st.session_state.page == "ask_test":
         ask_test_page()
-
+    
     elif st.session_state.page == "adti_test":
         adti_test_page()
     elif st.session_state.page == "profile":
@@ -0,0 +1,60 @@
+"""
+Per-pillar rating aggregation shared by the ASK write paths and migrations.
+
+Each pillar of an ASK result keeps running sums and counts of its ratings,
+so a single manager evaluation can be applied as a constant-time delta.
+"""
+
+import json
+from functools import lru_cache
+
+# Order of the running aggregates stored per (test_result_id, pillar)
+AGGREGATE_COLUMNS = (
+    'user_rating_sum', 'user_rating_count',
+    'manager_rating_sum', 'manager_rating_count',
+    'rating_sum', 'rating_count',
+)
+
+@lru_cache(maxsize=None)
+def load_question_pillars(framework_path='framework.json'):
+    """Map ASK question ids to their pillar, reading framework.json once per process"""
+    try:
+        with open(framework_path, 'r', encoding='utf-8') as f:
+            questions = json.load(f).get('questions', [])
+    except (OSError, ValueError):
+        return {}
+    
+    return {question['id']: question.get('pillar') for question in questions}
+
+def rating_contributions(user_rating, manager_rating):
+    """Return one answer's contribution to each of the AGGREGATE_COLUMNS"""
+    # Likert ratings 1-5 are scored 0-4 and a zero score does not count
+    user_value = user_rating - 1 if user_rating else 0
+    manager_value = manager_rating - 1 if manager_rating else 0
+    
+    # Use manager rating if available, otherwise user rating
+    rating = manager_value if manager_value > 0 else user_value
+    
+    return (
+        max(user_value, 0), 1 if user_value > 0 else 0,
+        max(manager_value, 0), 1 if manager_value > 0 else 0,
+        max(rating, 0), 1 if rating > 0 else 0,
+    )
+
+def aggregate_answers(answers, question_pillars):
+    """Sum rating contributions per pillar for (question_id, user_rating, manager_rating) rows"""
+    aggregates = {}
+    for question_id, user_rating, manager_rating in answers:
+        pillar = question_pillars.get(int(question_id))
+        if pillar is None:
+            continue
+        
+        totals = aggregates.setdefault(pillar, [0] * len(AGGREGATE_COLUMNS))
+        for i, value in enumerate(rating_contributions(user_rating, manager_rating)):
+            totals[i] += value
+    
+    return aggregates
+
+def pillar_score(rating_sum, rating_count):
+    """Convert a 0-4 rating sum and count into a 0-100 pillar score"""
+    return (rating_sum / rating_count) * 25 if rating_count else 0
@@ -0,0 +1,56 @@
+"""
+Asyncio front-end for Database.
+
+AsyncDatabase exposes every public Database method as a coroutine that runs
+the blocking SQLite (and bcrypt) work on a dedicated thread pool, so callers
+can overlap independent queries with asyncio.gather. It works the same from
+a Streamlit page (through asyncio.run) and from a headless asyncio server.
+"""
+
+import asyncio
+import functools
+import inspect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from database import Database
+
+class AsyncDatabase:
+    """Coroutine versions of the Database methods, executed off the event loop"""
+    
+    # Executor shared by every instance that does not bring its own
+    _shared_executor = None
+    _executor_lock = threading.Lock()
+    
+    def __init__(self, db_path="app.db", shard_count=None, replica_staleness=None, signed_sessions=None, executor=None):
+        self.db = Database(db_path, shard_count=shard_count, replica_staleness=replica_staleness,
+                           signed_sessions=signed_sessions)
+        self._executor = executor or self._get_shared_executor()
+    
+    @classmethod
+    def _get_shared_executor(cls, max_workers=8):
+        """Return the process-wide database executor, creating it on first use"""
+        with cls._executor_lock:
+            if cls._shared_executor is None:
+                cls._shared_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='async-db')
+            return cls._shared_executor
+    
+    async def run(self, function, *args, **kwargs):
+        """Run any blocking callable on the database executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+def _make_async_method(name):
+    """Build the coroutine wrapper of one Database method"""
+    method = getattr(Database, name)
+    
+    @functools.wraps(method)
+    async def async_method(self, *args, **kwargs):
+        return await self.run(getattr(self.db, name), *args, **kwargs)
+    
+    return async_method
+
+# Mirror the public Database surface so both classes stay in sync automatically
+for _name, _ in inspect.getmembers(Database, inspect.isfunction):
+    if not _name.startswith('_'):
+        setattr(AsyncDatabase, _name, _make_async_method(_name))
@@ -1,272 +1,771 @@
 import sqlite3
-import bcrypt
-from datetime import datetime, timedelta
 import secrets
 import string
-import json
 import hashlib
+import heapq
+import hmac
+import itertools
+import logging
+import os
+import queue
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from migrations import run_migrations
+from password_hashing import get_login_throttle, get_password_hasher, temp_password_digest
+from query_monitor import get_query_monitor
+from adti_types import to_adti_type_code
+from answer_encoding import MAX_OPTIONS, decode_option_masks, encode_answers, encode_options
+from ask_scoring import AGGREGATE_COLUMNS, aggregate_answers, load_question_pillars, pillar_score, rating_contributions
+from session_cache import get_session_cache
+from session_tokens import RevocationList, SessionTokenSigner, is_signed_token, user_revocation_id
+from timestamps import MS_PER_DAY, MS_PER_MONTH, MS_PER_WEEK, now_ms, to_epoch_ms
+
+# Number of database files per-user data is spread across (1 disables sharding)
+SHARD_COUNT_ENV = 'DS_EVAL_DB_SHARDS'
+
+# Seconds an admin analytics read may lag behind the live database (0 reads it directly)
+REPLICA_STALENESS_ENV = 'DS_EVAL_REPLICA_STALENESS'
+
+# Sessions expire after this long without activity
+SESSION_TTL_MS = MS_PER_DAY
+
+# A validated session's expiry is only rewritten once less than this fraction of SESSION_TTL_MS
+# remains, so idle sessions still expire between fraction * TTL and TTL after their last use
+SESSION_REFRESH_FRACTION_ENV = 'DS_EVAL_SESSION_REFRESH_FRACTION'
+
+# Set to "signed" to issue HMAC-signed session tokens that validate without a database read
+SESSION_TOKENS_ENV = 'DS_EVAL_SESSION_TOKENS'
+
+# Signing key of signed session tokens; without it a random key is kept in app_settings
+SESSION_SECRET_ENV = 'DS_EVAL_SESSION_SECRET'
+
+# Test result ids of shard k start above k * SHARD_ID_SPAN, so an id alone locates its shard
+SHARD_ID_SPAN = 10 ** 12
+
+# Per-result tables moved to the archive, with the column holding the test result id
+ARCHIVED_TABLES = (
+    ('test_results', 'id'),
+    ('ask_test_answers', 'test_result_id'),
+    ('ask_pillar_scores', 'test_result_id'),
+    ('adti_type_scores', 'test_result_id'),
+)
+
+# Per-result tables in the order their rows are deleted: children first (evaluation progress after the
+# answers whose triggers update it), test results last
+RESULT_REMOVAL_ORDER = (*reversed(ARCHIVED_TABLES[1:]), ('ask_evaluation_progress', 'test_result_id'),
+                        ARCHIVED_TABLES[0])
+
+class ConnectionManager:
+    """Process-wide pool of long-lived SQLite connections for one database file"""
+    
+    _managers = {}
+    _managers_lock = threading.Lock()
+    
+    def __init__(self, db_path, pool_size=8, cache_size_kb=16384, mmap_size=256 * 1024 * 1024, read_only=False):
+        self.db_path = db_path
+        self.read_only = read_only
+        self.pool_size = pool_size
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+        self._idle = queue.LifoQueue()
+        self._retired = False
+    
+    @classmethod
+    def for_path(cls, db_path):
+        """Return the shared manager for a database file, creating it on first use"""
+        key = os.path.abspath(db_path)
+        with cls._managers_lock:
+            manager = cls._managers.get(key)
+            if manager is None:
+                manager = cls(db_path)
+                cls._managers[key] = manager
+            return manager
+    
+    def _connect(self):
+        """Open a connection and apply the performance pragmas"""
+        if self.read_only:
+            uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, timeout=30, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{self.cache_size_kb}')
+        conn.execute(f'PRAGMA mmap_size={self.mmap_size}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+    
+    @contextmanager
+    def connection(self):
+        """Check a connection out of the pool and return it afterwards"""
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            # Keep at most pool_size idle connections around, and none once the pool is retired
+            if not self._retired and self._idle.qsize() < self.pool_size:
+                self._idle.put(conn)
+            else:
+                conn.close()
+    
+    @contextmanager
+    def cursor(self, immediate=False, attach=None):
+        """Yield a cursor whose work is committed on success and rolled back on error"""
+        # attach maps schema names to database files that are attached for this cursor only
+        attach = attach or {}
+        with self.connection() as conn:
+            for schema, path in attach.items():
+                conn.execute(f'ATTACH DATABASE ? AS {schema}', (path,))
+            
+            # Statement timings feed the query monitor (admin "Desempenho" tab, slow-query log)
+            cursor = get_query_monitor().wrap(conn.cursor())
+            try:
+                # Take the write lock up front so multi-statement writes cannot fail
+                # halfway through on a read-to-write lock upgrade
+                if immediate:
+                    cursor.execute('BEGIN IMMEDIATE')
+                yield cursor
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+                # Pooled connections go back without the attached files
+                for schema in attach:
+                    conn.execute(f'DETACH DATABASE {schema}')
+    
+    def close_all(self):
+        """Close every idle connection (used by tests and shutdown hooks)"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+    
+    def retire(self):
+        """Close every idle connection and close checked-out ones when they come back"""
+        self._retired = True
+        self.close_all()
+
+class SnapshotReplica:
+    """Read-only copy of one database file, refreshed with the SQLite online backup API by a background thread"""
+    
+    _replicas = {}
+    _replicas_lock = threading.Lock()
+    
+    def __init__(self, source, max_staleness):
+        self.source = source
+        self.max_staleness = max_staleness
+        root, ext = os.path.splitext(source.db_path)
+        self.path = f"{root}.replica{ext or '.db'}"
+        self.taken_at = None
+        self._pool = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+    
+    @classmethod
+    def for_source(cls, source, max_staleness):
+        """Return the shared replica of a connection manager's file, creating it on first use"""
+        key = os.path.abspath(source.db_path)
+        with cls._replicas_lock:
+            replica = cls._replicas.get(key)
+            if replica is None:
+                replica = cls(source, max_staleness)
+                cls._replicas[key] = replica
+            replica.max_staleness = max_staleness
+            return replica
+    
+    def pool(self):
+        """Connection manager on the current snapshot, never waiting for a refresh once one exists"""
+        if self._pool is None:
+            # Only the very first read of a process waits for a snapshot
+            with self._lock:
+                if self._pool is None:
+                    self.refresh()
+        
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._refresh_loop, name='snapshot-replica', daemon=True)
+                    self._thread.start()
+        return self._pool
+    
+    def _refresh_loop(self):
+        """Take a new snapshot every max_staleness seconds, or sooner when invalidated"""
+        while True:
+            self._wake.wait(self.max_staleness)
+            self._wake.clear()
+            try:
+                self.refresh()
+            except sqlite3.Error:
+                # Keep serving the previous snapshot and try again on the next round
+                logging.getLogger('ds_eval.replica').exception("Snapshot of %s failed", self.source.db_path)
+    
+    def refresh(self):
+        """Take a new snapshot and swap it in"""
+        taken_at = now_ms()
+        
+        # Copy into a scratch file unique to this refresh, so processes refreshing at once never share one
+        directory, name = os.path.split(os.path.abspath(self.path))
+        fd, scratch_path = tempfile.mkstemp(prefix=f"{name}.", suffix='.tmp', dir=directory)
+        os.close(fd)
+        try:
+            scratch = sqlite3.connect(scratch_path)
+            try:
+                with self.source.connection() as conn:
+                    conn.backup(scratch)
+                # Read-only connections cannot open WAL files without their -shm sidecar
+                scratch.execute('PRAGMA journal_mode=DELETE')
+            finally:
+                scratch.close()
+            os.replace(scratch_path, self.path)
+        except BaseException:
+            if os.path.exists(scratch_path):
+                os.remove(scratch_path)
+            raise
+        
+        # Connections still reading the old file finish their query, then are closed instead of pooled
+        previous, self._pool = self._pool, ConnectionManager(self.path, read_only=True)
+        if previous is not None:
+            previous.retire()
+        
+        self.taken_at = taken_at
+    
+    def invalidate(self):
+        """Take a new snapshot in the background now, instead of at the end of the period"""
+        self._wake.set()
 
 class Database:
-    def __init__(self, db_path="app.db"):
+    # Database files whose migrations already ran in this process
+    _initialized_paths = set()
+    _init_lock = threading.Lock()
+    
+    # Worker threads shared by every instance for cross-shard queries
+    _fan_out_executor = None
+    
+    # Session token signers and revocation lists, per catalog file
+    _token_signers = {}
+    _temp_password_keys = {}
+    _revocation_lists = {}
+    
+    # Sessions whose expiry a thread of this process is extending, so concurrent reruns write once
+    _refreshing_sessions = set()
+    _refreshing_lock = threading.Lock()
+    
+    def __init__(self, db_path="app.db", shard_count=None, replica_staleness=None, signed_sessions=None):
         self.db_path = db_path
+        self._pool = ConnectionManager.for_path(db_path)
+        
+        # Users, passwords and schema metadata stay in the catalog (db_path), while test
+        # results, answers and sessions are partitioned by user across the shard files.
+        # Shard 0 is the catalog itself, so turning sharding on leaves existing data in place.
+        if shard_count is None:
+            shard_count = int(os.environ.get(SHARD_COUNT_ENV, '1'))
+        self.shard_count = max(shard_count, 1)
+        self._shards = [self._pool] + [ConnectionManager.for_path(path) for path in self.shard_paths()[1:]]
+        
+        # Admin analytics can read from periodically refreshed snapshots instead of the live
+        # files, so heavy reports never hold locks that logins and submissions wait on
+        if replica_staleness is None:
+            replica_staleness = float(os.environ.get(REPLICA_STALENESS_ENV, '0'))
+        self.replica_staleness = replica_staleness
+        
+        if signed_sessions is None:
+            signed_sessions = os.environ.get(SESSION_TOKENS_ENV, '') == 'signed'
+        self.signed_sessions = signed_sessions
+        self.session_refresh_fraction = float(os.environ.get(SESSION_REFRESH_FRACTION_ENV, '0.9'))
+        
         self.init_database()
     
+    def _cursor(self, immediate=False):
+        """Context-managed cursor from the shared connection pool"""
+        return self._pool.cursor(immediate=immediate)
+    
+    def shard_paths(self):
+        """Return the database file of every shard, the catalog being shard 0"""
+        root, ext = os.path.splitext(self.db_path)
+        return [self.db_path] + [f"{root}.shard{index}{ext or '.db'}" for index in range(1, self.shard_count)]
+    
+    def archive_paths(self):
+        """Return the archive file holding the cold results of every shard"""
+        return [f"{os.path.splitext(path)[0]}.archive.db" for path in self.shard_paths()]
+    
     def init_database(self):
-        """Initialize the database with required tables"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Apply pending schema migrations and seed the admin user, once per process and file"""
+        for index, (path, pool) in enumerate(zip(self.shard_paths(), self._shards)):
+            if index == 0:
+                self._initialize_file(path, pool, self._ensure_admin_user)
+            else:
+                self._initialize_file(path, pool, lambda cursor, index=index: self._seed_shard_id_range(cursor, index))
+    
+    def _initialize_file(self, path, pool, seed=None):
+        """Migrate a database file and run its seed step, once per process"""
+        key = os.path.abspath(path)
+        if key in Database._initialized_paths:
+            return
+        
+        with Database._init_lock:
+            if key in Database._initialized_paths:
+                return
+            
+            # Shards and archives share the catalog schema and simply leave the catalog-only tables empty
+            with pool.connection() as conn:
+                run_migrations(conn)
+            
+            if seed is not None:
+                with pool.cursor() as cursor:
+                    seed(cursor)
+            
+            Database._initialized_paths.add(key)
+    
+    def _seed_shard_id_range(self, cursor, index):
+        """Start a new shard's test result ids at its SHARD_ID_SPAN offset"""
+        offset = index * SHARD_ID_SPAN
+        cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'test_results'", (offset,))
+        if cursor.rowcount == 0:
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('test_results', ?)", (offset,))
+    
+    def shard_for_username(self, username):
+        """Stable hash-based shard index assigned to a new user"""
+        digest = hashlib.blake2b(username.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big') % self.shard_count
+    
+    def _user_shard_index(self, username):
+        """Return the shard index holding a user's results and sessions"""
+        if self.shard_count == 1:
+            return 0
         
-        # Create users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                is_admin BOOLEAN DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create passwords table for temporary passwords
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS temp_passwords (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL,
-                password TEXT NOT NULL,
-                generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                expires_at TIMESTAMP NOT NULL,
-                is_used BOOLEAN DEFAULT 0,
-                FOREIGN KEY (username) REFERENCES users (username)
-            )
-        ''')
-        
-        # Create test results table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS test_results (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL,
-                test_type TEXT NOT NULL,
-                score INTEGER,
-                answers TEXT,
-                completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (username) REFERENCES users (username)
-            )
-        ''')
-        
-        # Create ASK test answers table for detailed tracking
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS ask_test_answers (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                test_result_id INTEGER NOT NULL,
-                question_id INTEGER NOT NULL,
-                selected_options TEXT,
-                user_rating INTEGER,
-                user_notes TEXT,
-                manager_rating INTEGER,
-                manager_notes TEXT,
-                evaluated_by TEXT,
-                evaluated_at TIMESTAMP,
-                FOREIGN KEY (test_result_id) REFERENCES test_results (id),
-                FOREIGN KEY (evaluated_by) REFERENCES users (username)
-            )
-        ''')
-        
-        # Add user_notes column if it doesn't exist (migration)
-        try:
-            cursor.execute('SELECT user_notes FROM ask_test_answers LIMIT 1')
-        except sqlite3.OperationalError:
-            # Column doesn't exist, add it
-            cursor.execute('ALTER TABLE ask_test_answers ADD COLUMN user_notes TEXT')
-            print("Added user_notes column to ask_test_answers table")
+        # Users keep the shard recorded at creation, so renames never move their data
+        with self._cursor() as cursor:
+            cursor.execute('SELECT shard FROM users WHERE username = ?', (username,))
+            row = cursor.fetchone()
         
-        # Create sessions table for persistent login
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS user_sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_token TEXT UNIQUE NOT NULL,
-                username TEXT NOT NULL,
-                is_admin BOOLEAN DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                expires_at TIMESTAMP NOT NULL,
-                FOREIGN KEY (username) REFERENCES users (username)
-            )
-        ''')
-        
-        # Create admin user if not exists
-        cursor.execute('SELECT * FROM users WHERE username = ?', ('admin',))
-        if not cursor.fetchone():
-            admin_password = bcrypt.hashpw('admin123'.encode('utf-8'), bcrypt.gensalt())
-            cursor.execute('INSERT INTO users (username, password_hash, is_admin) VALUES (?, ?, ?)',
-                         ('admin', admin_password.decode('utf-8'), True))
+        return row[0] if row else self.shard_for_username(username)
+    
+    def _user_shard(self, username):
+        """Connection manager of the shard holding a user's results and sessions"""
+        return self._shards[self._user_shard_index(username)]
+    
+    def _result_shard(self, test_result_id):
+        """Connection manager of the shard holding a test result"""
+        index = int(test_result_id) // SHARD_ID_SPAN
+        return self._shards[index] if index < self.shard_count else self._pool
+    
+    def _session_shard(self, session_token):
+        """Connection manager of the shard holding a session, read from the token prefix"""
+        prefix, separator, _ = session_token.partition('.')
+        if separator and prefix.isdigit() and int(prefix) < self.shard_count:
+            return self._shards[int(prefix)]
+        return self._pool
+    
+    def _read_pool(self, shard):
+        """Connection manager for admin analytics reads: the shard's snapshot when replicas are on"""
+        if not self.replica_staleness:
+            return shard
+        return SnapshotReplica.for_source(shard, self.replica_staleness).pool()
+    
+    def _invalidate_replicas(self, shards=None):
+        """Start a background refresh of the written shards' replicas; reads see the old snapshot until it ends"""
+        if self.replica_staleness:
+            for shard in self._shards if shards is None else shards:
+                SnapshotReplica.for_source(shard, self.replica_staleness).invalidate()
+    
+    def get_replica_taken_at(self):
+        """Epoch ms of the catalog snapshot admin analytics read from, or None when reading live data"""
+        if not self.replica_staleness:
+            return None
+        return SnapshotReplica.for_source(self._pool, self.replica_staleness).taken_at
+    
+    def _archive_pool(self, shard, create=False):
+        """Connection manager of a shard's archive file, or None while nothing was archived there"""
+        path = self.archive_paths()[self._shards.index(shard)]
+        if not create and not os.path.exists(path):
+            return None
         
-        conn.commit()
-        conn.close()
+        pool = ConnectionManager.for_path(path)
+        self._initialize_file(path, pool)
+        return pool
     
-    def verify_user(self, username, password):
-        """Verify user login with either permanent or temporary password"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _on_result_tier(self, shard, operation):
+        """Run operation(pool) on a shard's hot tables, then on its archive if that found nothing"""
+        result = operation(shard)
+        if not result:
+            archive = self._archive_pool(shard)
+            if archive is not None:
+                return operation(archive)
+        return result
+    
+    def _tiered_select(self, columns, table, condition, archived):
+        """SELECT from a hot table, or from the hot and archived tables combined with UNION ALL"""
+        # Callers repeat their parameters once per arm when archived
+        select = f'SELECT {columns} FROM {{schema}}.{table} WHERE {condition}'
+        if not archived:
+            return select.format(schema='main')
+        return f"{select.format(schema='main')} UNION ALL {select.format(schema='archive')}"
+    
+    def _fan_out(self, query, items=None):
+        """Run query(item) for every shard (or given item) in parallel and return the results in order"""
+        items = self._shards if items is None else list(items)
+        if len(items) == 1:
+            return [query(items[0])]
         
-        # Check permanent password first
-        cursor.execute('SELECT password_hash, is_admin FROM users WHERE username = ?', (username,))
-        user = cursor.fetchone()
+        with Database._init_lock:
+            if Database._fan_out_executor is None:
+                Database._fan_out_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='db-shard')
         
-        if user:
-            password_hash, is_admin = user
-            if bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8')):
-                conn.close()
+        return list(Database._fan_out_executor.map(query, items))
+    
+    def _execute_on_shard(self, cursor, shard, sql, params):
+        """Run a statement in the catalog transaction, or in its own transaction on another shard"""
+        if shard is self._pool:
+            cursor.execute(sql, params)
+        else:
+            with shard.cursor() as shard_cursor:
+                shard_cursor.execute(sql, params)
+    
+    def _ensure_admin_user(self, cursor):
+        """Create the default admin user if it does not exist"""
+        cursor.execute('SELECT 1 FROM users WHERE username = ?', ('admin',))
+        if not cursor.fetchone():
+            admin_password = get_password_hasher().hash_password('admin123')
+            cursor.execute('INSERT INTO users (username, password_hash, is_admin) VALUES (?, ?, ?)',
+                         ('admin', admin_password, True))
+    
+    def verify_user(self, username, password, client_address=None):
+        """Verify user login with either permanent or temporary password"""
+        # Turn away usernames and addresses with too many recent failures before any hashing;
+        # raises LoginThrottledError, and HashingBusyError when the hashing pool is saturated
+        throttle = get_login_throttle()
+        throttle.check(username, client_address)
+        
+        with self._cursor() as cursor:
+            cursor.execute('SELECT password_hash, is_admin, credential_type FROM users WHERE username = ?', (username,))
+            user = cursor.fetchone()
+            
+            # Temporary passwords are keyed digests, checked without bcrypt
+            cursor.execute('''
+                SELECT password FROM temp_passwords
+                WHERE username = ? AND expires_at > ? AND is_used = 0
+            ''', (username, now_ms()))
+            temp_digests = [row[0] for row in cursor.fetchall()]
+        
+        if temp_digests:
+            digest = temp_password_digest(self._temp_password_key(), password)
+            if any(hmac.compare_digest(digest, stored) for stored in temp_digests):
+                throttle.record_success(username)
+                return True, False  # Temporary user is not admin
+        
+        # Only users with a permanent password pay for a bcrypt check, on the hashing pool
+        if user and user[2] == 'password':
+            password_hash, is_admin, _ = user
+            if get_password_hasher().check_password(password, password_hash):
+                throttle.record_success(username)
                 return True, is_admin
         
-        # Check temporary password
-        cursor.execute('''
-            SELECT username FROM temp_passwords 
-            WHERE username = ? AND password = ? AND expires_at > ? AND is_used = 0
-        ''', (username, password, datetime.now()))
-        
-        temp_user = cursor.fetchone()
-        conn.close()
-        
-        if temp_user:
-            return True, False  # Temporary user is not admin
+        throttle.record_failure(username, client_address)
         return False, False
     
     def get_all_users(self):
         """Get all users for admin view"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT u.username, u.created_at, tp.password, tp.expires_at, tp.is_used
-            FROM users u
-            LEFT JOIN temp_passwords tp ON u.username = tp.username
-            WHERE u.is_admin = 0
-            ORDER BY u.username
-        ''')
+        with self._read_pool(self._pool).cursor() as cursor:
+            cursor.execute('''
+                SELECT u.username, u.created_at, tp.id IS NOT NULL, tp.expires_at, tp.is_used
+                FROM users u
+                LEFT JOIN temp_passwords tp ON u.username = tp.username
+                WHERE u.is_admin = 0
+                ORDER BY u.username
+            ''')
+            
+            return cursor.fetchall()
+    
+    def get_users_page(self, after_username=None, limit=50):
+        """Get one page of non-admin users ordered by username, plus the cursor of the next page"""
+        with self._read_pool(self._pool).cursor() as cursor:
+            cursor.execute('''
+                SELECT u.username, u.created_at, tp.id IS NOT NULL, tp.expires_at, tp.is_used
+                FROM users u
+                LEFT JOIN temp_passwords tp ON u.username = tp.username
+                WHERE u.is_admin = 0 AND u.username > ?
+                ORDER BY u.username
+                LIMIT ?
+            ''', (after_username or '', limit + 1))
+            
+            users = cursor.fetchall()
         
-        users = cursor.fetchall()
-        conn.close()
-        return users
+        next_cursor = users[limit - 1][0] if len(users) > limit else None
+        return users[:limit], next_cursor
     
     def generate_temp_password(self, username):
         """Generate a temporary password for a user"""
-        # Generate a random password
-        alphabet = string.ascii_letters + string.digits
-        password = ''.join(secrets.choice(alphabet) for i in range(8))
+        password = self._random_temp_password()
         
         # Set expiration to 1 week from now
-        expires_at = datetime.now() + timedelta(weeks=1)
-        
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        expires_at = now_ms() + MS_PER_WEEK
         
-        # Delete any existing password for this user
-        cursor.execute('DELETE FROM temp_passwords WHERE username = ?', (username,))
+        digest = temp_password_digest(self._temp_password_key(), password)
         
-        # Insert new temporary password
-        cursor.execute('''
-            INSERT INTO temp_passwords (username, password, expires_at)
-            VALUES (?, ?, ?)
-        ''', (username, password, expires_at))
-        
-        conn.commit()
-        conn.close()
+        with self._cursor() as cursor:
+            # Delete any existing password for this user
+            cursor.execute('DELETE FROM temp_passwords WHERE username = ?', (username,))
+            
+            # Insert new temporary password; only its digest is stored, so this is the one chance to show it
+            cursor.execute('''
+                INSERT INTO temp_passwords (username, password, expires_at)
+                VALUES (?, ?, ?)
+            ''', (username, digest, expires_at))
         
+        self._invalidate_replicas([self._pool])
         return password
     
+    @staticmethod
+    def _random_temp_password():
+        """Random 8-character temporary password"""
+        alphabet = string.ascii_letters + string.digits
+        return ''.join(secrets.choice(alphabet) for i in range(8))
+    
     def create_user(self, username):
         """Create a new user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+        # Users without a permanent password log in with temporary passwords only
         try:
-            # Create user with a dummy password (they'll use temp password)
-            dummy_password = bcrypt.hashpw('dummy'.encode('utf-8'), bcrypt.gensalt())
-            cursor.execute('INSERT INTO users (username, password_hash) VALUES (?, ?)',
-                         (username, dummy_password.decode('utf-8')))
-            conn.commit()
-            conn.close()
+            with self._cursor() as cursor:
+                cursor.execute('''
+                    INSERT INTO users (username, password_hash, credential_type, shard)
+                    VALUES (?, '', 'temporary', ?)
+                ''', (username, self.shard_for_username(username)))
+            self._invalidate_replicas([self._pool])
             return True
         except sqlite3.IntegrityError:
-            conn.close()
             return False
     
+    def create_users(self, rows):
+        """Create many users in one transaction, returning the created users and the rows that failed"""
+        # Rows are (line, username, password or None); returns ([(username, temp_password, expires_at)],
+        # [(line, username, reason)]), with no temporary password for users given a permanent one
+        rows = list(rows)
+        failures = []
+        
+        # Skip usernames that already exist before spending any hashing on them
+        existing = set()
+        with self._cursor() as cursor:
+            usernames = [username for _, username, _ in rows]
+            for start in range(0, len(usernames), 500):
+                chunk = usernames[start:start + 500]
+                cursor.execute(f"SELECT username FROM users WHERE username IN ({','.join('?' * len(chunk))})", chunk)
+                existing.update(row[0] for row in cursor.fetchall())
+        
+        new_rows = []
+        for line, username, password in rows:
+            if username in existing:
+                failures.append((line, username, "Username already exists"))
+            else:
+                new_rows.append((line, username, password))
+        
+        # Permanent passwords are bcrypt-hashed on the process pool; everyone else gets a temporary password
+        with_password = [(username, password) for _, username, password in new_rows if password]
+        password_hashes = dict(zip([username for username, _ in with_password],
+                                   get_password_hasher().hash_passwords(password for _, password in with_password)))
+        
+        key = self._temp_password_key()
+        expires_at = now_ms() + MS_PER_WEEK
+        created = []
+        with self._cursor(immediate=True) as cursor:
+            for line, username, password in new_rows:
+                shard = self.shard_for_username(username)
+                if password:
+                    credentials = (password_hashes[username], 'password')
+                else:
+                    temp_password = self._random_temp_password()
+                    credentials = ('', 'temporary')
+                
+                # Another admin may have created the username meanwhile; only that row fails
+                cursor.execute('''
+                    INSERT INTO users (username, password_hash, credential_type, shard)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (username) DO NOTHING
+                ''', (username, *credentials, shard))
+                if cursor.rowcount == 0:
+                    failures.append((line, username, "Username already exists"))
+                    continue
+                
+                if password:
+                    created.append((username, None, None))
+                else:
+                    cursor.execute('''
+                        INSERT INTO temp_passwords (username, password, expires_at)
+                        VALUES (?, ?, ?)
+                    ''', (username, temp_password_digest(key, temp_password), expires_at))
+                    created.append((username, temp_password, expires_at))
+        
+        self._invalidate_replicas([self._pool])
+        return created, failures
+    
     def delete_user(self, username):
         """Delete a user and all associated data"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         try:
-            # Delete user's test results first
-            cursor.execute('DELETE FROM test_results WHERE username = ?', (username,))
-            
-            # Delete user's temporary passwords
-            cursor.execute('DELETE FROM temp_passwords WHERE username = ?', (username,))
-            
-            # Delete the user (only if not admin)
-            cursor.execute('DELETE FROM users WHERE username = ? AND is_admin = 0', (username,))
-            user_deleted = cursor.rowcount
+            shard = self._user_shard(username)
+            archive = self._archive_pool(shard)
             
-            # Commit the changes
-            conn.commit()
-            conn.close()
+            # The user's shard and archive are attached to one catalog connection, so every row goes in a
+            # single transaction (in WAL mode each file commits atomically, the set of files not quite)
+            data_schema = 'main' if shard is self._pool else 'shard'
+            attach = {} if shard is self._pool else {'shard': shard.db_path}
+            if archive is not None:
+                attach['archive'] = archive.db_path
             
-            # Return True if user was actually deleted
-            return user_deleted > 0
+            now = now_ms()
+            with self._pool.cursor(immediate=True, attach=attach) as cursor:
+                # Only non-admin users can be deleted
+                cursor.execute('SELECT 1 FROM users WHERE username = ? AND is_admin = 0', (username,))
+                if cursor.fetchone() is None:
+                    return False
+                
+                # Delete user's test results and every per-result row, archived ones included; the
+                # ask_test_answers triggers drop their notes from the full-text index
+                for schema in filter(None, (data_schema, 'archive' if archive is not None else None)):
+                    for table, key in RESULT_REMOVAL_ORDER:
+                        cursor.execute(f'''
+                            DELETE FROM {schema}.{table}
+                            WHERE {key} IN (SELECT id FROM {schema}.test_results WHERE username = ?)
+                        ''', (username,))
+                
+                # Log the user out everywhere: database sessions go, signed tokens issued so far are revoked
+                cursor.execute(f'DELETE FROM {data_schema}.user_sessions WHERE username = ?', (username,))
+                cursor.execute('''
+                    INSERT OR REPLACE INTO revoked_sessions (token_id, expires_at, revoked_at)
+                    VALUES (?, ?, ?)
+                ''', (user_revocation_id(username), now + SESSION_TTL_MS, now))
+                
+                # Delete user's temporary passwords
+                cursor.execute('DELETE FROM temp_passwords WHERE username = ?', (username,))
+                
+                # Delete the user
+                cursor.execute('DELETE FROM users WHERE username = ? AND is_admin = 0', (username,))
             
+            self._revocations().revoke_user(username, now, now + SESSION_TTL_MS)
+            get_session_cache().invalidate_user(username)
+            return True
+        
         except Exception as e:
-            conn.close()
             return False
+        finally:
+            self._invalidate_replicas()
     
     def update_user(self, old_username, new_username):
         """Update a user's username"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
         try:
-            # Check if new username already exists
-            cursor.execute('SELECT username FROM users WHERE username = ?', (new_username,))
-            if cursor.fetchone():
-                conn.close()
-                return False, "Username already exists"
-            
-            # Update username in users table
-            cursor.execute('UPDATE users SET username = ? WHERE username = ? AND is_admin = 0', 
-                         (new_username, old_username))
-            
-            if cursor.rowcount > 0:
-                # Update username in related tables
-                cursor.execute('UPDATE test_results SET username = ? WHERE username = ?', 
-                             (new_username, old_username))
-                cursor.execute('UPDATE temp_passwords SET username = ? WHERE username = ?', 
+            shard = self._user_shard(old_username)
+            archive = self._archive_pool(shard)
+            with self._cursor() as cursor:
+                # Check if new username already exists
+                cursor.execute('SELECT username FROM users WHERE username = ?', (new_username,))
+                if cursor.fetchone():
+                    return False, "Username already exists"
+                
+                # Update username in users table
+                cursor.execute('UPDATE users SET username = ? WHERE username = ? AND is_admin = 0',
                              (new_username, old_username))
                 
-                conn.commit()
-                conn.close()
-                return True, "User updated successfully"
-            else:
-                conn.close()
-                return False, "User not found or is admin"
+                if cursor.rowcount > 0:
+                    # Update username in related tables
+                    for tier in filter(None, (shard, archive)):
+                        self._execute_on_shard(cursor, tier, 'UPDATE test_results SET username = ? WHERE username = ?',
+                                               (new_username, old_username))
+                    cursor.execute('UPDATE temp_passwords SET username = ? WHERE username = ?',
+                                 (new_username, old_username))
+                    return True, "User updated successfully"
+                else:
+                    return False, "User not found or is admin"
         except Exception as e:
-            conn.close()
             return False, str(e)
+        finally:
+            self._invalidate_replicas()
     
     def save_test_result(self, username, test_type, score, answers):
         """Save test results"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO test_results (username, test_type, score, answers)
-            VALUES (?, ?, ?, ?)
-        ''', (username, test_type, score, str(answers)))
-        
-        conn.commit()
-        conn.close()
+        with self._user_shard(username).cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO test_results (username, test_type, score, answers)
+                VALUES (?, ?, ?, ?)
+            ''', (username, test_type, score, encode_answers(answers)))
     
     def save_adti_detailed_result(self, username, primary_type, all_scores, answers):
         """Save detailed ADTI test results with all personality scores"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._user_shard(username).cursor(immediate=True) as cursor:
+            return self._insert_adti_result(cursor, username, primary_type, all_scores, answers)
+    
+    def save_ask_detailed_result(self, username, career_level, pillar_scores, answers,
+                                 user_pillar_scores=None, manager_pillar_scores=None):
+        """Save detailed ASK test results with career level, pillar scores, and answers"""
+        with self._user_shard(username).cursor(immediate=True) as cursor:
+            return self._insert_ask_result(cursor, username, career_level, pillar_scores, answers,
+                                           user_pillar_scores, manager_pillar_scores)
+    
+    def bulk_import_results(self, results, chunk_size=500):
+        """Stream ASK/ADTI result dicts into the database, one transaction per chunk"""
+        # Each item holds a 'test_type' ('ASK' or 'ADTI'), the keyword arguments of the
+        # matching save_*_detailed_result method and an optional 'completed_at'
+        # (datetime, ISO string or epoch milliseconds)
+        results = iter(results)
+        user_shards = {}
+        imported = 0
+        
+        while True:
+            chunk = list(itertools.islice(results, chunk_size))
+            if not chunk:
+                break
+            
+            # Validate the whole chunk before any shard commits part of it
+            for result in chunk:
+                if result.get('test_type') not in ('ASK', 'ADTI'):
+                    raise ValueError(f"Unsupported test type for import: {result.get('test_type')!r}")
+                if result['test_type'] == 'ADTI':
+                    to_adti_type_code(result['primary_type'])
+            
+            # Group the chunk by shard and write every group in parallel
+            groups = {}
+            for result in chunk:
+                username = result['username']
+                if username not in user_shards:
+                    user_shards[username] = self._user_shard_index(username)
+                groups.setdefault(user_shards[username], []).append(result)
+            
+            self._fan_out(lambda index: self._import_results(self._shards[index], groups[index]), groups)
+            
+            imported += len(chunk)
+        
+        return imported
+    
+    def _import_results(self, shard, results):
+        """Insert validated import items into one shard in a single transaction"""
+        with shard.cursor(immediate=True) as cursor:
+            for result in results:
+                if result['test_type'] == 'ASK':
+                    self._insert_ask_result(
+                        cursor, result['username'], result.get('career_level'), result['pillar_scores'],
+                        result.get('answers', {}), result.get('user_pillar_scores'),
+                        result.get('manager_pillar_scores'), result.get('completed_at'))
+                else:
+                    self._insert_adti_result(
+                        cursor, result['username'], result['primary_type'], result['all_scores'],
+                        result.get('answers', {}), result.get('completed_at'))
+    
+    def _insert_adti_result(self, cursor, username, primary_type, all_scores, answers, completed_at=None):
+        """Insert an ADTI result and its type scores using an open cursor"""
+        # Results always store type codes; full type names are mapped and anything else rejected
+        primary_type = to_adti_type_code(primary_type)
+        all_scores = {to_adti_type_code(code): type_score for code, type_score in all_scores.items()}
         
         # Store the primary type as the main score
         score = all_scores.get(primary_type, 0)
@@ -279,17 +778,26 @@ class Database:
         }
         
         cursor.execute('''
-            INSERT INTO test_results (username, test_type, score, answers)
-            VALUES (?, ?, ?, ?)
-        ''', (username, 'ADTI', score, json.dumps(detailed_result)))
+            INSERT INTO test_results (username, test_type, score, answers, primary_type, completed_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (username, 'ADTI', score, encode_answers(detailed_result), primary_type,
+              to_epoch_ms(completed_at) or now_ms()))
+        
+        test_result_id = cursor.lastrowid
+        
+        # Save the per-type scores for profile and analytics queries
+        cursor.executemany('''
+            INSERT INTO adti_type_scores (test_result_id, type_code, score)
+            VALUES (?, ?, ?)
+        ''', [(test_result_id, code, type_score) for code, type_score in all_scores.items()])
         
-        conn.commit()
-        conn.close()
+        return test_result_id
     
-    def save_ask_detailed_result(self, username, career_level, pillar_scores, answers):
-        """Save detailed ASK test results with career level, pillar scores, and answers"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _insert_ask_result(self, cursor, username, career_level, pillar_scores, answers,
+                           user_pillar_scores=None, manager_pillar_scores=None, completed_at=None):
+        """Insert an ASK result, its pillar scores and its answers using an open cursor"""
+        user_pillar_scores = user_pillar_scores or {}
+        manager_pillar_scores = manager_pillar_scores or {}
         
         # Create detailed result object with separate scores
         detailed_result = {
@@ -301,397 +809,682 @@ class Database:
         # Calculate overall score (average of pillar scores)
         overall_score = sum(pillar_scores.values()) / len(pillar_scores) if pillar_scores else 0
         
-        # Serialize to JSON
-        answers_json = json.dumps(detailed_result)
-        
-        # Save to database
         cursor.execute('''
-            INSERT INTO test_results (username, test_type, score, answers, completed_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (username, "ASK", overall_score, answers_json, datetime.now()))
+            INSERT INTO test_results (username, test_type, score, answers, completed_at, career_level)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (username, "ASK", overall_score, encode_answers(detailed_result), to_epoch_ms(completed_at) or now_ms(),
+              career_level))
         
         # Get the test result ID
         test_result_id = cursor.lastrowid
         
-        # Save individual answers for manager evaluation
-        for question_id, answer_data in answers.items():
-            selected_options = json.dumps(answer_data.get('selected_options', []))
-            user_rating = answer_data.get('user_rating')
-            user_notes = answer_data.get('user_notes', '')
-            manager_rating = answer_data.get('manager_rating')
-            manager_notes = answer_data.get('manager_notes', '')
-            evaluated_by = answer_data.get('evaluated_by')
-            evaluated_at = answer_data.get('evaluated_at')
-            
-            cursor.execute('''
-                INSERT INTO ask_test_answers 
-                (test_result_id, question_id, selected_options, user_rating, user_notes,
-                 manager_rating, manager_notes, evaluated_by, evaluated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (test_result_id, question_id, selected_options, user_rating, user_notes,
-                  manager_rating, manager_notes, evaluated_by, evaluated_at))
-        
-        conn.commit()
-        conn.close()
+        # Save the per-pillar scores with their running rating aggregates
+        aggregates = aggregate_answers(
+            [(question_id, answer_data.get('user_rating'), answer_data.get('manager_rating'))
+             for question_id, answer_data in answers.items()],
+            load_question_pillars())
+        pillar_rows = []
+        for pillar in list(pillar_scores) + [p for p in aggregates if p not in pillar_scores]:
+            totals = aggregates.get(pillar, [0] * len(AGGREGATE_COLUMNS))
+            combined = pillar_scores.get(pillar, pillar_score(totals[4], totals[5]))
+            pillar_rows.append((test_result_id, pillar, user_pillar_scores.get(pillar),
+                                manager_pillar_scores.get(pillar), combined, *totals))
+        
+        cursor.executemany(f'''
+            INSERT INTO ask_pillar_scores
+            (test_result_id, pillar, user_score, manager_score, combined_score, {', '.join(AGGREGATE_COLUMNS)})
+            VALUES (?, ?, ?, ?, ?, {', '.join('?' for _ in AGGREGATE_COLUMNS)})
+        ''', pillar_rows)
+        
+        # Save individual answers for manager evaluation in a single batch
+        cursor.executemany('''
+            INSERT INTO ask_test_answers
+            (test_result_id, question_id, selected_options, user_rating, user_notes,
+             manager_rating, manager_notes, evaluated_by, evaluated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(test_result_id, question_id, encode_options(answer_data.get('selected_options', [])),
+               answer_data.get('user_rating'), answer_data.get('user_notes', ''),
+               answer_data.get('manager_rating'), answer_data.get('manager_notes', ''),
+               answer_data.get('evaluated_by'), answer_data.get('evaluated_at'))
+              for question_id, answer_data in answers.items()])
         
         return test_result_id
     
     def get_user_test_results(self, username):
-        """Get test results for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Get test results for a user, archived ones included, newest first, without the detailed answer blobs"""
+        shard = self._user_shard(username)
+        archive = self._archive_pool(shard)
+        attach = {'archive': archive.db_path} if archive else None
+        
+        with shard.cursor(attach=attach) as cursor:
+            cursor.execute(f'''
+                {self._tiered_select('id, test_type, score, completed_at, career_level, primary_type',
+                                     'test_results', 'username = ?', archive)}
+                ORDER BY completed_at DESC
+            ''', (username,) * (2 if archive else 1))
+            
+            return cursor.fetchall()
+    
+    def get_user_test_results_page(self, username, test_type=None, after_completed_at=None, after_id=None, limit=20,
+                                   include_archived=False):
+        """Get one page of a user's results, newest first, plus the (completed_at, id) cursor of the next page"""
+        conditions = ['username = ?']
+        params = [username]
+        if test_type:
+            conditions.append('test_type = ?')
+            params.append(test_type)
+        if after_id is not None:
+            conditions.append('(completed_at, id) < (?, ?)')
+            params.extend([after_completed_at, after_id])
+        
+        select = self._tiered_select('id, test_type, score, completed_at, career_level, primary_type',
+                                     'test_results', ' AND '.join(conditions), archived=False)
+        
+        shard = self._user_shard(username)
+        with shard.cursor() as cursor:
+            cursor.execute(f'''
+                {select}
+                ORDER BY completed_at DESC, id DESC
+                LIMIT ?
+            ''', (*params, limit + 1))
+            
+            results = cursor.fetchall()
+        
+        # A user's archived results are all older than their hot ones, so the archive is only read once a page
+        # runs out of hot rows. It fills the page when paging on, asking for full history or having no hot rows;
+        # otherwise the first page only checks for archived rows, to hand out a cursor that pages into them
+        archive = self._archive_pool(shard) if len(results) <= limit else None
+        if archive is not None and (after_id is not None or include_archived or not results):
+            with archive.cursor() as cursor:
+                cursor.execute(f'''
+                    {select}
+                    ORDER BY completed_at DESC, id DESC
+                    LIMIT ?
+                ''', (*params, limit + 1 - len(results)))
+                
+                results += cursor.fetchall()
+        elif archive is not None:
+            with archive.cursor() as cursor:
+                cursor.execute(f'{select} LIMIT 1', params)
+                if cursor.fetchone() is not None:
+                    return results, (results[-1][3], results[-1][0])
+        
+        next_cursor = (results[limit - 1][3], results[limit - 1][0]) if len(results) > limit else None
+        return results[:limit], next_cursor
+    
+    def get_user_result_stats(self, username, include_archived=False):
+        """Get (total tests, average score, best score, ADTI tests) for a user, archived results only on request"""
+        def query(pool):
+            with pool.cursor() as cursor:
+                cursor.execute('''
+                    SELECT COUNT(*), COALESCE(SUM(score), 0), MAX(score), COALESCE(SUM(test_type = 'ADTI'), 0)
+                    FROM test_results
+                    WHERE username = ?
+                ''', (username,))
+                
+                return cursor.fetchone()
         
-        cursor.execute('''
-            SELECT test_type, score, completed_at, answers
-            FROM test_results
-            WHERE username = ?
-            ORDER BY completed_at DESC
-        ''', (username,))
+        shard = self._user_shard(username)
+        archive = self._archive_pool(shard) if include_archived else None
+        tiers = [query(pool) for pool in filter(None, (shard, archive))]
         
-        results = cursor.fetchall()
-        conn.close()
-        return results
+        total = sum(tier[0] for tier in tiers)
+        best_scores = [tier[2] for tier in tiers if tier[2] is not None]
+        return (total, sum(tier[1] for tier in tiers) / total if total else None,
+                max(best_scores) if best_scores else None, sum(tier[3] for tier in tiers))
     
-    def get_ask_test_for_evaluation(self, test_result_id):
-        """Get ASK test answers for manager evaluation"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get the main test result
-        cursor.execute('''
-            SELECT username, test_type, score, answers, completed_at
-            FROM test_results
-            WHERE id = ?
-        ''', (test_result_id,))
+    def get_ask_pillar_scores(self, test_result_id):
+        """Get (pillar, user_score, manager_score, combined_score) rows for an ASK result"""
+        def query(pool):
+            with pool.cursor() as cursor:
+                cursor.execute('''
+                    SELECT pillar, user_score, manager_score, combined_score
+                    FROM ask_pillar_scores
+                    WHERE test_result_id = ?
+                ''', (test_result_id,))
+                
+                return cursor.fetchall()
         
-        test_result = cursor.fetchone()
-        if not test_result:
-            conn.close()
-            return None
+        return self._on_result_tier(self._result_shard(test_result_id), query)
+    
+    def get_adti_type_scores(self, test_result_id):
+        """Get the personality type scores of an ADTI result as a code -> score dict"""
+        def query(pool):
+            with pool.cursor() as cursor:
+                cursor.execute('''
+                    SELECT type_code, score
+                    FROM adti_type_scores
+                    WHERE test_result_id = ?
+                    ORDER BY score DESC
+                ''', (test_result_id,))
+                
+                return dict(cursor.fetchall())
         
-        # Format the completed_at field
-        username, test_type, score, answers, completed_at = test_result
+        return self._on_result_tier(self._result_shard(test_result_id), query)
+    
+    def get_ask_option_frequencies(self, question_id, width=MAX_OPTIONS):
+        """Count how often each option of an ASK question was selected: (answers, per-option counts)"""
+        def query(shard):
+            with self._read_pool(shard).cursor() as cursor:
+                cursor.execute('SELECT selected_options FROM ask_test_answers WHERE question_id = ?', (question_id,))
+                return [row[0] for row in cursor.fetchall()]
+        
+        masks = [mask for shard_masks in self._fan_out(query) for mask in shard_masks]
+        return len(masks), decode_option_masks(masks, width).sum(axis=0)
+    
+    def search_notes(self, query, limit=20):
+        """Full-text search of candidate and manager notes, best matches first"""
+        # Every word is matched as a quoted term, so punctuation typed by the user is never FTS syntax;
+        # matches are marked with [ ] in the snippets, which are meant to be shown as plain text
+        terms = [f'"{term}"' for term in re.findall(r'\w+', query)]
+        if not terms:
+            return []
+        
+        def search(pool):
+            with pool.cursor() as cursor:
+                cursor.execute('''
+                    SELECT a.test_result_id, tr.username, tr.completed_at, a.question_id,
+                           snippet(ask_notes_fts, 0, '[', ']', '…', 12),
+                           snippet(ask_notes_fts, 1, '[', ']', '…', 12),
+                           ask_notes_fts.rank
+                    FROM ask_notes_fts
+                    JOIN ask_test_answers a ON a.id = ask_notes_fts.rowid
+                    JOIN test_results tr ON tr.id = a.test_result_id
+                    WHERE ask_notes_fts MATCH ?
+                    ORDER BY ask_notes_fts.rank
+                    LIMIT ?
+                ''', (' '.join(terms), limit))
+                
+                return cursor.fetchall()
         
-        # Handle completed_at formatting
-        if isinstance(completed_at, str):
-            try:
-                # Try to parse the datetime string
-                from datetime import datetime
-                parsed_date = datetime.fromisoformat(completed_at.replace('Z', '+00:00'))
-                formatted_date = parsed_date.strftime('%Y-%m-%d %H:%M')
-            except:
-                formatted_date = completed_at
-        else:
-            formatted_date = completed_at.strftime('%Y-%m-%d %H:%M') if hasattr(completed_at, 'strftime') else str(completed_at)
+        # Search every shard and archive, then merge on the bm25 rank (lower is better)
+        pools = [self._read_pool(shard) for shard in self._shards]
+        pools += filter(None, (self._archive_pool(shard) for shard in self._shards))
+        merged = heapq.merge(*self._fan_out(search, pools), key=lambda match: match[6])
+        return list(itertools.islice(merged, limit))
+    
+    def get_ask_test_for_evaluation(self, test_result_id):
+        """Get ASK test answers for manager evaluation"""
+        def query(pool):
+            with pool.cursor() as cursor:
+                # Get the main test result
+                cursor.execute('''
+                    SELECT username, test_type, score, answers, completed_at
+                    FROM test_results
+                    WHERE id = ?
+                ''', (test_result_id,))
+                
+                test_result = cursor.fetchone()
+                if not test_result:
+                    return None
+                
+                # Get individual answers (handle migration)
+                try:
+                    cursor.execute('''
+                        SELECT question_id, selected_options, user_rating, user_notes,
+                               manager_rating, manager_notes, evaluated_by, evaluated_at
+                        FROM ask_test_answers
+                        WHERE test_result_id = ?
+                        ORDER BY question_id
+                    ''', (test_result_id,))
+                except sqlite3.OperationalError:
+                    # Fallback for old database format
+                    cursor.execute('''
+                        SELECT question_id, selected_options, user_rating,
+                               manager_rating, manager_notes, evaluated_by, evaluated_at
+                        FROM ask_test_answers
+                        WHERE test_result_id = ?
+                        ORDER BY question_id
+                    ''', (test_result_id,))
+                
+                answers = cursor.fetchall()
+            
+            return {
+                'test_result': test_result,
+                'answers': answers
+            }
         
-        test_result = (username, test_type, score, answers, formatted_date)
+        return self._on_result_tier(self._result_shard(test_result_id), query)
+    
+    def get_all_ask_tests_for_evaluation(self, pending_only=False):
+        """Get ASK tests with their evaluation progress, newest first (completed_at in epoch ms)"""
+        pending_filter = 'AND COALESCE(p.evaluated, 0) < COALESCE(p.total, 0)' if pending_only else ''
+        
+        def query(shard):
+            with self._read_pool(shard).cursor() as cursor:
+                # Progress comes from the trigger-maintained summary table, one row per test
+                cursor.execute(f'''
+                    SELECT tr.id, tr.username, tr.score, tr.completed_at,
+                           COALESCE(p.total, 0) as total_questions,
+                           COALESCE(p.evaluated, 0) as evaluated_questions
+                    FROM test_results tr
+                    LEFT JOIN ask_evaluation_progress p ON p.test_result_id = tr.id
+                    WHERE tr.test_type = 'ASK' {pending_filter}
+                    ORDER BY tr.completed_at DESC, tr.id DESC
+                ''')
+                
+                return cursor.fetchall()
         
-        # Get individual answers (handle migration)
-        try:
-            cursor.execute('''
-                SELECT question_id, selected_options, user_rating, user_notes,
-                       manager_rating, manager_notes, evaluated_by, evaluated_at
-                FROM ask_test_answers
-                WHERE test_result_id = ?
-                ORDER BY question_id
-            ''', (test_result_id,))
-        except sqlite3.OperationalError:
-            # Fallback for old database format
-            cursor.execute('''
-                SELECT question_id, selected_options, user_rating,
-                       manager_rating, manager_notes, evaluated_by, evaluated_at
-                FROM ask_test_answers
-                WHERE test_result_id = ?
-                ORDER BY question_id
-            ''', (test_result_id,))
-        
-        answers = cursor.fetchall()
-        conn.close()
-        
-        return {
-            'test_result': test_result,
-            'answers': answers
-        }
+        # Each shard returns its tests sorted, so a merge keeps the global order
+        return list(heapq.merge(*self._fan_out(query), key=lambda test: (test[3], test[0]), reverse=True))
     
-    def get_all_ask_tests_for_evaluation(self):
-        """Get all ASK tests that need manager evaluation"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def get_ask_tests_for_evaluation_page(self, after_completed_at=None, after_id=None, limit=20, pending_only=False):
+        """Get one page of the ASK evaluation queue plus the (completed_at, id) cursor of the next page"""
+        conditions = ["tr.test_type = 'ASK'"]
+        params = []
+        if pending_only:
+            conditions.append('COALESCE(p.evaluated, 0) < COALESCE(p.total, 0)')
+        if after_id is not None:
+            conditions.append('(tr.completed_at, tr.id) < (?, ?)')
+            params.extend([after_completed_at, after_id])
+        
+        def query(shard):
+            with self._read_pool(shard).cursor() as cursor:
+                cursor.execute(f'''
+                    SELECT tr.id, tr.username, tr.score, tr.completed_at,
+                           COALESCE(p.total, 0), COALESCE(p.evaluated, 0)
+                    FROM test_results tr
+                    LEFT JOIN ask_evaluation_progress p ON p.test_result_id = tr.id
+                    WHERE {' AND '.join(conditions)}
+                    ORDER BY tr.completed_at DESC, tr.id DESC
+                    LIMIT ?
+                ''', (*params, limit + 1))
+                
+                return cursor.fetchall()
         
-        cursor.execute('''
-            SELECT tr.id, tr.username, tr.score, tr.completed_at,
-                   COUNT(ata.question_id) as total_questions,
-                   COUNT(CASE WHEN ata.manager_rating IS NOT NULL THEN 1 END) as evaluated_questions
-            FROM test_results tr
-            LEFT JOIN ask_test_answers ata ON tr.id = ata.test_result_id
-            WHERE tr.test_type = 'ASK'
-            GROUP BY tr.id
-            ORDER BY tr.completed_at DESC
-        ''')
-        
-        tests = cursor.fetchall()
-        conn.close()
-        
-        # Convert datetime strings to proper format if needed
-        formatted_tests = []
-        for test in tests:
-            test_id, username, score, completed_at, total_questions, evaluated_questions = test
-            
-            # Handle completed_at formatting
-            if isinstance(completed_at, str):
-                try:
-                    # Try to parse the datetime string
-                    from datetime import datetime
-                    parsed_date = datetime.fromisoformat(completed_at.replace('Z', '+00:00'))
-                    formatted_date = parsed_date.strftime('%Y-%m-%d %H:%M')
-                except:
-                    formatted_date = completed_at
-            else:
-                formatted_date = completed_at.strftime('%Y-%m-%d %H:%M') if hasattr(completed_at, 'strftime') else str(completed_at)
-            
-            formatted_tests.append((test_id, username, score, formatted_date, total_questions, evaluated_questions))
+        # Every shard pages from the same cursor; merging keeps the first limit + 1 overall
+        merged = heapq.merge(*self._fan_out(query), key=lambda test: (test[3], test[0]), reverse=True)
+        tests = list(itertools.islice(merged, limit + 1))
         
-        return formatted_tests
+        next_cursor = (tests[limit - 1][3], tests[limit - 1][0]) if len(tests) > limit else None
+        return tests[:limit], next_cursor
     
     def update_ask_answer_evaluation(self, test_result_id, question_id, manager_rating, manager_notes, evaluated_by):
-        """Update manager evaluation for a specific answer and recalculate overall scores"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Update the specific answer
-        cursor.execute('''
-            UPDATE ask_test_answers
-            SET manager_rating = ?, manager_notes = ?, evaluated_by = ?, evaluated_at = ?
-            WHERE test_result_id = ? AND question_id = ?
-        ''', (manager_rating, manager_notes, evaluated_by, datetime.now(), test_result_id, question_id))
+        """Update manager evaluation for a specific answer and apply it to the pillar aggregates"""
+        def update(pool):
+            with pool.cursor(immediate=True) as cursor:
+                cursor.execute('''
+                    SELECT user_rating, manager_rating
+                    FROM ask_test_answers
+                    WHERE test_result_id = ? AND question_id = ?
+                ''', (test_result_id, question_id))
+                
+                previous = cursor.fetchone()
+                if not previous:
+                    return False
+                
+                user_rating, previous_manager_rating = previous
+                
+                # Update the specific answer
+                cursor.execute('''
+                    UPDATE ask_test_answers
+                    SET manager_rating = ?, manager_notes = ?, evaluated_by = ?, evaluated_at = ?
+                    WHERE test_result_id = ? AND question_id = ?
+                ''', (manager_rating, manager_notes, evaluated_by, now_ms(), test_result_id, question_id))
+                
+                # Apply the rating change to the question's pillar as a delta
+                pillar = load_question_pillars().get(int(question_id))
+                if pillar is not None:
+                    old = rating_contributions(user_rating, previous_manager_rating)
+                    new = rating_contributions(user_rating, manager_rating)
+                    deltas = [new_value - old_value for new_value, old_value in zip(new, old)]
+                    
+                    cursor.execute(f'''
+                        UPDATE ask_pillar_scores
+                        SET {', '.join(f'{column} = {column} + ?' for column in AGGREGATE_COLUMNS)}
+                        WHERE test_result_id = ? AND pillar = ?
+                    ''', (*deltas, test_result_id, pillar))
+                    
+                    if cursor.rowcount == 0:
+                        # Results saved without this pillar get their aggregates rebuilt once
+                        self._rebuild_pillar_aggregates(cursor, test_result_id)
+                
+                # Refresh the result's pillar scores (one row per pillar) from the aggregates
+                cursor.execute('''
+                    UPDATE ask_pillar_scores
+                    SET manager_score = CASE WHEN manager_rating_count > 0
+                                             THEN manager_rating_sum * 25.0 / manager_rating_count ELSE 0 END,
+                        combined_score = CASE WHEN rating_count > 0
+                                              THEN rating_sum * 25.0 / rating_count ELSE 0 END
+                    WHERE test_result_id = ?
+                ''', (test_result_id,))
+                
+                # Recalculate the overall score from the pillar scores
+                cursor.execute('''
+                    UPDATE test_results
+                    SET score = (SELECT COALESCE(AVG(combined_score), 0) FROM ask_pillar_scores WHERE test_result_id = ?)
+                    WHERE id = ?
+                ''', (test_result_id, test_result_id))
+                
+                return cursor.rowcount > 0
         
-        # Get all answers for this test to recalculate scores
+        # Archived results can still be re-evaluated in place
+        shard = self._result_shard(test_result_id)
+        updated = self._on_result_tier(shard, update)
+        self._invalidate_replicas([shard])
+        return updated
+    
+    def _rebuild_pillar_aggregates(self, cursor, test_result_id):
+        """Recompute the pillar aggregates of one ASK result from its answers"""
         cursor.execute('''
             SELECT question_id, user_rating, manager_rating
             FROM ask_test_answers
             WHERE test_result_id = ?
-            ORDER BY question_id
         ''', (test_result_id,))
         
-        answers = cursor.fetchall()
+        aggregates = aggregate_answers(cursor.fetchall(), load_question_pillars())
+        cursor.executemany(f'''
+            INSERT INTO ask_pillar_scores (test_result_id, pillar, {', '.join(AGGREGATE_COLUMNS)})
+            VALUES (?, ?, {', '.join('?' for _ in AGGREGATE_COLUMNS)})
+            ON CONFLICT (test_result_id, pillar) DO UPDATE SET
+            {', '.join(f'{column} = excluded.{column}' for column in AGGREGATE_COLUMNS)}
+        ''', [(test_result_id, pillar, *totals) for pillar, totals in aggregates.items()])
+    
+    def archive_old_results(self, older_than_months=None, keep_latest=None):
+        """Move results older than N months, or beyond each user's latest K, to the archive files"""
+        if older_than_months is None and keep_latest is None:
+            raise ValueError("Give older_than_months, keep_latest or both")
         
-        # Recalculate scores with manager evaluations
-        if answers:
-            # Load framework data for questions
-            try:
-                with open('framework.json', 'r', encoding='utf-8') as f:
-                    import json
-                    framework_data = json.load(f)
-                questions = framework_data.get('questions', [])
-                question_map = {q['id']: q for q in questions}
-            except:
-                # If framework.json not available, use basic calculation
-                question_map = {}
-            
-            # Calculate new pillar scores
-            pillar_scores = {}
-            pillar_questions = {}
-            
-            # Group questions by pillar
-            for question in questions:
-                pillar = question.get('pillar')
-                if pillar not in pillar_questions:
-                    pillar_questions[pillar] = []
-                pillar_questions[pillar].append(question)
+        cutoff = now_ms() - older_than_months * MS_PER_MONTH if older_than_months is not None else None
+        return sum(self._fan_out(lambda shard: self._archive_shard(shard, cutoff, keep_latest)))
+    
+    def _archive_shard(self, shard, cutoff, keep_latest):
+        """Move one shard's cold results into its archive in a single transaction"""
+        conditions = []
+        params = []
+        if cutoff is not None:
+            conditions.append('ranked.completed_at < ?')
+            params.append(cutoff)
+        if keep_latest is not None:
+            conditions.append('ranked.position > ?')
+            params.append(keep_latest)
+        
+        archive = self._archive_pool(shard, create=True)
+        with shard.cursor(immediate=True, attach={'archive': archive.db_path}) as cursor:
+            # ASK results still awaiting evaluation stay hot, and so does everything newer than
+            # them, so each user's archived results are always older than their hot ones
+            cursor.execute(f'''
+                CREATE TEMP TABLE archived_ids AS
+                WITH ranked AS (
+                    SELECT id, username, completed_at,
+                           ROW_NUMBER() OVER (PARTITION BY username ORDER BY completed_at DESC, id DESC) AS position
+                    FROM main.test_results
+                ),
+                pending AS (
+                    SELECT tr.username, MIN(tr.completed_at) AS completed_at
+                    FROM main.test_results tr
+                    JOIN main.ask_evaluation_progress p ON p.test_result_id = tr.id
+                    WHERE p.evaluated < p.total
+                    GROUP BY tr.username
+                )
+                SELECT ranked.id
+                FROM ranked
+                LEFT JOIN pending ON pending.username = ranked.username
+                WHERE ({' OR '.join(conditions)})
+                  AND (pending.completed_at IS NULL OR ranked.completed_at < pending.completed_at)
+            ''', params)
             
-            # Calculate scores for each pillar
-            for pillar, pillar_question_list in pillar_questions.items():
-                pillar_total = 0
-                pillar_count = 0
+            moved = cursor.execute('SELECT COUNT(*) FROM temp.archived_ids').fetchone()[0]
+            if moved:
+                # Evaluation progress is rebuilt by the ask_test_answers triggers of whichever file
+                # receives the answers
+                # Rows are copied before they are deleted, so an interrupted run can only leave
+                # archive copies behind; drop those first so reruns stay idempotent
+                for table, key in RESULT_REMOVAL_ORDER:
+                    cursor.execute(f'DELETE FROM archive.{table} WHERE {key} IN (SELECT id FROM temp.archived_ids)')
                 
-                for question in pillar_question_list:
-                    question_id = question.get('id')
-                    
-                    # Find corresponding answer
-                    for answer in answers:
-                        if answer[0] == question_id:
-                            user_rating = answer[1] - 1 if answer[1] else 0  # Convert to 0-4
-                            manager_rating = answer[2] - 1 if answer[2] else 0  # Convert to 0-4
-                            
-                            # Use manager rating if available, otherwise user rating
-                            if manager_rating > 0:
-                                rating = manager_rating
-                            else:
-                                rating = user_rating
-                            
-                            if rating > 0:
-                                pillar_total += rating
-                                pillar_count += 1
-                            break
+                for table, key in ARCHIVED_TABLES:
+                    columns = ', '.join(row[1] for row in cursor.execute(f'PRAGMA main.table_info({table})').fetchall())
+                    cursor.execute(f'''
+                        INSERT INTO archive.{table} ({columns})
+                        SELECT {columns} FROM main.{table}
+                        WHERE {key} IN (SELECT id FROM temp.archived_ids)
+                    ''')
                 
-                # Calculate pillar score (0-100)
-                if pillar_count > 0:
-                    pillar_scores[pillar] = (pillar_total / pillar_count) * 25  # Convert to 0-100
-                else:
-                    pillar_scores[pillar] = 0
-            
-            # Calculate overall score
-            overall_score = sum(pillar_scores.values()) / len(pillar_scores) if pillar_scores else 0
+                for table, key in RESULT_REMOVAL_ORDER:
+                    cursor.execute(f'DELETE FROM main.{table} WHERE {key} IN (SELECT id FROM temp.archived_ids)')
             
-            # Update the test result with new scores
-            detailed_result = {
-                "career_level": "Updated",  # Will be recalculated
-                "pillar_scores": pillar_scores,
-                "answers": "Updated with manager evaluations"
-            }
-            
-            cursor.execute('''
-                UPDATE test_results
-                SET score = ?, answers = ?
-                WHERE id = ?
-            ''', (overall_score, json.dumps(detailed_result), test_result_id))
+            # Pooled connections outlive the transaction, so the temp table has to go explicitly
+            cursor.execute('DROP TABLE temp.archived_ids')
         
-        conn.commit()
-        conn.close()
-        
-        return cursor.rowcount > 0
+        return moved
     
     def user_exists(self, username):
         """Check if a user exists"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT username FROM users WHERE username = ?', (username,))
-        user = cursor.fetchone()
-        conn.close()
+        with self._cursor() as cursor:
+            cursor.execute('SELECT username FROM users WHERE username = ?', (username,))
+            user = cursor.fetchone()
         
         return user is not None
     
     def get_all_usernames(self):
         """Get all usernames for debugging"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT username, is_admin FROM users')
-        users = cursor.fetchall()
-        conn.close()
+        with self._read_pool(self._pool).cursor() as cursor:
+            cursor.execute('SELECT username, is_admin FROM users')
+            return cursor.fetchall()
+    
+    def get_usernames_page(self, after_username=None, limit=100):
+        """Get one page of (username, is_admin) rows plus the cursor of the next page"""
+        with self._read_pool(self._pool).cursor() as cursor:
+            cursor.execute('''
+                SELECT username, is_admin FROM users
+                WHERE username > ?
+                ORDER BY username
+                LIMIT ?
+            ''', (after_username or '', limit + 1))
+            
+            users = cursor.fetchall()
         
-        return users
+        next_cursor = users[limit - 1][0] if len(users) > limit else None
+        return users[:limit], next_cursor
     
-    def create_session(self, username, is_admin):
+    def create_session(self, username, is_admin, current_page='home'):
         """Create a new session for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Generate session token
-        session_data = f"{username}_{datetime.now().timestamp()}_{secrets.token_hex(16)}"
-        session_token = hashlib.sha256(session_data.encode()).hexdigest()
-        
-        # Set expiration to 24 hours from now
-        expires_at = datetime.now() + timedelta(hours=24)
-        
+        now = now_ms()
         try:
-            cursor.execute('''
-                INSERT INTO user_sessions (session_token, username, is_admin, expires_at)
-                VALUES (?, ?, ?, ?)
-            ''', (session_token, username, is_admin, expires_at))
+            # Sharded tokens carry their shard index so they can be validated without a lookup
+            shard_index = self._user_shard_index(username)
+            prefix = f"{shard_index}." if self.shard_count > 1 else ''
+            
+            if self.signed_sessions:
+                # Signed tokens validate on their own; the row only tracks the current page
+                session_token = self._token_signer().issue(username, is_admin, now, now + SESSION_TTL_MS, prefix)
+            else:
+                # Generate session token
+                session_data = f"{username}_{now}_{secrets.token_hex(16)}"
+                session_token = prefix + hashlib.sha256(session_data.encode()).hexdigest()
             
-            conn.commit()
-            conn.close()
+            with self._shards[shard_index].cursor() as cursor:
+                cursor.execute('''
+                    INSERT INTO user_sessions
+                    (session_token, username, is_admin, current_page, created_at, last_seen_at, expires_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (session_token, username, is_admin, current_page, now, now, now + SESSION_TTL_MS))
             return session_token
         except Exception as e:
-            conn.close()
             return None
     
     def validate_session(self, session_token):
-        """Validate a session token and return user info"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Validate a session token, extend its expiry and return user info"""
+        now = now_ms()
+        if is_signed_token(session_token):
+            # Signature, expiry and revocation are all checked in memory; the expiry is fixed at login
+            # and does not slide like database sessions do
+            claims = self._token_signer().verify(session_token, now)
+            if claims is None or self._revocations().is_revoked(claims):
+                return None
+            return {'username': claims['u'], 'is_admin': claims['a'], 'current_page': None,
+                    'created_at': claims['iat'], 'expires_at': claims['exp']}
+        
+        with self._session_shard(session_token).cursor() as cursor:
+            cursor.execute('''
+                SELECT username, is_admin, current_page, created_at, expires_at FROM user_sessions
+                WHERE session_token = ? AND expires_at > ?
+            ''', (session_token, now))
+            
+            session = cursor.fetchone()
         
-        cursor.execute('''
-            SELECT username, is_admin FROM user_sessions 
-            WHERE session_token = ? AND expires_at > ?
-        ''', (session_token, datetime.now()))
+        if session is None:
+            return None
+        
+        # Sliding expiry, written only once the remaining lifetime drops below the refresh fraction
+        username, is_admin, current_page, created_at, expires_at = session
+        if expires_at - now < self.session_refresh_fraction * SESSION_TTL_MS:
+            expires_at = self._extend_session(session_token, now) or expires_at
+        
+        return {'username': username, 'is_admin': is_admin, 'current_page': current_page,
+                'created_at': created_at, 'expires_at': expires_at}
+    
+    def _extend_session(self, session_token, now):
+        """Push a session's expiry a full TTL forward, unless another thread of this process already is"""
+        with Database._refreshing_lock:
+            if session_token in Database._refreshing_sessions:
+                return None
+            Database._refreshing_sessions.add(session_token)
+        
+        try:
+            expires_at = now + SESSION_TTL_MS
+            with self._session_shard(session_token).cursor() as cursor:
+                # Other processes may have extended it meanwhile; never move an expiry backwards
+                cursor.execute('''
+                    UPDATE user_sessions SET last_seen_at = ?, expires_at = ?
+                    WHERE session_token = ? AND expires_at < ?
+                ''', (now, expires_at, session_token, expires_at))
+            return expires_at
+        finally:
+            with Database._refreshing_lock:
+                Database._refreshing_sessions.discard(session_token)
+    
+    def _temp_password_key(self):
+        """Key of this catalog's temporary password digests (created by migration 15)"""
+        key = os.path.abspath(self.db_path)
+        temp_password_key = Database._temp_password_keys.get(key)
+        if temp_password_key is None:
+            with self._cursor() as cursor:
+                cursor.execute("SELECT value FROM app_settings WHERE key = 'temp_password_key'")
+                temp_password_key = Database._temp_password_keys.setdefault(key, bytes.fromhex(cursor.fetchone()[0]))
+        return temp_password_key
+    
+    def _token_signer(self):
+        """Signer of this catalog's session tokens, loading or creating its key on first use"""
+        key = os.path.abspath(self.db_path)
+        signer = Database._token_signers.get(key)
+        if signer is not None:
+            return signer
+        
+        secret = os.environ.get(SESSION_SECRET_ENV)
+        if secret:
+            signing_key = secret.encode('utf-8')
+        else:
+            # Every process sharing the catalog agrees on the first key written
+            with self._cursor(immediate=True) as cursor:
+                cursor.execute("INSERT OR IGNORE INTO app_settings (key, value) VALUES ('session_signing_key', ?)",
+                               (secrets.token_hex(32),))
+                cursor.execute("SELECT value FROM app_settings WHERE key = 'session_signing_key'")
+                signing_key = bytes.fromhex(cursor.fetchone()[0])
+        
+        return Database._token_signers.setdefault(key, SessionTokenSigner(signing_key))
+    
+    def _revocations(self):
+        """In-memory revocation list of signed tokens, reloading newer revocations when due"""
+        revocations = Database._revocation_lists.setdefault(os.path.abspath(self.db_path), RevocationList())
+        if revocations.needs_refresh():
+            with self._cursor() as cursor:
+                cursor.execute('''
+                    SELECT token_id, expires_at, revoked_at FROM revoked_sessions
+                    WHERE revoked_at >= ?
+                ''', (revocations.high_water,))
+                rows = cursor.fetchall()
+                
+                cursor.execute("SELECT value FROM app_settings WHERE key = 'sessions_not_before'")
+                not_before = cursor.fetchone()
+            
+            revocations.apply(rows, int(not_before[0]) if not_before else 0)
+        return revocations
+    
+    def _revoke_signed_token(self, session_token):
+        """Add a signed token to the revocation list so it stops validating everywhere"""
+        claims = self._token_signer().verify(session_token, now_ms())
+        if claims is None:
+            return
         
-        result = cursor.fetchone()
-        conn.close()
+        with self._cursor() as cursor:
+            cursor.execute('''
+                INSERT OR IGNORE INTO revoked_sessions (token_id, expires_at, revoked_at)
+                VALUES (?, ?, ?)
+            ''', (claims['jti'], claims['exp'], now_ms()))
+        self._revocations().add(claims['jti'], claims['exp'])
+    
+    def update_session_page(self, session_token, current_page):
+        """Record the page a session is on, extending its expiry"""
+        now = now_ms()
+        with self._session_shard(session_token).cursor() as cursor:
+            cursor.execute('''
+                UPDATE user_sessions SET current_page = ?, last_seen_at = ?, expires_at = ?
+                WHERE session_token = ? AND expires_at > ?
+            ''', (current_page, now, now + SESSION_TTL_MS, session_token, now))
+            
+            return cursor.rowcount > 0
+    
+    def get_session_page(self, session_token):
+        """Get the page a session was last on, or None when the session does not exist"""
+        with self._session_shard(session_token).cursor() as cursor:
+            cursor.execute('SELECT current_page FROM user_sessions WHERE session_token = ?', (session_token,))
+            row = cursor.fetchone()
         
-        if result:
-            return {'username': result[0], 'is_admin': result[1]}
-        return None
+        return row[0] if row else None
     
     def delete_session(self, session_token):
         """Delete a session token"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM user_sessions WHERE session_token = ?', (session_token,))
-        conn.commit()
-        conn.close()
-    
-    def cleanup_expired_sessions(self):
-        """Clean up expired sessions"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM user_sessions WHERE expires_at <= ?', (datetime.now(),))
-        conn.commit()
-        conn.close()
-    
-    def fix_adti_primary_type_codes(self):
-        """Fix ADTI test results that have full names instead of codes for primary_type"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get all ADTI results
-        cursor.execute('SELECT id, answers FROM test_results WHERE test_type = "ADTI"')
-        results = cursor.fetchall()
-        
-        # Define personality types mapping
-        personality_types = {
-            "Data Strategist": "DSTA",
-            "Data Virtuoso": "DVRT", 
-            "Data Logician": "DLOG",
-            "Data Visionary": "DVIS",
-            "Data Collaborator": "DCOL",
-            "Data Supporter": "DSUP",
-            "Data Advocate": "DADV",
-            "Data Integrator": "DINT",
-            "Data Commander": "DCOM",
-            "Data Executive": "DEXE",
-            "Data Innovator": "DINN",
-            "Data Protagonist": "DPRO",
-            "Data Creator": "DCRT",
-            "Data Communicator": "DCOMM",
-            "Data Entrepreneur": "DENT",
-            "Data Activist": "DACT"
-        }
+        if is_signed_token(session_token):
+            self._revoke_signed_token(session_token)
         
-        fixed_count = 0
-        for result_id, answers_str in results:
-            try:
-                data = json.loads(answers_str)
-                if isinstance(data, dict) and 'primary_type' in data and 'all_scores' in data:
-                    old_primary_type = data['primary_type']
-                    
-                    # Check if it's a full name that needs to be converted to code
-                    if old_primary_type in personality_types:
-                        new_primary_type = personality_types[old_primary_type]
-                        data['primary_type'] = new_primary_type
-                        
-                        # Update the score based on the correct primary type code
-                        new_score = data['all_scores'].get(new_primary_type, 0)
-                        
-                        # Update the database
-                        cursor.execute('''
-                            UPDATE test_results 
-                            SET score = ?, answers = ? 
-                            WHERE id = ?
-                        ''', (new_score, json.dumps(data), result_id))
-                        
-                        fixed_count += 1
-                        print(f"Fixed result {result_id}: {old_primary_type} -> {new_primary_type}, score: {new_score}")
-                        
-            except (json.JSONDecodeError, KeyError) as e:
-                print(f"Error processing result {result_id}: {e}")
-                continue
-        
-        conn.commit()
-        conn.close()
-        print(f"Fixed {fixed_count} ADTI results")
-        return fixed_count
+        with self._session_shard(session_token).cursor() as cursor:
+            cursor.execute('DELETE FROM user_sessions WHERE session_token = ?', (session_token,))
+    
+    def delete_all_sessions(self):
+        """Delete every session, logging every user out"""
+        # Signed tokens issued until now are revoked in one go
+        now = now_ms()
+        with self._cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO app_settings (key, value) VALUES ('sessions_not_before', ?)
+                ON CONFLICT (key) DO UPDATE SET value = excluded.value
+            ''', (str(now),))
+        self._revocations().revoke_all(now)
+        
+        def delete(shard):
+            with shard.cursor() as cursor:
+                cursor.execute('DELETE FROM user_sessions')
+        
+        self._fan_out(delete)
+    
+    def cleanup_expired_sessions(self, batch_size=500):
+        """Delete expired sessions in batches of batch_size, each in its own short transaction"""
+        now = now_ms()
+        
+        def cleanup(shard):
+            deleted = 0
+            while True:
+                # The expires_at index finds each batch without scanning live sessions
+                with shard.cursor() as cursor:
+                    cursor.execute('''
+                        DELETE FROM user_sessions
+                        WHERE id IN (SELECT id FROM user_sessions WHERE expires_at <= ? LIMIT ?)
+                    ''', (now, batch_size))
+                    batch = cursor.rowcount
+                
+                deleted += batch
+                if batch < batch_size:
+                    return deleted
+        
+        deleted = sum(self._fan_out(cleanup))
+        
+        # Revocations only matter until the revoked tokens expire
+        with self._cursor() as cursor:
+            cursor.execute('DELETE FROM revoked_sessions WHERE expires_at <= ?', (now,))
+        revocations = Database._revocation_lists.get(os.path.abspath(self.db_path))
+        if revocations is not None:
+            revocations.purge(now)
+        
+        return deleted
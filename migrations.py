@@ -0,0 +1,630 @@
+"""
+Versioned schema migrations for the application database.
+
+Each migration is a (version, description, function) entry in MIGRATIONS.
+Applied versions are recorded in the schema_version table, so a migration
+runs exactly once per database file. Never edit a migration that has
+shipped; append a new one instead.
+"""
+
+import json
+import logging
+import re
+import secrets
+from datetime import datetime, timezone
+
+from adti_types import ADTI_TYPE_CODES, ADTI_TYPE_NAMES
+from answer_encoding import decode_answers, encode_answers, encode_options
+from ask_scoring import AGGREGATE_COLUMNS, aggregate_answers, load_question_pillars, pillar_score
+from password_hashing import temp_password_digest
+from timestamps import EPOCH_MS_NOW_SQL, now_ms, to_epoch_ms
+
+
+def create_base_tables(cursor):
+    """Create the original application tables"""
+    # Create users table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            is_admin BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Create passwords table for temporary passwords
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS temp_passwords (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            generated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL,
+            is_used BOOLEAN DEFAULT 0,
+            FOREIGN KEY (username) REFERENCES users (username)
+        )
+    ''')
+    
+    # Create test results table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS test_results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            test_type TEXT NOT NULL,
+            score INTEGER,
+            answers TEXT,
+            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (username) REFERENCES users (username)
+        )
+    ''')
+    
+    # Create ASK test answers table for detailed tracking
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ask_test_answers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            test_result_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            selected_options TEXT,
+            user_rating INTEGER,
+            user_notes TEXT,
+            manager_rating INTEGER,
+            manager_notes TEXT,
+            evaluated_by TEXT,
+            evaluated_at TIMESTAMP,
+            FOREIGN KEY (test_result_id) REFERENCES test_results (id),
+            FOREIGN KEY (evaluated_by) REFERENCES users (username)
+        )
+    ''')
+    
+    # Create sessions table for persistent login
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_token TEXT UNIQUE NOT NULL,
+            username TEXT NOT NULL,
+            is_admin BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL,
+            FOREIGN KEY (username) REFERENCES users (username)
+        )
+    ''')
+
+
+def add_user_notes_column(cursor):
+    """Add user_notes to ask_test_answers for databases created before it existed"""
+    cursor.execute('PRAGMA table_info(ask_test_answers)')
+    columns = [row[1] for row in cursor.fetchall()]
+    if 'user_notes' not in columns:
+        cursor.execute('ALTER TABLE ask_test_answers ADD COLUMN user_notes TEXT')
+
+
+def add_hot_query_indexes(cursor):
+    """Index the columns used by profile, evaluation and session lookups"""
+    # Keep only the latest row per (test_result_id, question_id) so the unique index can be built
+    cursor.execute('''
+        DELETE FROM ask_test_answers
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM ask_test_answers
+            GROUP BY test_result_id, question_id
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_test_results_username_completed
+        ON test_results (username, completed_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_test_results_type_completed
+        ON test_results (test_type, completed_at)
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_ask_answers_result_question
+        ON ask_test_answers (test_result_id, question_id)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_user_sessions_expires
+        ON user_sessions (expires_at)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_temp_passwords_username
+        ON temp_passwords (username)
+    ''')
+
+
+def create_score_tables(cursor):
+    """Create columnar ASK pillar and ADTI type score tables and backfill them from the JSON blobs"""
+    cursor.execute('ALTER TABLE test_results ADD COLUMN career_level TEXT')
+    cursor.execute('ALTER TABLE test_results ADD COLUMN primary_type TEXT')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ask_pillar_scores (
+            test_result_id INTEGER NOT NULL,
+            pillar TEXT NOT NULL,
+            user_score REAL,
+            manager_score REAL,
+            combined_score REAL,
+            PRIMARY KEY (test_result_id, pillar),
+            FOREIGN KEY (test_result_id) REFERENCES test_results (id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS adti_type_scores (
+            test_result_id INTEGER NOT NULL,
+            type_code TEXT NOT NULL,
+            score REAL,
+            PRIMARY KEY (test_result_id, type_code),
+            FOREIGN KEY (test_result_id) REFERENCES test_results (id)
+        ) WITHOUT ROWID
+    ''')
+    
+    cursor.execute("SELECT id, test_type, answers FROM test_results WHERE test_type IN ('ASK', 'ADTI')")
+    for result_id, test_type, answers in cursor.fetchall():
+        try:
+            data = json.loads(answers)
+        except (TypeError, ValueError):
+            # Results saved through save_test_result are not JSON; nothing to backfill
+            continue
+        if not isinstance(data, dict):
+            continue
+        
+        if test_type == 'ASK' and isinstance(data.get('pillar_scores'), dict):
+            user_scores = data.get('user_pillar_scores') or {}
+            manager_scores = data.get('manager_pillar_scores') or {}
+            cursor.executemany('''
+                INSERT OR REPLACE INTO ask_pillar_scores
+                (test_result_id, pillar, user_score, manager_score, combined_score)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(result_id, pillar, user_scores.get(pillar), manager_scores.get(pillar), combined)
+                  for pillar, combined in data['pillar_scores'].items()])
+            cursor.execute('UPDATE test_results SET career_level = ? WHERE id = ?',
+                         (data.get('career_level'), result_id))
+        
+        elif test_type == 'ADTI' and isinstance(data.get('all_scores'), dict):
+            cursor.executemany('''
+                INSERT OR REPLACE INTO adti_type_scores (test_result_id, type_code, score)
+                VALUES (?, ?, ?)
+            ''', [(result_id, code, score) for code, score in data['all_scores'].items()])
+            cursor.execute('UPDATE test_results SET primary_type = ? WHERE id = ?',
+                         (data.get('primary_type'), result_id))
+
+
+def add_pillar_rating_aggregates(cursor):
+    """Add running per-pillar rating sums and counts to ask_pillar_scores and backfill them"""
+    for column in AGGREGATE_COLUMNS:
+        cursor.execute(f'ALTER TABLE ask_pillar_scores ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0')
+    
+    cursor.execute('''
+        SELECT test_result_id, question_id, user_rating, manager_rating
+        FROM ask_test_answers
+        ORDER BY test_result_id
+    ''')
+    answers_by_result = {}
+    for test_result_id, question_id, user_rating, manager_rating in cursor.fetchall():
+        answers_by_result.setdefault(test_result_id, []).append((question_id, user_rating, manager_rating))
+    
+    question_pillars = load_question_pillars()
+    rows = []
+    for test_result_id, answers in answers_by_result.items():
+        for pillar, totals in aggregate_answers(answers, question_pillars).items():
+            rows.append((test_result_id, pillar, pillar_score(totals[4], totals[5]), *totals))
+    
+    # Existing rows keep their scores; missing pillars are created from the aggregates
+    cursor.executemany(f'''
+        INSERT INTO ask_pillar_scores (test_result_id, pillar, combined_score, {', '.join(AGGREGATE_COLUMNS)})
+        VALUES (?, ?, ?, {', '.join('?' for _ in AGGREGATE_COLUMNS)})
+        ON CONFLICT (test_result_id, pillar) DO UPDATE SET
+        {', '.join(f'{column} = excluded.{column}' for column in AGGREGATE_COLUMNS)}
+    ''', rows)
+
+
+def create_evaluation_progress(cursor):
+    """Keep per-result ASK evaluation progress current with triggers on ask_test_answers"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ask_evaluation_progress (
+            test_result_id INTEGER PRIMARY KEY,
+            total INTEGER NOT NULL DEFAULT 0,
+            evaluated INTEGER NOT NULL DEFAULT 0,
+            last_evaluated_at TIMESTAMP,
+            FOREIGN KEY (test_result_id) REFERENCES test_results (id)
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_ask_answers_progress_insert
+        AFTER INSERT ON ask_test_answers
+        BEGIN
+            INSERT INTO ask_evaluation_progress (test_result_id, total, evaluated, last_evaluated_at)
+            VALUES (NEW.test_result_id, 1, NEW.manager_rating IS NOT NULL, NEW.evaluated_at)
+            ON CONFLICT (test_result_id) DO UPDATE SET
+                total = total + 1,
+                evaluated = evaluated + excluded.evaluated,
+                last_evaluated_at = COALESCE(excluded.last_evaluated_at, last_evaluated_at);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_ask_answers_progress_update
+        AFTER UPDATE OF manager_rating, evaluated_at ON ask_test_answers
+        BEGIN
+            UPDATE ask_evaluation_progress
+            SET evaluated = evaluated + (NEW.manager_rating IS NOT NULL) - (OLD.manager_rating IS NOT NULL),
+                last_evaluated_at = COALESCE(NEW.evaluated_at, last_evaluated_at)
+            WHERE test_result_id = NEW.test_result_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_ask_answers_progress_delete
+        AFTER DELETE ON ask_test_answers
+        BEGIN
+            UPDATE ask_evaluation_progress
+            SET total = total - 1,
+                evaluated = evaluated - (OLD.manager_rating IS NOT NULL)
+            WHERE test_result_id = OLD.test_result_id;
+        END
+    ''')
+    
+    cursor.execute('''
+        INSERT OR REPLACE INTO ask_evaluation_progress (test_result_id, total, evaluated, last_evaluated_at)
+        SELECT test_result_id, COUNT(*), COUNT(manager_rating), MAX(evaluated_at)
+        FROM ask_test_answers
+        GROUP BY test_result_id
+    ''')
+
+
+def add_user_history_index(cursor):
+    """Index per-user history pages filtered by test type"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_test_results_username_type_completed
+        ON test_results (username, test_type, completed_at)
+    ''')
+
+
+def add_user_shard_column(cursor):
+    """Record the shard holding each user's results and sessions"""
+    # Existing users default to shard 0 (the catalog), where their data already is
+    cursor.execute('PRAGMA table_info(users)')
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'shard' not in columns:
+        cursor.execute('ALTER TABLE users ADD COLUMN shard INTEGER NOT NULL DEFAULT 0')
+
+
+# Timestamp columns converted to epoch milliseconds, per table
+TIMESTAMP_COLUMNS = {
+    'users': ('created_at',),
+    'temp_passwords': ('generated_at', 'expires_at'),
+    'test_results': ('completed_at',),
+    'ask_test_answers': ('evaluated_at',),
+    'user_sessions': ('created_at', 'expires_at'),
+}
+
+
+def legacy_timestamp_to_ms(value):
+    """Convert a stored timestamp string to epoch milliseconds, or None when it cannot be parsed"""
+    # datetime.now() values written through the sqlite3 adapter carry microseconds and
+    # are local time, while CURRENT_TIMESTAMP defaults are whole-second UTC
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    
+    if parsed.tzinfo is None and '.' not in value:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return to_epoch_ms(parsed)
+
+
+def rebuild_table(cursor, table, rewrite_create_sql):
+    """Recreate a table from its rewritten CREATE TABLE statement, keeping rows, indexes and triggers"""
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    table_sql = cursor.fetchone()[0]
+    
+    # Column types and defaults cannot be altered, so follow SQLite's documented table
+    # rebuild: copy into a new table, swap it in and recreate the indexes and triggers
+    cursor.execute("SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+                   (table,))
+    dependent_sql = [row[0] for row in cursor.fetchall()]
+    cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,))
+    sequence = cursor.fetchone()
+    
+    rebuilt = f'{table}_rebuild'
+    # sqlite_master keeps the original CREATE TABLE text, with the name quoted after a rename
+    create_sql = re.sub(rf'^CREATE TABLE\s+"?{table}"?', f'CREATE TABLE {rebuilt}', table_sql, count=1)
+    cursor.execute(rewrite_create_sql(create_sql))
+    cursor.execute(f'INSERT INTO {rebuilt} SELECT * FROM {table}')
+    cursor.execute(f'DROP TABLE {table}')
+    cursor.execute(f'ALTER TABLE {rebuilt} RENAME TO {table}')
+    for sql in dependent_sql:
+        cursor.execute(sql)
+    
+    # Keep the AUTOINCREMENT position (shards start theirs at an id offset)
+    if sequence:
+        cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,))
+        current = cursor.fetchone()
+        cursor.execute('DELETE FROM sqlite_sequence WHERE name = ?', (table,))
+        cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)',
+                       (table, max(sequence[0], current[0] if current else 0)))
+
+
+def rebuild_with_epoch_ms_defaults(cursor, table):
+    """Recreate a table so its CURRENT_TIMESTAMP defaults produce epoch milliseconds"""
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    if 'CURRENT_TIMESTAMP' in cursor.fetchone()[0]:
+        rebuild_table(cursor, table,
+                      lambda sql: sql.replace('DEFAULT CURRENT_TIMESTAMP', f'DEFAULT ({EPOCH_MS_NOW_SQL})'))
+
+
+def convert_timestamps_to_epoch_ms(cursor):
+    """Store every timestamp as INTEGER epoch milliseconds"""
+    for table, columns in TIMESTAMP_COLUMNS.items():
+        rebuild_with_epoch_ms_defaults(cursor, table)
+        
+        for column in columns:
+            cursor.execute(f"SELECT rowid, {column} FROM {table} WHERE typeof({column}) = 'text'")
+            converted = []
+            for rowid, value in cursor.fetchall():
+                timestamp = legacy_timestamp_to_ms(value)
+                if timestamp is None:
+                    # Unknown times stay NULL, except expiries (NOT NULL), which count as already expired
+                    logging.getLogger('ds_eval.migrations').warning(
+                        "Unparseable timestamp %r in %s.%s (rowid %s)", value, table, column, rowid)
+                    timestamp = 0 if column == 'expires_at' else None
+                converted.append((timestamp, rowid))
+            cursor.executemany(f'UPDATE {table} SET {column} = ? WHERE rowid = ?', converted)
+    
+    # The progress trigger copied evaluated_at row by row; recompute the latest evaluation
+    cursor.execute('''
+        UPDATE ask_evaluation_progress
+        SET last_evaluated_at = (SELECT MAX(evaluated_at) FROM ask_test_answers a
+                                 WHERE a.test_result_id = ask_evaluation_progress.test_result_id)
+    ''')
+    
+    # Temporary password expiry is filtered by range on login
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_temp_passwords_expires ON temp_passwords (expires_at)')
+
+
+
+def convert_adti_type_names_to_codes(cursor):
+    """Replace full ADTI type names stored by older versions with type codes"""
+    placeholders = ', '.join('?' for _ in ADTI_TYPE_NAMES)
+    cursor.execute(f'''
+        SELECT id, answers FROM test_results
+        WHERE test_type = 'ADTI' AND (primary_type IS NULL OR primary_type NOT IN ({placeholders}))
+    ''', tuple(ADTI_TYPE_NAMES))
+    
+    updates = []
+    for result_id, answers in cursor.fetchall():
+        try:
+            data = json.loads(answers)
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(data, dict) or data.get('primary_type') not in ADTI_TYPE_CODES:
+            continue
+        
+        # The score of an ADTI result is the score of its primary type
+        data['primary_type'] = ADTI_TYPE_CODES[data['primary_type']]
+        all_scores = data.get('all_scores', {})
+        updates.append((all_scores.get(data['primary_type'], 0), json.dumps(data), data['primary_type'], result_id))
+    
+    cursor.executemany('''
+        UPDATE test_results SET score = ?, answers = ?, primary_type = ? WHERE id = ?
+    ''', updates)
+
+
+def store_selected_options_as_bitmasks(cursor):
+    """Store ASK option selections as integer bitmasks and compress result answer blobs"""
+    # TEXT affinity would turn the masks back into text, so the column is retyped first
+    rebuild_table(cursor, 'ask_test_answers',
+                  lambda sql: re.sub(r'selected_options\s+TEXT', 'selected_options INTEGER DEFAULT 0', sql, count=1))
+    
+    cursor.execute("SELECT id, selected_options FROM ask_test_answers WHERE typeof(selected_options) = 'text'")
+    updates = []
+    for answer_id, selected_options in cursor.fetchall():
+        try:
+            mask = encode_options(json.loads(selected_options))
+        except (TypeError, ValueError):
+            mask = 0
+        updates.append((mask, answer_id))
+    cursor.executemany('UPDATE ask_test_answers SET selected_options = ? WHERE id = ?', updates)
+    
+    # Re-encode the JSON and str(dict) text blobs in batches
+    last_id = 0
+    while True:
+        cursor.execute('''
+            SELECT id, answers FROM test_results
+            WHERE id > ? AND typeof(answers) = 'text'
+            ORDER BY id LIMIT 500
+        ''', (last_id,))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        
+        updates = []
+        for result_id, answers in rows:
+            try:
+                updates.append((encode_answers(decode_answers(answers)), result_id))
+            except (TypeError, ValueError, SyntaxError):
+                # Blobs that are neither JSON nor a Python literal are left as they are
+                continue
+        cursor.executemany('UPDATE test_results SET answers = ? WHERE id = ?', updates)
+        last_id = rows[-1][0]
+
+
+def create_notes_search_index(cursor):
+    """Index candidate and manager notes in an FTS5 table kept in sync by triggers"""
+    # External-content table: the text stays in ask_test_answers and only the index is stored.
+    # remove_diacritics lets "lideranca" match "liderança"
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS ask_notes_fts USING fts5(
+            user_notes, manager_notes,
+            content='ask_test_answers', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_ask_answers_fts_insert
+        AFTER INSERT ON ask_test_answers
+        BEGIN
+            INSERT INTO ask_notes_fts (rowid, user_notes, manager_notes)
+            VALUES (NEW.id, NEW.user_notes, NEW.manager_notes);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_ask_answers_fts_update
+        AFTER UPDATE OF user_notes, manager_notes ON ask_test_answers
+        BEGIN
+            INSERT INTO ask_notes_fts (ask_notes_fts, rowid, user_notes, manager_notes)
+            VALUES ('delete', OLD.id, OLD.user_notes, OLD.manager_notes);
+            INSERT INTO ask_notes_fts (rowid, user_notes, manager_notes)
+            VALUES (NEW.id, NEW.user_notes, NEW.manager_notes);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_ask_answers_fts_delete
+        AFTER DELETE ON ask_test_answers
+        BEGIN
+            INSERT INTO ask_notes_fts (ask_notes_fts, rowid, user_notes, manager_notes)
+            VALUES ('delete', OLD.id, OLD.user_notes, OLD.manager_notes);
+        END
+    ''')
+    
+    cursor.execute("INSERT INTO ask_notes_fts (ask_notes_fts) VALUES ('rebuild')")
+
+
+def add_session_page_and_activity(cursor):
+    """Keep each session's current page and last activity in user_sessions"""
+    # Sessions used to be mirrored into sessions.json; the table is now their only store
+    cursor.execute('PRAGMA table_info(user_sessions)')
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'current_page' not in columns:
+        cursor.execute("ALTER TABLE user_sessions ADD COLUMN current_page TEXT DEFAULT 'home'")
+    if 'last_seen_at' not in columns:
+        cursor.execute('ALTER TABLE user_sessions ADD COLUMN last_seen_at INTEGER')
+        cursor.execute('UPDATE user_sessions SET last_seen_at = created_at')
+    
+    # Restoring the most recently active session orders by last activity
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_user_sessions_last_seen ON user_sessions (last_seen_at)')
+
+
+def create_signed_session_tables(cursor):
+    """Add the settings table holding the session signing key and the list of revoked signed sessions"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_settings (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    ''')
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS revoked_sessions (
+            token_id TEXT PRIMARY KEY,
+            expires_at INTEGER NOT NULL,
+            revoked_at INTEGER NOT NULL
+        )
+    ''')
+    # Processes reload revocations newer than the last one they saw; the reaper purges by expiry
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_revoked_sessions_revoked ON revoked_sessions (revoked_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_revoked_sessions_expires ON revoked_sessions (expires_at)')
+
+
+def add_credential_types(cursor):
+    """Flag how each user logs in and store temporary passwords as keyed digests"""
+    cursor.execute('PRAGMA table_info(users)')
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'credential_type' not in columns:
+        cursor.execute("ALTER TABLE users ADD COLUMN credential_type TEXT NOT NULL DEFAULT 'password'")
+        # create_user only ever stored a bcrypt hash of a placeholder, so non-admins log in
+        # with temporary passwords alone and need no bcrypt check
+        cursor.execute("UPDATE users SET credential_type = 'temporary' WHERE is_admin = 0")
+    
+    # Key of the temporary password digests, generated once per catalog
+    cursor.execute("INSERT OR IGNORE INTO app_settings (key, value) VALUES ('temp_password_key', ?)",
+                   (secrets.token_hex(32),))
+    cursor.execute("SELECT value FROM app_settings WHERE key = 'temp_password_key'")
+    key = bytes.fromhex(cursor.fetchone()[0])
+    
+    cursor.execute('SELECT id, password FROM temp_passwords')
+    cursor.executemany('UPDATE temp_passwords SET password = ? WHERE id = ?',
+                       [(temp_password_digest(key, password), row_id) for row_id, password in cursor.fetchall()])
+
+
+def add_answer_question_index(cursor):
+    """Index ASK answers by question for the option frequency report"""
+    # Covering index: the report reads selected_options straight from it
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_ask_test_answers_question
+        ON ask_test_answers (question_id, selected_options)
+    ''')
+
+
+def convert_schema_versions_to_epoch_ms(cursor):
+    """Store schema_version.applied_at as epoch milliseconds like every other timestamp"""
+    # Older versions recorded datetime.now() through the deprecated sqlite3 datetime adapter
+    cursor.execute("SELECT version, applied_at FROM schema_version WHERE typeof(applied_at) = 'text'")
+    for version, applied_at in cursor.fetchall():
+        timestamp = legacy_timestamp_to_ms(applied_at)
+        if timestamp is None:
+            logging.getLogger('ds_eval.migrations').warning(
+                "Unparseable applied_at %r of schema version %s", applied_at, version)
+            continue
+        cursor.execute('UPDATE schema_version SET applied_at = ? WHERE version = ?', (timestamp, version))
+
+
+MIGRATIONS = [
+    (1, "Create base tables", create_base_tables),
+    (2, "Add user_notes to ask_test_answers", add_user_notes_column),
+    (3, "Add indexes for hot queries", add_hot_query_indexes),
+    (4, "Add columnar ASK pillar and ADTI type score tables", create_score_tables),
+    (5, "Add running pillar rating aggregates", add_pillar_rating_aggregates),
+    (6, "Add trigger-maintained ASK evaluation progress", create_evaluation_progress),
+    (7, "Add per-user test type history index", add_user_history_index),
+    (8, "Add users.shard for sharded storage", add_user_shard_column),
+    (9, "Convert timestamps to epoch milliseconds", convert_timestamps_to_epoch_ms),
+    (10, "Convert ADTI type names to type codes", convert_adti_type_names_to_codes),
+    (11, "Store ASK selections as bitmasks and compress answer blobs", store_selected_options_as_bitmasks),
+    (12, "Add full-text index over ASK notes", create_notes_search_index),
+    (13, "Add current page and last activity to user_sessions", add_session_page_and_activity),
+    (14, "Add app settings and revoked signed sessions", create_signed_session_tables),
+    (15, "Add users.credential_type and digest temporary passwords", add_credential_types),
+    (16, "Index ASK answers by question", add_answer_question_index),
+    (17, "Convert schema_version.applied_at to epoch milliseconds", convert_schema_versions_to_epoch_ms),
+]
+
+
+def get_schema_version(conn):
+    """Return the highest applied migration version (0 for a fresh database)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at INTEGER NOT NULL
+        )
+    ''')
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def run_migrations(conn):
+    """Apply every pending migration, each in its own transaction"""
+    applied = []
+    current_version = get_schema_version(conn)
+    
+    for version, description, migrate in MIGRATIONS:
+        if version <= current_version:
+            continue
+        
+        # Take the write lock up front so concurrent processes apply each version once
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,)).fetchone()
+            if not row:
+                cursor = conn.cursor()
+                migrate(cursor)
+                cursor.execute('INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)',
+                             (version, description, now_ms()))
+                applied.append(version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    
+    return applied
@@ -0,0 +1,349 @@
+"""
+Password hashing off the Streamlit script threads.
+
+bcrypt is deliberately CPU-bound, and a cohort logging in at once used to
+queue every check behind the GIL and stall the whole app. PasswordHasher runs
+hashes and checks in a ProcessPoolExecutor sized to the available cores. Its
+workers come from a forkserver (spawn where there is none), never a fork of the
+multithreaded server, whose locks another thread may hold at fork time. Work
+is admitted only while fewer than workers + queue_size operations are in
+flight; beyond that callers get HashingBusyError at once instead of waiting.
+Temporary passwords are random and short-lived, so they are stored as
+HMAC-SHA256 digests (temp_password_digest) that verify in microseconds
+without the pool. LoginThrottle counts failed logins per username and per client address in a
+sliding window. An address over its budget is turned away with
+LoginThrottledError until the window moves on; a username over its budget is
+only slowed down (exponentially growing waits between attempts, capped at 32 s),
+so nobody can lock a victim out by failing logins in their name.
+
+Configuration (environment variables):
+    DS_EVAL_HASH_WORKERS         hashing processes (default: available cores, 0 hashes in the calling thread)
+    DS_EVAL_HASH_QUEUE           operations allowed to wait for a free process (default 4 per process)
+    DS_EVAL_HASH_TIMEOUT         seconds a caller waits for its result before giving up (default 10)
+    DS_EVAL_LOGIN_MAX_FAILURES   failed logins per username or address within the window (default 5)
+    DS_EVAL_LOGIN_WINDOW         length of the failure window in seconds (default 300)
+    DS_EVAL_TRUSTED_PROXIES      reverse proxies in front of the app that append to X-Forwarded-For
+                                 (default 0: the header is ignored and only usernames are throttled)
+"""
+
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+from query_monitor import bucket_index, bucket_labels
+from timestamps import now_ms
+
+# Upper bounds (ms) of the hash latency histogram buckets (time in queue included); bcrypt is far slower
+# than a query, so the buckets are coarser than the query monitor's
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+
+# Start method of the hashing processes: forking the threaded server could copy locks held by other threads
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# Past its failure budget a username waits 1 s before the next attempt, doubling per further failure up to 32 s
+USERNAME_BACKOFF_MS = 1000
+USERNAME_BACKOFF_STEPS = 5
+
+class HashingBusyError(RuntimeError):
+    """Raised when the hashing pool has no room for another operation"""
+
+class LoginThrottledError(RuntimeError):
+    """Raised when a username or client address has failed too many logins recently"""
+    
+    def __init__(self, retry_after_seconds):
+        super().__init__(f"Too many failed logins, retry in {retry_after_seconds} s")
+        self.retry_after_seconds = retry_after_seconds
+
+def _hash_password(password):
+    """Return the bcrypt hash of a password (runs in a worker process)"""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+
+def _check_password(password, password_hash):
+    """Check a password against a bcrypt hash (runs in a worker process)"""
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    except ValueError:
+        # Malformed stored hash
+        return False
+
+def temp_password_digest(key, password):
+    """Keyed hex digest under which a temporary password is stored"""
+    return hmac.new(key, password.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def forwarded_client_address(forwarded_for, trusted_proxies):
+    """Client address recorded in X-Forwarded-For by the outermost of trusted_proxies proxies, or None"""
+    # Each proxy appends the address it received the request from, so only the right-most trusted_proxies
+    # entries come from our own infrastructure; anything left of them is whatever the client sent
+    if trusted_proxies <= 0 or not forwarded_for:
+        return None
+    hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+    return hops[-trusted_proxies] if len(hops) >= trusted_proxies else None
+
+def trusted_proxy_count():
+    """Number of trusted reverse proxies configured through DS_EVAL_TRUSTED_PROXIES"""
+    return int(os.environ.get('DS_EVAL_TRUSTED_PROXIES', '0'))
+
+def available_cores():
+    """Number of CPUs this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+class PasswordHasher:
+    """Bounded process pool for bcrypt with fast rejection and latency counters"""
+    
+    def __init__(self, workers=None, queue_size=None, timeout_seconds=10):
+        self.workers = available_cores() if workers is None else workers
+        self.queue_size = 4 * max(self.workers, 1) if queue_size is None else queue_size
+        self.timeout_seconds = timeout_seconds
+        self._capacity = threading.BoundedSemaphore(max(self.workers, 1) + self.queue_size)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    
+    def hash_password(self, password):
+        """Return the bcrypt hash of a password as text"""
+        return self._run(_hash_password, password)
+    
+    def hash_passwords(self, passwords):
+        """Return the bcrypt hashes of many passwords, in order (bulk work bypasses admission control)"""
+        passwords = list(passwords)
+        if self.workers <= 0:
+            return [_hash_password(password) for password in passwords]
+        
+        # Submit one wave per worker so logins arriving meanwhile queue behind a wave, not the whole batch
+        hashes = []
+        for start in range(0, len(passwords), self.workers):
+            wave = passwords[start:start + self.workers]
+            executor = self._get_executor()
+            try:
+                hashes.extend(executor.map(_hash_password, wave))
+            except BrokenProcessPool:
+                self._discard_executor(executor)
+                hashes.extend(self._get_executor().map(_hash_password, wave))
+        return hashes
+    
+    def check_password(self, password, password_hash):
+        """Return whether a password matches a bcrypt hash"""
+        return self._run(_check_password, password, password_hash)
+    
+    def _get_executor(self):
+        """Return the worker pool, starting it (again, if a worker died) on demand"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context(START_METHOD))
+            return self._executor
+    
+    def _discard_executor(self, executor):
+        """Drop a broken worker pool so the next operation starts a fresh one"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _run(self, function, *args):
+        """Admit one operation, run it on the pool and account for its latency"""
+        if not self._capacity.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusyError("Password hashing pool is saturated")
+        
+        started = time.perf_counter()
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            if self.workers <= 0:
+                return function(*args)
+            
+            executor = self._get_executor()
+            try:
+                future = executor.submit(function, *args)
+            except BrokenProcessPool:
+                self._discard_executor(executor)
+                executor = self._get_executor()
+                future = executor.submit(function, *args)
+            
+            try:
+                return future.result(timeout=self.timeout_seconds)
+            except FutureTimeoutError:
+                future.cancel()
+                with self._lock:
+                    self.timeouts += 1
+                raise HashingBusyError("Password hashing timed out")
+            except BrokenProcessPool:
+                self._discard_executor(executor)
+                raise HashingBusyError("Password hashing worker stopped")
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+                self.total_ms += elapsed_ms
+                self.max_ms = max(self.max_ms, elapsed_ms)
+                self.buckets[bucket_index(elapsed_ms, LATENCY_BUCKETS_MS)] += 1
+            self._capacity.release()
+    
+    def stats(self):
+        """Return queue depth, rejection and latency counters as a dict"""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'in_flight': self.in_flight,
+                'queued': max(0, self.in_flight - max(self.workers, 1)),
+                'peak_in_flight': self.peak_in_flight,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'avg_ms': self.total_ms / self.completed if self.completed else 0.0,
+                'max_ms': self.max_ms,
+            }
+    
+    def latency_histogram(self):
+        """Return (bucket label, operation count) pairs"""
+        labels = bucket_labels(LATENCY_BUCKETS_MS)
+        with self._lock:
+            return list(zip(labels, self.buckets))
+    
+    def shutdown(self):
+        """Stop the worker processes"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+class LoginThrottle:
+    """Sliding-window counters of failed logins: addresses are locked out, usernames slowed down"""
+    
+    def __init__(self, max_failures=5, window_seconds=300, max_keys=100000):
+        self.max_failures = max_failures
+        self.window_ms = int(window_seconds * 1000)
+        self.max_keys = max_keys
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+        self.throttled = 0
+    
+    @property
+    def enabled(self):
+        return self.max_failures > 0 and self.window_ms > 0
+    
+    @staticmethod
+    def _keys(username, client_address):
+        keys = [('user', username)]
+        if client_address:
+            keys.append(('address', client_address))
+        return keys
+    
+    def check(self, username, client_address=None):
+        """Raise LoginThrottledError if the address is over its failure budget or the username must still wait"""
+        if not self.enabled:
+            return
+        
+        now = now_ms()
+        retry_after_ms = 0
+        with self._lock:
+            for key in self._keys(username, client_address):
+                failures = self._failures.get(key)
+                if failures is None:
+                    continue
+                
+                # Forget failures that left the window
+                while failures and failures[0] <= now - self.window_ms:
+                    failures.popleft()
+                if not failures:
+                    del self._failures[key]
+                elif len(failures) < self.max_failures:
+                    continue
+                elif key[0] == 'user':
+                    backoff = USERNAME_BACKOFF_MS << min(len(failures) - self.max_failures, USERNAME_BACKOFF_STEPS)
+                    retry_after_ms = max(retry_after_ms, failures[-1] + backoff - now)
+                else:
+                    retry_after_ms = max(retry_after_ms, failures[0] + self.window_ms - now)
+            
+            if retry_after_ms > 0:
+                self.throttled += 1
+        
+        if retry_after_ms > 0:
+            raise LoginThrottledError(-(-retry_after_ms // 1000))
+    
+    def record_failure(self, username, client_address=None):
+        """Count one failed login against the username and the address"""
+        if not self.enabled:
+            return
+        
+        now = now_ms()
+        with self._lock:
+            for key in self._keys(username, client_address):
+                failures = self._failures.get(key)
+                if failures is None:
+                    # Usernames keep enough failures to count their backoff steps
+                    maxlen = self.max_failures + (USERNAME_BACKOFF_STEPS + 1 if key[0] == 'user' else 0)
+                    failures = self._failures[key] = deque(maxlen=maxlen)
+                failures.append(now)
+                self._failures.move_to_end(key)
+            
+            # Drop the least recently failing keys beyond the cap
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+    
+    def record_success(self, username):
+        """Clear the failures of a username after a successful login"""
+        with self._lock:
+            self._failures.pop(('user', username), None)
+    
+    def stats(self):
+        """Return the number of tracked keys and of throttled attempts"""
+        with self._lock:
+            return {'tracked': len(self._failures), 'throttled': self.throttled}
+
+_hasher = None
+_throttle = None
+_singletons_lock = threading.Lock()
+
+def get_password_hasher():
+    """Return the process-wide PasswordHasher configured from the environment"""
+    global _hasher
+    if _hasher is not None:
+        return _hasher
+    
+    with _singletons_lock:
+        if _hasher is None:
+            workers = os.environ.get('DS_EVAL_HASH_WORKERS')
+            queue_size = os.environ.get('DS_EVAL_HASH_QUEUE')
+            _hasher = PasswordHasher(
+                workers=int(workers) if workers else None,
+                queue_size=int(queue_size) if queue_size else None,
+                timeout_seconds=float(os.environ.get('DS_EVAL_HASH_TIMEOUT', '10')),
+            )
+        return _hasher
+
+def get_login_throttle():
+    """Return the process-wide LoginThrottle configured from the environment"""
+    global _throttle
+    if _throttle is not None:
+        return _throttle
+    
+    with _singletons_lock:
+        if _throttle is None:
+            _throttle = LoginThrottle(
+                max_failures=int(os.environ.get('DS_EVAL_LOGIN_MAX_FAILURES', '5')),
+                window_seconds=float(os.environ.get('DS_EVAL_LOGIN_WINDOW', '300')),
+            )
+        return _throttle
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Create a cohort of users from a CSV file and write their credentials sheet
+"""
+
+import argparse
+import os
+import sys
+
+from database import Database
+from user_provisioning import credentials_csv, decode_csv, failures_csv, parse_users_csv
+
+def main():
+    """Provision the users of a CSV file"""
+    parser = argparse.ArgumentParser(description="Create users in bulk from a CSV file "
+                                                 "(a username column and an optional password column)")
+    parser.add_argument("csv_file", help="CSV file of usernames, with or without a header row")
+    parser.add_argument("--db", default="app.db", help="catalog database file (default: app.db)")
+    parser.add_argument("--output", default="credentials.csv", help="credentials sheet to write (default: credentials.csv)")
+    parser.add_argument("--failures", default="failures.csv", help="report of rows not created (default: failures.csv)")
+    args = parser.parse_args()
+    
+    # The sheet holds the only copy of the temporary passwords; never overwrite an earlier one
+    if os.path.exists(args.output):
+        print(f"❌ {args.output} already exists; move it away or pass another --output")
+        return 1
+    
+    with open(args.csv_file, "rb") as f:
+        data = f.read()
+    try:
+        rows, failures = parse_users_csv(decode_csv(data))
+    except UnicodeDecodeError:
+        print(f"❌ Cannot read {args.csv_file}: save it as UTF-8 or Windows-1252 CSV")
+        return 1
+    
+    created, insert_failures = Database(args.db).create_users(rows)
+    failures += insert_failures
+    
+    if created:
+        with open(args.output, "w", encoding="utf-8", newline="") as f:
+            f.write(credentials_csv(created))
+        print(f"✅ {len(created)} users created, credentials written to {args.output}")
+    else:
+        print("❌ No users created")
+    
+    if failures:
+        with open(args.failures, "w", encoding="utf-8", newline="") as f:
+            f.write(failures_csv(sorted(failures)))
+        print(f"⚠️ {len(failures)} rows not created, see {args.failures}")
+        for line, username, reason in sorted(failures)[:10]:
+            print(f"   line {line}: {username or '(empty)'}: {reason}")
+    
+    return 1 if failures and not created else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
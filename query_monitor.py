@@ -0,0 +1,304 @@
+"""
+In-process instrumentation of the SQL statements issued through Database.
+
+Every cursor handed out by ConnectionManager is wrapped in an
+InstrumentedCursor, which times each statement (including fetching its rows)
+and reports it to the process-wide QueryMonitor. The monitor keeps the most
+recent statements in a ring buffer plus per-statement histogram counters, and
+writes statements slower than the threshold to a rotating slow-query log
+together with their EXPLAIN QUERY PLAN.
+
+Configuration (environment variables):
+    DS_EVAL_QUERY_MONITOR   set to 0 to disable instrumentation
+    DS_EVAL_SLOW_QUERY_MS   slow-query threshold in milliseconds (default 100)
+    DS_EVAL_SLOW_QUERY_LOG  slow-query log file (default slow_queries.log)
+"""
+
+import inspect
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import types
+from collections import deque, namedtuple
+from functools import lru_cache
+from logging.handlers import RotatingFileHandler
+
+from timestamps import now_ms
+
+# Upper bounds (ms) of the latency histogram buckets; slower statements land in the last bucket
+LATENCY_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000)
+
+QueryRecord = namedtuple('QueryRecord', 'executed_at method sql rows elapsed_ms')
+
+_WHITESPACE = re.compile(r'\s+')
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+
+# Statements EXPLAIN QUERY PLAN can describe
+_EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """Collapse whitespace and replace literals so equivalent statements share one key"""
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    sql = _LITERALS.sub('?', sql)
+    return _IN_LISTS.sub('IN (?...)', sql)
+
+@lru_cache(maxsize=None)
+def _database_method_names():
+    """Map the code of every Database method, and of the functions nested in it, to the method name"""
+    # Built from the class rather than from co_qualname, which Python only has since 3.11
+    from database import Database
+    
+    names = {}
+    def collect(code, method):
+        names[code] = method
+        for constant in code.co_consts:
+            if isinstance(constant, types.CodeType):
+                collect(constant, method)
+    
+    for name, attribute in vars(Database).items():
+        function = inspect.unwrap(getattr(attribute, '__func__', attribute))
+        if isinstance(function, types.FunctionType):
+            collect(function.__code__, name)
+    return names
+
+def calling_method():
+    """Return the name of the Database method that issued the current statement"""
+    # The innermost public Database method wins; private helpers and shard workers
+    # (whose thread never saw the public method) fall back to the innermost private one
+    method_names = _database_method_names()
+    fallback = None
+    frame = sys._getframe(2)
+    while frame is not None:
+        method = method_names.get(frame.f_code)
+        if method is not None:
+            if not method.startswith('_'):
+                return method
+            fallback = fallback or method
+        frame = frame.f_back
+    return fallback or 'unknown'
+
+class StatementStats:
+    """Histogram counters for one (method, normalized SQL) pair"""
+    
+    __slots__ = ('calls', 'total_ms', 'max_ms', 'rows', 'buckets')
+    
+    def __init__(self):
+        self.calls = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+    
+    def add(self, elapsed_ms, rows):
+        self.calls += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.rows += rows
+        self.buckets[bucket_index(elapsed_ms)] += 1
+
+def bucket_index(elapsed_ms, bounds=LATENCY_BUCKETS_MS):
+    """Return the histogram bucket of a latency, for the given bucket upper bounds"""
+    for index, upper_bound in enumerate(bounds):
+        if elapsed_ms <= upper_bound:
+            return index
+    return len(bounds)
+
+def bucket_labels(bounds=LATENCY_BUCKETS_MS):
+    """Return the labels of the histogram buckets with the given upper bounds"""
+    return [f"≤{bound} ms" for bound in bounds] + [f">{bounds[-1]} ms"]
+
+class QueryMonitor:
+    """Ring buffer, histogram counters and slow-query log shared by every connection"""
+    
+    def __init__(self, enabled=True, slow_query_ms=100, log_path='slow_queries.log', buffer_size=1000):
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self.log_path = log_path
+        self._recent = deque(maxlen=buffer_size)
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._logger = None
+    
+    def wrap(self, cursor):
+        """Return an instrumented proxy for a sqlite3 cursor (or the cursor itself when disabled)"""
+        return InstrumentedCursor(cursor, self) if self.enabled else cursor
+    
+    def record(self, method, sql, parameters, rows, elapsed_ms, connection):
+        """Account for one finished statement"""
+        normalized = normalize_sql(sql)
+        with self._lock:
+            self._recent.append(QueryRecord(now_ms(), method, normalized, rows, elapsed_ms))
+            stats = self._stats.get((method, normalized))
+            if stats is None:
+                stats = self._stats[(method, normalized)] = StatementStats()
+            stats.add(elapsed_ms, rows)
+        
+        if elapsed_ms >= self.slow_query_ms:
+            self._log_slow_query(method, sql, parameters, rows, elapsed_ms, connection)
+    
+    def _log_slow_query(self, method, sql, parameters, rows, elapsed_ms, connection):
+        """Write a slow statement and its query plan to the rotating slow-query log"""
+        plan = ''
+        if sql.lstrip().upper().startswith(_EXPLAINABLE):
+            try:
+                plan = ''.join(f"\n    {row[3]}" for row in connection.execute(f'EXPLAIN QUERY PLAN {sql}', parameters))
+            except sqlite3.Error as e:
+                plan = f"\n    (plan unavailable: {e})"
+        
+        self._get_logger().warning("%.1f ms, %d rows, %s: %s%s",
+                                   elapsed_ms, rows, method, normalize_sql(sql), plan)
+    
+    def _get_logger(self):
+        """Return the slow-query logger, attaching its rotating file handler on first use"""
+        with self._lock:
+            if self._logger is None:
+                logger = logging.getLogger('ds_eval.slow_queries')
+                if not logger.handlers:
+                    handler = RotatingFileHandler(self.log_path, maxBytes=5 * 1024 * 1024, backupCount=3,
+                                                  encoding='utf-8')
+                    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+                    logger.addHandler(handler)
+                    logger.setLevel(logging.INFO)
+                    logger.propagate = False
+                self._logger = logger
+            return self._logger
+    
+    def top_statements(self, limit=20, order_by='total_ms'):
+        """Return the most expensive statements as dicts, sorted by total_ms, max_ms or calls"""
+        with self._lock:
+            snapshot = [(method, sql, stats.calls, stats.total_ms, stats.max_ms, stats.rows, list(stats.buckets))
+                        for (method, sql), stats in self._stats.items()]
+        
+        statements = [{
+            'method': method,
+            'sql': sql,
+            'calls': calls,
+            'total_ms': total_ms,
+            'avg_ms': total_ms / calls,
+            'max_ms': max_ms,
+            'rows': rows,
+            'buckets': buckets,
+        } for method, sql, calls, total_ms, max_ms, rows, buckets in snapshot]
+        
+        statements.sort(key=lambda statement: statement[order_by], reverse=True)
+        return statements[:limit]
+    
+    def latency_histogram(self):
+        """Return (bucket label, statement count) pairs over every recorded statement"""
+        labels = bucket_labels()
+        totals = [0] * len(labels)
+        with self._lock:
+            for stats in self._stats.values():
+                for index, count in enumerate(stats.buckets):
+                    totals[index] += count
+        return list(zip(labels, totals))
+    
+    def recent(self, min_elapsed_ms=0):
+        """Return buffered statements, newest first, optionally only the slower ones"""
+        with self._lock:
+            records = list(self._recent)
+        return [record for record in reversed(records) if record.elapsed_ms >= min_elapsed_ms]
+    
+    def reset(self):
+        """Drop every buffered statement and counter"""
+        with self._lock:
+            self._recent.clear()
+            self._stats.clear()
+
+class InstrumentedCursor:
+    """sqlite3 cursor proxy that times statements, including fetching their rows"""
+    
+    def __init__(self, cursor, monitor):
+        self._cursor = cursor
+        self._monitor = monitor
+        self._statement = None
+    
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+    
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+    
+    def _run(self, execute, sql, parameters):
+        """Start accounting for a new statement and time its execution"""
+        self._finish()
+        self._statement = [calling_method(), sql, parameters, 0, 0.0]
+        started = time.perf_counter()
+        try:
+            execute(sql, parameters)
+        finally:
+            self._statement[4] += time.perf_counter() - started
+        
+        if self._cursor.rowcount > 0:
+            self._statement[3] = self._cursor.rowcount
+        return self
+    
+    def execute(self, sql, parameters=()):
+        return self._run(self._cursor.execute, sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        self._run(self._cursor.executemany, sql, seq_of_parameters)
+        # Keep one parameter set for EXPLAIN QUERY PLAN
+        self._statement[2] = seq_of_parameters[0] if seq_of_parameters else ()
+        return self
+    
+    def _fetch(self, fetch, *args):
+        """Time a fetch and add its rows to the current statement"""
+        started = time.perf_counter()
+        result = fetch(*args)
+        if self._statement is not None:
+            self._statement[4] += time.perf_counter() - started
+            if isinstance(result, list):
+                self._statement[3] += len(result)
+            elif result is not None:
+                self._statement[3] += 1
+        return result
+    
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+    
+    def fetchmany(self, size=None):
+        return self._fetch(self._cursor.fetchmany, size or self._cursor.arraysize)
+    
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+    
+    def _finish(self):
+        """Report the current statement to the monitor"""
+        if self._statement is not None:
+            method, sql, parameters, rows, elapsed = self._statement
+            self._statement = None
+            self._monitor.record(method, sql, parameters, rows, elapsed * 1000, self._cursor.connection)
+    
+    def close(self):
+        self._finish()
+        self._cursor.close()
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+def get_query_monitor():
+    """Return the process-wide QueryMonitor configured from the environment"""
+    global _monitor
+    if _monitor is not None:
+        return _monitor
+    
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = QueryMonitor(
+                enabled=os.environ.get('DS_EVAL_QUERY_MONITOR', '1') != '0',
+                slow_query_ms=float(os.environ.get('DS_EVAL_SLOW_QUERY_MS', '100')),
+                log_path=os.environ.get('DS_EVAL_SLOW_QUERY_LOG', 'slow_queries.log'),
+            )
+        return _monitor
@@ -0,0 +1,113 @@
+"""
+Process-wide cache of validated session tokens.
+
+Validating a session costs a database round trip on every Streamlit rerun, yet
+a token's answer rarely changes within minutes. SessionCache remembers each
+validated token for a short TTL (never past the session's own expiry) in an
+LRU-ordered dict with a size cap. Logouts invalidate their tokens explicitly;
+sessions deleted by another process stop being trusted when the TTL runs out.
+
+Configuration (environment variables):
+    DS_EVAL_SESSION_CACHE_TTL   seconds a validated token is trusted (default 60, 0 disables the cache)
+    DS_EVAL_SESSION_CACHE_SIZE  maximum number of cached tokens (default 10000)
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from timestamps import now_ms
+
+class SessionCache:
+    """LRU cache of token -> user info with a TTL, a size cap and hit/miss counters"""
+    
+    def __init__(self, ttl_seconds=60, max_entries=10000):
+        self.ttl_ms = int(ttl_seconds * 1000)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @property
+    def enabled(self):
+        return self.ttl_ms > 0 and self.max_entries > 0
+    
+    def get(self, session_token):
+        """Return the cached user info of a token, or None when it has to be validated again"""
+        if not self.enabled:
+            return None
+        
+        now = now_ms()
+        with self._lock:
+            entry = self._entries.get(session_token)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[session_token]
+                self.misses += 1
+                return None
+            
+            self._entries.move_to_end(session_token)
+            self.hits += 1
+            return dict(entry[0])
+    
+    def put(self, session_token, user_info):
+        """Cache a validated token until the TTL or the session's expiry, whichever comes first"""
+        if not self.enabled:
+            return
+        
+        valid_until = min(now_ms() + self.ttl_ms, user_info['expires_at'])
+        with self._lock:
+            self._entries[session_token] = (dict(user_info), valid_until)
+            self._entries.move_to_end(session_token)
+            
+            # Evict the least recently used tokens beyond the cap
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+    
+    def invalidate(self, session_token):
+        """Forget one token (logout, deletion)"""
+        with self._lock:
+            self._entries.pop(session_token, None)
+    
+    def invalidate_user(self, username):
+        """Forget every token of one user (user deletion)"""
+        with self._lock:
+            for session_token in [token for token, entry in self._entries.items() if entry[0]['username'] == username]:
+                del self._entries[session_token]
+    
+    def clear(self):
+        """Forget every token"""
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        """Return the counters and current size as a dict"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_session_cache():
+    """Return the process-wide SessionCache configured from the environment"""
+    global _cache
+    if _cache is not None:
+        return _cache
+    
+    with _cache_lock:
+        if _cache is None:
+            _cache = SessionCache(
+                ttl_seconds=float(os.environ.get('DS_EVAL_SESSION_CACHE_TTL', '60')),
+                max_entries=int(os.environ.get('DS_EVAL_SESSION_CACHE_SIZE', '10000')),
+            )
+        return _cache
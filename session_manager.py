@@ -1,146 +1,153 @@
-import json
+"""
+Login sessions and their per-browser tokens.
+
+A browser's session token travels in its URL (?session=...), so a reload can
+restore that browser's own session. A token in a URL is exposed: it lands in
+browser history, proxy and server access logs, and Referer headers of links
+followed from the page, and anyone holding it is logged in as its user. To
+narrow that window, a URL token restores a session only for
+DS_EVAL_URL_TOKEN_TTL seconds after it was issued (default 1800), every
+restore replaces it with a fresh token and ends the old one, and open pages
+swap their token for a new one once it is half that age. Duplicating a tab
+therefore moves the session to the new tab and logs the old one out.
+"""
+
+import logging
 import os
-from datetime import datetime, timedelta
+import threading
 from database import Database
+from session_cache import get_session_cache
+from timestamps import now_ms
+
+# Seconds between runs of the background session reaper
+REAP_INTERVAL_ENV = 'DS_EVAL_SESSION_REAP_INTERVAL'
+
+# URL query parameter holding a browser's session token
+SESSION_QUERY_PARAM = 'session'
+
+# Seconds after issue during which a token in a URL can restore its session
+URL_TOKEN_TTL_ENV = 'DS_EVAL_URL_TOKEN_TTL'
 
 class SessionManager:
-    def __init__(self, session_file="sessions.json"):
-        self.session_file = session_file
-        self.db = Database()
-        self.load_sessions()
+    """Login sessions, stored only in the user_sessions table so every server process shares them"""
     
-    def load_sessions(self):
-        """Load sessions from file"""
-        if os.path.exists(self.session_file):
-            try:
-                with open(self.session_file, 'r') as f:
-                    self.sessions = json.load(f)
-            except:
-                self.sessions = {}
-        else:
-            self.sessions = {}
-    
-    def save_sessions(self):
-        """Save sessions to file"""
-        with open(self.session_file, 'w') as f:
-            json.dump(self.sessions, f)
+    def __init__(self):
+        self.db = Database()
+        self.cache = get_session_cache()
+        self.url_token_ttl_ms = int(float(os.environ.get(URL_TOKEN_TTL_ENV, '1800')) * 1000)
     
     def create_session(self, username, is_admin, current_page="home"):
         """Create a new session"""
-        # Create session in database
-        session_token = self.db.create_session(username, is_admin)
-        
-        if session_token:
-            # Store in file for persistence
-            self.sessions[session_token] = {
-                'username': username,
-                'is_admin': is_admin,
-                'current_page': current_page,
-                'created_at': datetime.now().isoformat(),
-                'expires_at': (datetime.now() + timedelta(hours=24)).isoformat()
-            }
-            self.save_sessions()
-            return session_token
-        return None
+        return self.db.create_session(username, is_admin, current_page)
     
     def validate_session(self, session_token):
-        """Validate a session token"""
-        # First check database
-        user_info = self.db.validate_session(session_token)
-        
-        if user_info:
-            # Update file session if needed
-            if session_token in self.sessions:
-                self.sessions[session_token]['expires_at'] = (datetime.now() + timedelta(hours=24)).isoformat()
-                self.save_sessions()
+        """Validate a session token, answering from the session cache while it is fresh"""
+        user_info = self.cache.get(session_token)
+        if user_info is not None:
             return user_info
         
-        # If not in database, check file
-        if session_token in self.sessions:
-            session_data = self.sessions[session_token]
-            expires_at = datetime.fromisoformat(session_data['expires_at'])
-            
-            if datetime.now() < expires_at:
-                # Session is still valid, restore to database
-                self.db.create_session(session_data['username'], session_data['is_admin'])
-                return {
-                    'username': session_data['username'],
-                    'is_admin': session_data['is_admin']
-                }
-            else:
-                # Session expired, remove from file
-                del self.sessions[session_token]
-                self.save_sessions()
+        # Misses go to the database, which also extends the session's expiry
+        session = self.db.validate_session(session_token)
+        if session is None:
+            return None
         
-        return None
+        user_info = {key: session[key] for key in ('username', 'is_admin', 'created_at', 'expires_at')}
+        self.cache.put(session_token, user_info)
+        return user_info
     
     def delete_session(self, session_token):
         """Delete a session"""
-        # Delete from database
+        self.cache.invalidate(session_token)
         self.db.delete_session(session_token)
-        
-        # Delete from file
-        if session_token in self.sessions:
-            del self.sessions[session_token]
-            self.save_sessions()
     
     def update_current_page(self, session_token, current_page):
         """Update the current page for a session"""
-        if session_token in self.sessions:
-            self.sessions[session_token]['current_page'] = current_page
-            self.save_sessions()
+        self.db.update_session_page(session_token, current_page)
     
     def clear_all_sessions(self):
         """Clear all sessions (for logout)"""
-        # Clear all sessions from file
-        self.sessions = {}
-        self.save_sessions()
-        
-        # Clean up database sessions
-        self.db.cleanup_expired_sessions()
+        self.cache.clear()
+        self.db.delete_all_sessions()
+    
+    def rotate_session(self, session_token, username, is_admin, current_page):
+        """Move a session to a fresh token and end the old one; returns the new token or None"""
+        new_token = self.create_session(username, is_admin, current_page)
+        if new_token is not None:
+            self.delete_session(session_token)
+        return new_token
     
-    def get_current_session(self):
-        """Get the current active session from file"""
-        if not self.sessions:
+    def needs_rotation(self, user_info):
+        """Whether a validated session's token is old enough to be replaced in the URL"""
+        return now_ms() - (user_info.get('created_at') or 0) > self.url_token_ttl_ms // 2
+    
+    def get_current_session(self, session_token):
+        """Restore the session a browser's URL token belongs to under a new token, or None"""
+        if not session_token:
             return None
         
-        # Get the most recent session
-        current_time = datetime.now()
-        valid_sessions = []
+        session = self.db.validate_session(session_token)
+        if session is None:
+            return None
         
-        for token, session_data in self.sessions.items():
-            expires_at = datetime.fromisoformat(session_data['expires_at'])
-            if current_time < expires_at:
-                valid_sessions.append((token, session_data))
+        # Old URL tokens may have leaked through history or logs, so they no longer restore
+        if now_ms() - (session['created_at'] or 0) > self.url_token_ttl_ms:
+            return None
         
-        if valid_sessions:
-            # Return the most recent valid session
-            valid_sessions.sort(key=lambda x: x[1]['created_at'], reverse=True)
-            token, session_data = valid_sessions[0]
-            return {
-                'username': session_data['username'],
-                'is_admin': session_data['is_admin'],
-                'current_page': session_data.get('current_page', 'home'),
-                'token': token
-            }
+        # Signed tokens validate without reading the row that tracks the page
+        current_page = session['current_page'] or self.db.get_session_page(session_token) or 'home'
+        new_token = self.rotate_session(session_token, session['username'], session['is_admin'], current_page)
+        if new_token is None:
+            return None
         
-        return None
+        return {
+            'username': session['username'],
+            'is_admin': session['is_admin'],
+            'current_page': current_page,
+            'token': new_token
+        }
     
     def cleanup_expired_sessions(self):
         """Clean up expired sessions"""
-        current_time = datetime.now()
-        expired_tokens = []
-        
-        for token, session_data in self.sessions.items():
-            expires_at = datetime.fromisoformat(session_data['expires_at'])
-            if current_time >= expires_at:
-                expired_tokens.append(token)
-        
-        for token in expired_tokens:
-            del self.sessions[token]
-        
-        if expired_tokens:
-            self.save_sessions()
-        
-        # Also cleanup database
         self.db.cleanup_expired_sessions()
+
+_reaper = None
+_reaper_stop = threading.Event()
+_reaper_lock = threading.Lock()
+
+def start_session_reaper(interval=None, batch_size=500):
+    """Start the thread that deletes expired sessions in the background, once per process"""
+    global _reaper
+    if _reaper is not None:
+        return _reaper
+    
+    with _reaper_lock:
+        if _reaper is None:
+            if interval is None:
+                interval = float(os.environ.get(REAP_INTERVAL_ENV, '300'))
+            _reaper_stop.clear()
+            _reaper = threading.Thread(target=_reap_expired_sessions, args=(interval, batch_size),
+                                       name='session-reaper', daemon=True)
+            _reaper.start()
+        return _reaper
+
+def stop_session_reaper():
+    """Stop the reaper thread (used by tests and shutdown hooks)"""
+    global _reaper
+    with _reaper_lock:
+        if _reaper is not None:
+            _reaper_stop.set()
+            _reaper.join()
+            _reaper = None
+
+def _reap_expired_sessions(interval, batch_size):
+    """Reaper loop: delete expired sessions in bounded batches every interval seconds"""
+    db = Database()
+    while True:
+        try:
+            db.cleanup_expired_sessions(batch_size=batch_size)
+        except Exception:
+            # A locked or unavailable database is retried on the next run
+            logging.getLogger('ds_eval.sessions').exception("Session cleanup failed")
+        
+        if _reaper_stop.wait(interval):
+            return
@@ -0,0 +1,137 @@
+"""
+HMAC-signed session tokens.
+
+A signed token carries its own claims (username, admin flag, issue and expiry
+times and a random token id), so validating it is a constant-time signature
+check with no database read. Logouts are recorded in the revoked_sessions
+table, which RevocationList mirrors in memory and refreshes every few seconds
+so revocations made by other processes are picked up. A row whose token id is
+user_revocation_id(username) revokes every token that user was issued up to
+its revoked_at (used when the user is deleted).
+
+Signed tokens have a hard expiry: exp is fixed when the token is issued, and
+unlike database sessions they do not slide with activity.
+
+Token format: [<shard>.]v1.<base64url claims JSON>.<base64url HMAC-SHA256>, the
+signature covering everything before its final dot.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+
+TOKEN_VERSION = 'v1'
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def user_revocation_id(username):
+    """revoked_sessions token id that revokes every token issued to a user so far"""
+    return f"user:{username}"
+
+def is_signed_token(session_token):
+    """Whether a token uses the signed format (random database tokens have no version part)"""
+    parts = session_token.split('.')
+    return len(parts) >= 3 and parts[-3] == TOKEN_VERSION
+
+class SessionTokenSigner:
+    """Issues and verifies signed session tokens with one server-side key"""
+    
+    def __init__(self, key):
+        self._key = key
+    
+    def _sign(self, signed_part):
+        return _b64encode(hmac.new(self._key, signed_part.encode('ascii'), hashlib.sha256).digest())
+    
+    def issue(self, username, is_admin, issued_at, expires_at, prefix=''):
+        """Return a token carrying the given claims; prefix routes its session row to a shard"""
+        claims = {
+            'u': username,
+            'a': bool(is_admin),
+            'iat': issued_at,
+            'exp': expires_at,
+            'jti': secrets.token_hex(8),
+        }
+        payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+        signed_part = f"{prefix}{TOKEN_VERSION}.{payload}"
+        return f"{signed_part}.{self._sign(signed_part)}"
+    
+    def verify(self, session_token, now):
+        """Return the claims of an authentic, unexpired token, or None"""
+        signed_part, _, signature = session_token.rpartition('.')
+        try:
+            if not hmac.compare_digest(self._sign(signed_part).encode('ascii'), signature.encode('utf-8')):
+                return None
+            claims = json.loads(_b64decode(signed_part.rpartition('.')[2]))
+        except ValueError:
+            # Tokens with non-ASCII or malformed parts are simply not authentic
+            return None
+        return claims if claims['exp'] > now else None
+
+class RevocationList:
+    """In-memory mirror of revoked_sessions plus the time before which every token was revoked"""
+    
+    def __init__(self, refresh_interval=5.0):
+        self.refresh_interval = refresh_interval
+        self.not_before = 0
+        self.high_water = 0
+        self._revoked = {}
+        self._users_not_before = {}
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+    
+    def needs_refresh(self):
+        return self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self.refresh_interval
+    
+    def apply(self, rows, not_before):
+        """Merge (token_id, expires_at, revoked_at) rows loaded from the database"""
+        with self._lock:
+            for token_id, expires_at, revoked_at in rows:
+                if token_id.startswith('user:'):
+                    self._revoke_user(token_id[len('user:'):], revoked_at, expires_at)
+                else:
+                    self._revoked[token_id] = expires_at
+                self.high_water = max(self.high_water, revoked_at)
+            self.not_before = max(self.not_before, not_before)
+            self._refreshed_at = time.monotonic()
+    
+    def add(self, token_id, expires_at):
+        """Record a revocation made by this process"""
+        with self._lock:
+            self._revoked[token_id] = expires_at
+    
+    def revoke_user(self, username, not_before, expires_at):
+        """Record that every token issued to a user at or before not_before is revoked"""
+        with self._lock:
+            self._revoke_user(username, not_before, expires_at)
+    
+    def _revoke_user(self, username, not_before, expires_at):
+        previous = self._users_not_before.get(username)
+        if previous is None or previous[0] < not_before:
+            self._users_not_before[username] = (not_before, expires_at)
+    
+    def revoke_all(self, not_before):
+        """Record that every token issued at or before not_before is revoked"""
+        with self._lock:
+            self.not_before = max(self.not_before, not_before)
+    
+    def purge(self, now):
+        """Forget revocations of tokens that have expired anyway"""
+        with self._lock:
+            self._revoked = {token_id: expires_at for token_id, expires_at in self._revoked.items() if expires_at > now}
+            self._users_not_before = {username: entry for username, entry in self._users_not_before.items()
+                                      if entry[1] > now}
+    
+    def is_revoked(self, claims):
+        # A token issued in the same millisecond as a revoke-all is revoked too
+        if claims['iat'] <= self.not_before or claims['jti'] in self._revoked:
+            return True
+        user_entry = self._users_not_before.get(claims['u'])
+        return user_entry is not None and claims['iat'] <= user_entry[0]
@@ -2,7 +2,48 @@ import streamlit as st
 import pandas as pd
 import json
 from database import Database
-from datetime import datetime, timedelta
+from answer_encoding import count_selected, selected_option_names
+from query_monitor import get_query_monitor
+from session_cache import get_session_cache
+from password_hashing import get_login_throttle, get_password_hasher
+from user_provisioning import credentials_csv, decode_csv, failures_csv, parse_users_csv, validate_username
+from timestamps import format_timestamp, now_ms
+
+USERS_PAGE_SIZE = 50
+ASK_TESTS_PAGE_SIZE = 20
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_option_frequencies(_db, question_id, width):
+    """Option frequencies of an ASK question, recomputed at most every 5 minutes"""
+    return _db.get_ask_option_frequencies(question_id, width=width)
+
+def get_page_cursor(state_key):
+    """Return the keyset cursor of the page currently shown for a paginated list"""
+    cursors = st.session_state.setdefault(state_key, [])
+    return cursors[-1] if cursors else None
+
+def reset_page_cursor(state_key):
+    """Go back to the first page of a paginated list"""
+    st.session_state[state_key] = []
+
+def render_page_controls(state_key, next_cursor):
+    """Render previous/next buttons that move through a stack of keyset cursors"""
+    cursors = st.session_state.setdefault(state_key, [])
+    
+    col1, col2, col3 = st.columns([1, 2, 1])
+    
+    with col1:
+        if cursors and st.button("⬅️ Anterior", key=f"{state_key}_prev"):
+            cursors.pop()
+            st.rerun()
+    
+    with col2:
+        st.write(f"Página {len(cursors) + 1}")
+    
+    with col3:
+        if next_cursor is not None and st.button("Próxima ➡️", key=f"{state_key}_next"):
+            cursors.append(next_cursor)
+            st.rerun()
 
 def admin_page():
     st.title("Painel de Administração")
@@ -20,7 +61,7 @@ def admin_page():
     st.success(f"Bem-vindo, Admin {st.session_state['username']}!")
     
     # Create tabs for different admin functions
-    tab1, tab2 = st.tabs(["Gerenciamento de Usuários", "Avaliação ASK"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Gerenciamento de Usuários", "Avaliação ASK", "Desempenho", "Busca nas Notas"])
     
     with tab1:
         # Create new user section
@@ -30,44 +71,80 @@ def admin_page():
             create_button = st.form_submit_button("Criar Usuário")
         
         if create_button and new_username:
-            if db.create_user(new_username):
+            if validate_username(new_username):
+                st.error("Nome de usuário inválido: use letras, números e . _ @ - (até 64 caracteres).")
+            elif db.create_user(new_username):
                 st.success(f"Usuário '{new_username}' criado com sucesso!")
             else:
                 st.error(f"Usuário '{new_username}' já existe ou a criação falhou.")
         
+        # Bulk provisioning of a whole cohort from a CSV file
+        with st.expander("Criar Usuários em Lote (CSV)"):
+            st.caption("Uma coluna `username` (ou apenas os nomes, um por linha) e, opcionalmente, uma coluna "
+                       "`password` com senhas permanentes, separadas por vírgula ou ponto e vírgula. "
+                       "Usuários sem senha recebem uma senha temporária.")
+            uploaded_file = st.file_uploader("Arquivo CSV", type=["csv"], key="bulk_users_file")
+            
+            if uploaded_file is not None and st.button("Criar Usuários", key="bulk_create_button"):
+                try:
+                    text = decode_csv(uploaded_file.getvalue())
+                except UnicodeDecodeError:
+                    st.error("Não foi possível ler o arquivo: salve-o como CSV UTF-8 e tente novamente.")
+                else:
+                    rows, failures = parse_users_csv(text)
+                    with st.spinner(f"Criando {len(rows)} usuários..."):
+                        created, insert_failures = db.create_users(rows)
+                    # Keep the sheet across reruns; the temporary passwords cannot be read back later
+                    st.session_state['bulk_provisioning'] = (created, sorted(failures + insert_failures))
+            
+            if 'bulk_provisioning' in st.session_state:
+                created, failures = st.session_state['bulk_provisioning']
+                col1, col2 = st.columns(2)
+                col1.metric("Usuários Criados", len(created))
+                col2.metric("Linhas com Falha", len(failures))
+                
+                if created:
+                    st.download_button("Baixar Credenciais (CSV)", credentials_csv(created),
+                                       file_name="credenciais.csv", mime="text/csv", key="bulk_credentials_download")
+                    st.warning("Baixe as credenciais agora: as senhas temporárias não poderão ser exibidas novamente.")
+                if failures:
+                    st.dataframe(pd.DataFrame(failures, columns=['Linha', 'Usuário', 'Motivo']),
+                                 use_container_width=True)
+                    st.download_button("Baixar Falhas (CSV)", failures_csv(failures),
+                                       file_name="falhas.csv", mime="text/csv", key="bulk_failures_download")
+                
+                if st.button("Limpar Resultado", key="bulk_clear_button"):
+                    del st.session_state['bulk_provisioning']
+                    st.rerun()
+        
         st.markdown("---")
         
         # User management section
         st.subheader("Gerenciamento de Usuários")
         
-        # Get all users
-        users = db.get_all_users()
+        # Get the current page of users
+        users, next_users_cursor = db.get_users_page(
+            after_username=get_page_cursor('users_page_cursors'),
+            limit=USERS_PAGE_SIZE
+        )
         
         if users:
             # Convert to DataFrame for better display
             user_data = []
+            current_time = now_ms()
             for user in users:
-                username, created_at, temp_password, expires_at, is_used = user
+                username, created_at, has_temp_password, expires_at, is_used = user
                 
                 # Format dates
-                created_str = created_at if isinstance(created_at, str) else created_at.strftime('%Y-%m-%d %H:%M')
-                expires_str = "N/A" if not expires_at else (expires_at if isinstance(expires_at, str) else expires_at.strftime('%Y-%m-%d %H:%M'))
+                created_str = format_timestamp(created_at)
+                expires_str = format_timestamp(expires_at)
                 
                 # Password status
-                if temp_password:
+                if has_temp_password:
                     if is_used:
                         password_status = "Usado"
                     elif expires_at:
-                        # Convert string to datetime if needed
-                        if isinstance(expires_at, str):
-                            try:
-                                expires_dt = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
-                            except:
-                                expires_dt = datetime.now() - timedelta(days=1)  # Default to expired
-                        else:
-                            expires_dt = expires_at
-                        
-                        if datetime.now() > expires_dt:
+                        if current_time > expires_at:
                             password_status = "Expirado"
                         else:
                             password_status = "Ativo"
@@ -79,7 +156,8 @@ def admin_page():
                 user_data.append({
                     'Usuário': username,
                     'Criado': created_str,
-                    'Senha Temporária': temp_password if temp_password else "N/A",
+                    # Only digests are stored; a password is shown once, when it is generated
+                    'Senha Temporária': "••••••••" if has_temp_password else "N/A",
                     'Expira': expires_str,
                     'Status': password_status
                 })
@@ -88,6 +166,7 @@ def admin_page():
             
             # Display users table
             st.dataframe(df, use_container_width=True)
+            render_page_controls('users_page_cursors', next_users_cursor)
             
             # User actions section
             st.subheader("Ações de Usuário")
@@ -146,8 +225,8 @@ def admin_page():
                             
                             # Debug information
                             with st.expander("Informações de Debug"):
-                                all_users = db.get_all_usernames()
-                                st.write("Todos os usuários no banco de dados:")
+                                all_users, _ = db.get_usernames_page(limit=100)
+                                st.write("Usuários no banco de dados (primeiros 100):")
                                 for username, is_admin in all_users:
                                     st.write(f"- {username} (admin: {is_admin})")
             
@@ -168,11 +247,22 @@ def admin_page():
                 
                 if st.button("Gerar Senha", key="generate_password"):
                     new_password = db.generate_temp_password(selected_user_password)
-                    st.success(f"Nova senha para {selected_user_password}: **{new_password}**")
-                    st.info("Esta senha é válida por 1 semana e substitui qualquer senha existente.")
+                    # Keep the password across the rerun; it cannot be read back from the database
+                    st.session_state['generated_password'] = (selected_user_password, new_password)
                     st.rerun()
-            
-
+                
+                if 'generated_password' in st.session_state:
+                    generated_user, generated_password = st.session_state.pop('generated_password')
+                    st.success(f"Nova senha para {generated_user}: **{generated_password}**")
+                    st.info("Esta senha é válida por 1 semana e substitui qualquer senha existente. "
+                            "Anote-a agora: ela não poderá ser exibida novamente.")
+        
+        
+        
+        elif get_page_cursor('users_page_cursors'):
+            # Users on the stored page may have been deleted meanwhile
+            reset_page_cursor('users_page_cursors')
+            st.rerun()
         
         else:
             st.info("Nenhum usuário encontrado. Crie alguns usuários primeiro!")
@@ -184,9 +274,25 @@ def admin_page():
         
         # Get all ASK tests
         try:
-            ask_tests = db.get_all_ask_tests_for_evaluation()
+            pending_only = st.checkbox(
+                "Mostrar apenas testes pendentes",
+                key="ask_pending_only",
+                on_change=reset_page_cursor,
+                args=('ask_tests_page_cursors',)
+            )
+            after_completed_at, after_id = get_page_cursor('ask_tests_page_cursors') or (None, None)
+            ask_tests, next_ask_tests_cursor = db.get_ask_tests_for_evaluation_page(
+                after_completed_at=after_completed_at,
+                after_id=after_id,
+                limit=ASK_TESTS_PAGE_SIZE,
+                pending_only=pending_only
+            )
             
-            if not ask_tests:
+            if not ask_tests and after_id is not None:
+                # Tests on the stored page may have been evaluated or deleted meanwhile
+                reset_page_cursor('ask_tests_page_cursors')
+                st.rerun()
+            elif not ask_tests:
                 st.info("Nenhum teste ASK encontrado para avaliação.")
             else:
                 # Display test list
@@ -201,7 +307,7 @@ def admin_page():
                     col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
                     
                     with col1:
-                        st.write(f"**{username}** - {completed_at}")
+                        st.write(f"**{username}** - {format_timestamp(completed_at)}")
                         st.write(f"Score: {score:.1f}")
                     
                     with col2:
@@ -215,6 +321,8 @@ def admin_page():
                             st.session_state.selected_test_id = test_id
                             st.rerun()
                 
+                render_page_controls('ask_tests_page_cursors', next_ask_tests_cursor)
+                
                 # Evaluation interface
                 if 'selected_test_id' in st.session_state:
                     test_id = st.session_state.selected_test_id
@@ -229,7 +337,7 @@ def admin_page():
                             username, test_type, score, answers_json, completed_at = test_result
                             
                             st.subheader(f"Avaliando: {username}")
-                            st.write(f"**Data do Teste:** {completed_at}")
+                            st.write(f"**Data do Teste:** {format_timestamp(completed_at)}")
                             st.write(f"**Pontuação Atual:** {score:.1f}")
                             
                             # Load framework data for questions
@@ -268,15 +376,10 @@ def admin_page():
                                 pillar = question.get('pillar', 'Unknown')
                                 category = question.get('category', 'Unknown')
                                 
-                                # Convert selected options to skill names
-                                try:
-                                    selected_options_list = json.loads(selected_options) if selected_options else []
-                                    option_set_name = question.get('option_set', '')
-                                    option_list = option_sets.get(option_set_name, [])
-                                    selected_skills = [option_list[i] for i in selected_options_list if i < len(option_list)]
-                                    selected_skills_text = ", ".join(selected_skills[:3]) + ("..." if len(selected_skills) > 3 else "")
-                                except:
-                                    selected_skills_text = f"Opções: {selected_options}"
+                                # Convert the selected options bitmask to skill names
+                                option_list = option_sets.get(question.get('option_set', ''), [])
+                                selected_skills = selected_option_names(selected_options, option_list)
+                                selected_skills_text = ", ".join(selected_skills[:3]) + ("..." if len(selected_skills) > 3 else "")
                                 
                                 # Determine status
                                 status = "Avaliado" if manager_rating and manager_rating > 0 else "Pendente"
@@ -287,6 +390,7 @@ def admin_page():
                                     "Pilar": pillar,
                                     "Categoria": category,
                                     "Habilidades Selecionadas": selected_skills_text,
+                                    "Qtd. Habilidades": count_selected(selected_options),
                                     "Avaliação do Usuário": f"{user_rating}/5",
                                     "Avaliação do Gerente": f"{manager_rating}/5" if manager_rating else "Não avaliado",
                                     "Status": status
@@ -354,25 +458,29 @@ def admin_page():
                                     st.write(f"**Explicação:** {explanation}")
                                     
                                     # Display selected skills
-                                    try:
-                                        selected_options_list = json.loads(selected_options) if selected_options else []
-                                        option_list = option_sets.get(option_set_name, [])
-                                        selected_skills = [option_list[i] for i in selected_options_list if i < len(option_list)]
+                                    option_list = option_sets.get(option_set_name, [])
+                                    selected_skills = selected_option_names(selected_options, option_list)
+                                    
+                                    if selected_skills:
+                                        st.write(f"**Habilidades Selecionadas ({len(selected_skills)}):**")
                                         
-                                        if selected_skills:
-                                            st.write(f"**Habilidades Selecionadas ({len(selected_skills)}):**")
-                                            
-                                            # Display in 3 columns
-                                            cols = st.columns(3)
-                                            for i, skill in enumerate(selected_skills):
-                                                col_idx = i % 3
-                                                with cols[col_idx]:
-                                                    st.write(f"• {skill}")
-                                        else:
-                                            st.write("**Habilidades Selecionadas:** Nenhuma")
-                                    except Exception as e:
-                                        st.write(f"**Opções Selecionadas:** {selected_options}")
-                                        st.write(f"*Erro ao analisar opções: {e}*")
+                                        # Display in 3 columns
+                                        cols = st.columns(3)
+                                        for i, skill in enumerate(selected_skills):
+                                            col_idx = i % 3
+                                            with cols[col_idx]:
+                                                st.write(f"• {skill}")
+                                    else:
+                                        st.write("**Habilidades Selecionadas:** Nenhuma")
+                                    
+                                    # How often each option of this question was selected across all ASK tests
+                                    if option_list:
+                                        with st.expander("Frequência das Opções em Todos os Testes"):
+                                            # Expander bodies run on every rerun, so the scan waits for an explicit request
+                                            if st.checkbox("Calcular frequências", key=f"option_frequencies_{question_id}"):
+                                                answer_count, option_counts = cached_option_frequencies(db, question_id, len(option_list))
+                                                st.write(f"**Respostas:** {answer_count}")
+                                                st.bar_chart(pd.DataFrame({'Seleções': option_counts}, index=option_list))
                                     
                                     st.write(f"**Autoavaliação do Usuário:** {user_rating}/5")
                                     
@@ -428,6 +536,130 @@ def admin_page():
         except Exception as e:
             st.error(f"Erro ao carregar testes ASK: {e}")
     
+    with tab3:
+        # Query performance section
+        st.subheader("Desempenho das Consultas")
+        monitor = get_query_monitor()
+        
+        if not monitor.enabled:
+            st.info("Monitoramento de consultas desativado (DS_EVAL_QUERY_MONITOR=0).")
+        else:
+            order_labels = {"Tempo total": "total_ms", "Tempo máximo": "max_ms", "Execuções": "calls"}
+            order_label = st.selectbox("Ordenar por:", list(order_labels), key="query_stats_order")
+            statements = monitor.top_statements(limit=20, order_by=order_labels[order_label])
+            
+            if not statements:
+                st.info("Nenhuma consulta registrada ainda.")
+            else:
+                # Top offenders
+                st.write("**Consultas Mais Custosas:**")
+                df = pd.DataFrame([{
+                    'Método': statement['method'],
+                    'Execuções': statement['calls'],
+                    'Total (ms)': round(statement['total_ms'], 1),
+                    'Média (ms)': round(statement['avg_ms'], 2),
+                    'Máximo (ms)': round(statement['max_ms'], 1),
+                    'Linhas': statement['rows'],
+                    'SQL': statement['sql']
+                } for statement in statements])
+                st.dataframe(df, use_container_width=True)
+                
+                # Latency distribution over every recorded statement
+                st.write("**Distribuição de Latência:**")
+                histogram = pd.DataFrame(monitor.latency_histogram(), columns=['Faixa', 'Consultas']).set_index('Faixa')
+                st.bar_chart(histogram)
+                
+                # Recent slow statements from the ring buffer
+                slow_queries = monitor.recent(min_elapsed_ms=monitor.slow_query_ms)
+                st.write(f"**Consultas Lentas Recentes (≥ {monitor.slow_query_ms:g} ms):**")
+                if slow_queries:
+                    st.dataframe(pd.DataFrame([{
+                        'Quando': format_timestamp(record.executed_at, '%Y-%m-%d %H:%M:%S'),
+                        'Método': record.method,
+                        'Tempo (ms)': round(record.elapsed_ms, 1),
+                        'Linhas': record.rows,
+                        'SQL': record.sql
+                    } for record in slow_queries]), use_container_width=True)
+                    st.caption(f"Planos de execução em {monitor.log_path}")
+                else:
+                    st.write("Nenhuma consulta lenta no buffer.")
+            
+            if st.button("Limpar Estatísticas", key="reset_query_stats"):
+                monitor.reset()
+                st.rerun()
+        
+        # Session validation cache of this server process
+        session_cache = get_session_cache()
+        if session_cache.enabled:
+            st.write("**Cache de Sessões:**")
+            cache_stats = session_cache.stats()
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Acertos", cache_stats['hits'])
+            col2.metric("Falhas", cache_stats['misses'])
+            col3.metric("Taxa de Acerto", f"{cache_stats['hit_rate']:.0%}")
+            col4.metric("Sessões em Cache", cache_stats['size'])
+        
+        # Password hashing pool of this server process
+        st.write("**Verificação de Senhas:**")
+        hasher = get_password_hasher()
+        hash_stats = hasher.stats()
+        col1, col2, col3, col4, col5 = st.columns(5)
+        col1.metric("Em Andamento", hash_stats['in_flight'],
+                    help=f"{hash_stats['workers']} processos, até {hash_stats['queue_size']} na fila")
+        col2.metric("Na Fila", hash_stats['queued'], help=f"Pico: {hash_stats['peak_in_flight']} em andamento")
+        col3.metric("Tempo Médio (ms)", f"{hash_stats['avg_ms']:.0f}", help=f"Máximo: {hash_stats['max_ms']:.0f} ms")
+        col4.metric("Recusadas", hash_stats['rejected'] + hash_stats['timeouts'])
+        col5.metric("Logins Bloqueados", get_login_throttle().stats()['throttled'])
+        if hash_stats['completed']:
+            st.bar_chart(pd.DataFrame(hasher.latency_histogram(), columns=['Faixa', 'Verificações']).set_index('Faixa'))
+        
+        # Admin listings read from a snapshot replica when DS_EVAL_REPLICA_STALENESS is set
+        replica_taken_at = db.get_replica_taken_at()
+        if replica_taken_at is not None:
+            st.caption(f"Listagens administrativas lidas de um instantâneo de "
+                       f"{format_timestamp(replica_taken_at, '%Y-%m-%d %H:%M:%S')} "
+                       f"(defasagem máxima de {db.replica_staleness:g} s).")
+        
+        # Retention: move old results out of the hot tables into the archive files
+        st.subheader("Arquivamento de Resultados")
+        st.caption("Resultados arquivados continuam visíveis no histórico dos usuários. "
+                   "Testes ASK com avaliação pendente permanecem ativos.")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            older_than_months = st.number_input("Arquivar resultados com mais de (meses):", min_value=0, value=12,
+                                                key="archive_months")
+        with col2:
+            keep_latest = st.number_input("Manter ativos os últimos por usuário (0 = sem limite):", min_value=0,
+                                          value=0, key="archive_keep_latest")
+        
+        if st.button("Arquivar Resultados", key="archive_results"):
+            if not older_than_months and not keep_latest:
+                st.warning("Defina a idade ou a quantidade de resultados a manter.")
+            else:
+                moved = db.archive_old_results(older_than_months=older_than_months or None,
+                                               keep_latest=keep_latest or None)
+                st.success(f"{moved} resultado(s) arquivado(s).")
+    
+    with tab4:
+        # Full-text search over candidate and manager notes
+        st.subheader("Buscar nas Notas")
+        search_query = st.text_input("Palavras a buscar nas notas dos candidatos e gerentes:", key="notes_search")
+        
+        if search_query:
+            matches = db.search_notes(search_query, limit=50)
+            if not matches:
+                st.info("Nenhuma nota encontrada.")
+            
+            for test_id, username, completed_at, question_id, user_snippet, manager_snippet, _ in matches:
+                # Notes are typed by users, so they are shown as plain text, never as markdown
+                st.text(f"{username} - {format_timestamp(completed_at)} - Teste #{test_id} - Pergunta {question_id}")
+                if user_snippet:
+                    st.text(f"Candidato: {user_snippet}")
+                if manager_snippet:
+                    st.text(f"Gerente: {manager_snippet}")
+                st.markdown("---")
+    
     # Admin actions
     st.markdown("---")
     st.subheader("Ações de Administrador")
@@ -440,13 +672,15 @@ def admin_page():
     
     with col2:
         if st.button("Sair"):
-            # Clear all sessions
+            # End this browser's session only
             import sys
             import os
             sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
             from session_manager import SessionManager
             session_manager = SessionManager()
-            session_manager.clear_all_sessions()
+            if st.session_state.get('session_token'):
+                session_manager.delete_session(st.session_state['session_token'])
+            st.experimental_set_query_params()
             
             # Clear session state
             for key in ['logged_in', 'username', 'is_admin', 'session_token']:
@@ -356,19 +356,8 @@ def adti_test_page():
             st.markdown("**Papel Ideal:**")
             st.markdown(f"**{personality_type['ideal_role']}**")
         
-        # Save detailed results to database
-        # Find the primary type code from the personality_types dictionary
-        primary_type_code = None
-        for code, ptype in personality_types.items():
-            if ptype['type'] == personality_type['type']:
-                primary_type_code = code
-                break
-        
-        if primary_type_code is None:
-            # Fallback: use the first key if not found
-            primary_type_code = list(personality_types.keys())[0]
-        
-        db.save_adti_detailed_result(username, primary_type_code, all_scores, st.session_state.adti_answers)
+        # Save detailed results to database (the type name is stored as its type code)
+        db.save_adti_detailed_result(username, personality_type['type'], all_scores, st.session_state.adti_answers)
         
         # Reset button
         if st.button("Fazer Teste Novamente"):
@@ -1,6 +1,8 @@
 import streamlit as st
 import json
 from database import Database
+from answer_encoding import selected_option_names
+from timestamps import format_timestamp
 
 def ask_evaluation_page():
     """Admin page for evaluating ASK tests"""
@@ -11,7 +13,8 @@ def ask_evaluation_page():
     
     # Get all ASK tests
     try:
-        ask_tests = db.get_all_ask_tests_for_evaluation()
+        pending_only = st.checkbox("Mostrar apenas testes pendentes", key="ask_pending_only")
+        ask_tests = db.get_all_ask_tests_for_evaluation(pending_only=pending_only)
         
         if not ask_tests:
             st.info("Nenhum teste ASK encontrado para avaliação.")
@@ -32,7 +35,7 @@ def ask_evaluation_page():
         col1, col2, col3, col4 = st.columns([2, 1, 1, 1])
         
         with col1:
-            st.write(f"**{username}** - {completed_at}")
+            st.write(f"**{username}** - {format_timestamp(completed_at)}")
             st.write(f"Score: {score:.1f}")
         
         with col2:
@@ -60,7 +63,7 @@ def ask_evaluation_page():
                 username, test_type, score, answers_json, completed_at = test_result
                 
                 st.subheader(f"Avaliando: {username}")
-                st.write(f"**Data do Teste:** {completed_at}")
+                st.write(f"**Data do Teste:** {format_timestamp(completed_at)}")
                 st.write(f"**Pontuação Atual:** {score:.1f}")
                 
                 # Load framework data for questions
@@ -99,24 +102,13 @@ def ask_evaluation_page():
                     pillar = question.get('pillar', 'Unknown')
                     category = question.get('category', 'Unknown')
                     
-                    # Get selected skills names
+                    # Get selected skills names from the selected options bitmask
                     selected_skills_text = "None"
-                    if selected_options:
-                        try:
-                            selected_indices = json.loads(selected_options)
-                            option_set_name = question.get('option_set', '')
-                            if selected_indices and option_set_name in option_sets:
-                                options_list = option_sets[option_set_name]
-                                selected_skills = []
-                                for index in selected_indices:
-                                    if isinstance(index, int) and 0 <= index < len(options_list):
-                                        selected_skills.append(options_list[index])
-                                if selected_skills:
-                                    selected_skills_text = ", ".join(selected_skills[:3])  # Show first 3 skills
-                                    if len(selected_skills) > 3:
-                                        selected_skills_text += f" (+{len(selected_skills)-3} more)"
-                        except:
-                            selected_skills_text = "Error parsing"
+                    selected_skills = selected_option_names(selected_options, option_sets.get(question.get('option_set', ''), []))
+                    if selected_skills:
+                        selected_skills_text = ", ".join(selected_skills[:3])  # Show first 3 skills
+                        if len(selected_skills) > 3:
+                            selected_skills_text += f" (+{len(selected_skills)-3} more)"
                     
                     # Evaluation status - only show as evaluated if manager_rating is not None and not 0
                     status = "✅ Evaluated" if manager_rating and manager_rating > 0 else "⚠️ Pending"
@@ -203,34 +195,21 @@ def ask_evaluation_page():
                     st.write(f"**Conjunto de Opções:** {option_set_name}")
                     st.write(f"**Explicação:** {explanation}")
                     
-                    # Display selected options
-                    if selected_options:
-                        try:
-                            selected_indices = json.loads(selected_options)
-                            if selected_indices and option_set_name in option_sets:
-                                options_list = option_sets[option_set_name]
-                                selected_skills = []
-                                
-                                for index in selected_indices:
-                                    if isinstance(index, int) and 0 <= index < len(options_list):
-                                        selected_skills.append(options_list[index])
-                                    else:
-                                        selected_skills.append(f"Skill {index}")
-                                
-                                if selected_skills:
-                                    st.write(f"**Habilidades Selecionadas ({len(selected_skills)}):**")
-                                    cols = st.columns(3)
-                                    for i, skill_name in enumerate(selected_skills):
-                                        col_idx = i % 3
-                                        with cols[col_idx]:
-                                            st.write(f"• {skill_name}")
-                                else:
-                                    st.write("**Habilidades Selecionadas:** Nenhuma")
-                            else:
-                                st.write("**Habilidades Selecionadas:** Nenhuma habilidade selecionada")
-                        except Exception as e:
-                            st.write(f"**Opções Selecionadas:** {selected_options}")
-                            st.write(f"*Erro ao analisar opções: {e}*")
+                    # Display selected options (mask 0 is an answer with nothing selected, NULL is no data)
+                    if selected_options is not None:
+                        selected_skills = selected_option_names(selected_options, option_sets.get(option_set_name, []))
+                        
+                        if selected_skills:
+                            st.write(f"**Habilidades Selecionadas ({len(selected_skills)}):**")
+                            cols = st.columns(3)
+                            for i, skill_name in enumerate(selected_skills):
+                                col_idx = i % 3
+                                with cols[col_idx]:
+                                    st.write(f"• {skill_name}")
+                        elif selected_options:
+                            st.write("**Habilidades Selecionadas:** Nenhuma")
+                        else:
+                            st.write("**Habilidades Selecionadas:** Nenhuma habilidade selecionada")
                     
                     # Display user rating and notes
                     st.write(f"**Autoavaliação do Usuário:** {user_rating}/5")
@@ -385,7 +385,9 @@ def ask_test_page():
                 st.session_state.username,
                 results["career_level"],
                 results["combined_pillar_scores"],
-                results["answers"]
+                results["answers"],
+                user_pillar_scores=results["user_pillar_scores"],
+                manager_pillar_scores=results["manager_pillar_scores"]
             )
             
             st.success(f"Teste concluído e salvo! ID do Teste: {test_result_id}")
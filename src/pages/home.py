@@ -170,13 +170,15 @@ def home_page():
     
     with col6:
         if st.button("Sair"):
-            # Clear all sessions
+            # End this browser's session only
             import sys
             import os
             sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
             from session_manager import SessionManager
             session_manager = SessionManager()
-            session_manager.clear_all_sessions()
+            if st.session_state.get('session_token'):
+                session_manager.delete_session(st.session_state['session_token'])
+            st.experimental_set_query_params()
             
             # Clear session state
             for key in ['logged_in', 'username', 'is_admin', 'session_token']:
@@ -1,6 +1,17 @@
 import streamlit as st
 from database import Database
 from datetime import datetime, timedelta
+from password_hashing import HashingBusyError, LoginThrottledError, forwarded_client_address, trusted_proxy_count
+
+def client_address():
+    """Address of the browser as recorded by the trusted reverse proxies, or None without any"""
+    try:
+        from streamlit.web.server.websocket_headers import _get_websocket_headers
+        headers = _get_websocket_headers() or {}
+    except Exception:
+        return None
+    
+    return forwarded_client_address(headers.get('X-Forwarded-For'), trusted_proxy_count())
 
 def login_page():
     st.title("Entrar")
@@ -10,7 +21,7 @@ def login_page():
     import sys
     import os
     sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
-    from session_manager import SessionManager
+    from session_manager import SESSION_QUERY_PARAM, SessionManager
     session_manager = SessionManager()
     
     # Create login form
@@ -21,8 +32,15 @@ def login_page():
     
     if submit_button:
         if username and password:
-            # Verify user credentials
-            is_valid, is_admin = session_manager.db.verify_user(username, password)
+            # Verify user credentials (the bcrypt check runs on the shared hashing pool)
+            try:
+                is_valid, is_admin = session_manager.db.verify_user(username, password, client_address())
+            except LoginThrottledError as e:
+                st.error(f"Muitas tentativas de login sem sucesso. Tente novamente em {e.retry_after_seconds} segundos.")
+                return
+            except HashingBusyError:
+                st.warning("Muitos logins simultâneos no momento. Tente novamente em alguns segundos.")
+                return
             
             if is_valid:
                 # Create session token
@@ -36,6 +54,9 @@ def login_page():
                     st.session_state['session_token'] = session_token
                     st.session_state['page'] = "home"
                     
+                    # Keep the token in the URL so a reload of this browser restores its own session
+                    st.experimental_set_query_params(**{SESSION_QUERY_PARAM: session_token})
+                    
                     st.success(f"Bem-vindo, {username}!")
                     st.rerun()
                 else:
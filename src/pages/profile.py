@@ -4,9 +4,11 @@ import plotly.express as px
 import plotly.graph_objects as go
 import matplotlib.pyplot as plt
 import numpy as np
+import asyncio
 from database import Database
+from async_database import AsyncDatabase
 from datetime import datetime, timedelta
-import json
+from timestamps import format_timestamp
 
 def create_ask_polar_graph(pillar_scores, career_level):
     """Create a polar graph (radar chart) for ASK test results"""
@@ -50,6 +52,23 @@ def create_ask_polar_graph(pillar_scores, career_level):
     
     return fig
 
+async def load_profile_data(adb, username, include_archived=False):
+    """Fetch a user's statistics, latest results and latest score breakdowns concurrently"""
+    stats, (ask_results, _), (adti_results, _) = await asyncio.gather(
+        adb.get_user_result_stats(username, include_archived=include_archived),
+        adb.get_user_test_results_page(username, test_type='ASK', limit=4, include_archived=include_archived),
+        adb.get_user_test_results_page(username, test_type='ADTI', limit=4, include_archived=include_archived)
+    )
+    
+    # Score breakdowns of the latest ASK and ADTI results are independent as well
+    # (asyncio.sleep(0, value) stands in for a type without results)
+    ask_pillar_rows, adti_type_scores = await asyncio.gather(
+        adb.get_ask_pillar_scores(ask_results[0][0]) if ask_results else asyncio.sleep(0, []),
+        adb.get_adti_type_scores(adti_results[0][0]) if adti_results else asyncio.sleep(0, {})
+    )
+    
+    return stats, ask_results, adti_results, ask_pillar_rows, adti_type_scores
+
 def profile_page():
     st.title("Perfil do Usuário")
     st.markdown("---")
@@ -76,193 +95,149 @@ def profile_page():
         st.write(f"**Status de Login:** {'🟢 Ativo' if st.session_state.get('logged_in') else '🔴 Inativo'}")
         st.write(f"**Sessão:** {'🟢 Válida' if st.session_state.get('session_token') else '🔴 Expirada'}")
     
-    # Get test results
-    results = db.get_user_test_results(username)
+    # Archived results are only read when the full history is asked for
+    include_archived = st.checkbox("Incluir resultados arquivados", key="profile_include_archived")
     
-    # Fix any old ADTI results that have full names instead of codes
-    db.fix_adti_primary_type_codes()
+    # Get aggregate statistics and the latest 4 results of each test type in parallel
+    stats, ask_results, adti_results, ask_pillar_rows, adti_type_scores = asyncio.run(
+        load_profile_data(AsyncDatabase(), username, include_archived)
+    )
+    total_tests, avg_score, best_score, adti_count = stats
     
-    if results:
-        # Convert to DataFrame for easier analysis
-        test_data = []
-        for test_type, score, completed_at, answers in results:
-            test_data.append({
-                'Test Type': test_type,
-                'Score': score,
-                'Completed At': completed_at,
-                'Answers': answers
-            })
-        
-        df = pd.DataFrame(test_data)
-        
+    if total_tests:
         # Overall statistics
         st.subheader("Estatísticas Gerais")
         
         col1, col2, col3, col4 = st.columns(4)
         
         with col1:
-            st.metric("Total de Testes", len(results))
+            st.metric("Total de Testes", total_tests)
         
         with col2:
-            avg_score = df['Score'].mean()
             st.metric("Pontuação Média", f"{avg_score:.1f}")
         
         with col3:
-            best_score = df['Score'].max()
             st.metric("Melhor Pontuação", f"{best_score:.1f}")
         
         with col4:
-            recent_tests = len([r for r in results if r[0] == 'ADTI'])
-            st.metric("Testes ADTI", recent_tests)
+            st.metric("Testes ADTI", adti_count)
         
         # Detailed results section
         st.subheader("Resultados Detalhados dos Testes")
         
-        # Group by test type
-        ask_results = [r for r in results if r[0] == 'ASK']
-        adti_results = [r for r in results if r[0] == 'ADTI']
-        
         # ASK Test Results with detailed analysis
         if ask_results:
             st.write("**Resultados do Teste ASK:**")
             
             # Show latest ASK result with detailed analysis
             latest_ask = ask_results[0]  # Most recent result
-            test_type, score, completed_at, answers_str = latest_ask
+            result_id, test_type, score, completed_at, career_level, primary_type = latest_ask
             
-            st.write(f"**Último Teste:** {completed_at}")
+            st.write(f"**Último Teste:** {format_timestamp(completed_at)}")
             
-            # Parse detailed results if available
-            try:
-                detailed_data = json.loads(answers_str)
-                if isinstance(detailed_data, dict) and 'pillar_scores' in detailed_data:
-                    pillar_scores = detailed_data['pillar_scores']
-                    career_level = detailed_data.get('career_level', 'Unknown')
-                    
-                    st.write(f"**Nível de Carreira:** {career_level}")
-                    st.write(f"**Pontuação Geral:** {score:.1f}")
-                    
-                    # Check if we have separate evaluation scores
-                    if 'user_weighted_score' in detailed_data and 'manager_weighted_score' in detailed_data:
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.metric("Autoavaliação", f"{detailed_data.get('user_weighted_score', 0):.1f}")
-                        with col2:
-                            manager_score = detailed_data.get('manager_weighted_score', 0)
-                            if manager_score > 0:
-                                st.metric("Avaliação do Líder", f"{manager_score:.1f}")
-                            else:
-                                st.metric("Avaliação do Líder", "Não avaliado")
-                        with col3:
-                            st.metric("Pontuação Combinada", f"{detailed_data.get('combined_weighted_score', 0):.1f}")
-                    
-                    # Check if we have detailed results
-                    if 'meets_current_level' in detailed_data:
-                        st.write(f"**Atende ao Nível Atual:** {'✅ Sim' if detailed_data.get('meets_current_level', False) else '❌ Não'}")
-                    
-                    # Create and display polar graph
-                    st.subheader("Análise do Gráfico Polar")
-                    fig = create_ask_polar_graph(pillar_scores, career_level)
-                    st.pyplot(fig)
+            # Pillar scores of the latest result were loaded with the page data
+            pillar_rows = ask_pillar_rows
+            if pillar_rows:
+                pillar_scores = {pillar: combined_score or 0 for pillar, _, _, combined_score in pillar_rows}
+                user_pillar_scores = {pillar: user_score for pillar, user_score, _, _ in pillar_rows if user_score is not None}
+                manager_pillar_scores = {pillar: manager_score for pillar, _, manager_score, _ in pillar_rows if manager_score is not None}
+                career_level = career_level or 'Unknown'
+                
+                st.write(f"**Nível de Carreira:** {career_level}")
+                st.write(f"**Pontuação Geral:** {score:.1f}")
+                
+                # Create and display polar graph
+                st.subheader("Análise do Gráfico Polar")
+                fig = create_ask_polar_graph(pillar_scores, career_level)
+                st.pyplot(fig)
+                
+                # Show pillar scores with visual representation
+                st.subheader("Análise dos Pilares")
+                
+                # Check if we have separate pillar scores
+                if user_pillar_scores and manager_pillar_scores:
+                    col1, col2 = st.columns(2)
                     
-                    # Show pillar scores with visual representation
-                    st.subheader("Análise dos Pilares")
+                    with col1:
+                        st.write("**Pontuações dos Pilares de Autoavaliação:**")
+                        for pillar, pillar_score in user_pillar_scores.items():
+                            progress = pillar_score / 100  # Normalize to 0-1
+                            st.write(f"**{pillar}:** {pillar_score:.1f}")
+                            st.progress(progress)
                     
-                    # Check if we have separate pillar scores
-                    if 'user_pillar_scores' in detailed_data and 'manager_pillar_scores' in detailed_data:
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            st.write("**Pontuações dos Pilares de Autoavaliação:**")
-                            for pillar, pillar_score in detailed_data['user_pillar_scores'].items():
-                                progress = pillar_score / 100  # Normalize to 0-1
-                                st.write(f"**{pillar}:** {pillar_score:.1f}")
-                                st.progress(progress)
-                        
-                        with col2:
-                            st.write("**Pontuações dos Pilares de Avaliação do Líder:**")
-                            for pillar, pillar_score in detailed_data['manager_pillar_scores'].items():
-                                if pillar_score > 0:
-                                    progress = pillar_score / 100  # Normalize to 0-1
-                                    st.write(f"**{pillar}:** {pillar_score:.1f}")
-                                    st.progress(progress)
-                                else:
-                                    st.write(f"**{pillar}:** Não avaliado")
-                                    st.progress(0)
-                        
-                        # Combined scores
-                        st.subheader("Pontuações Combinadas dos Pilares")
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            for pillar, pillar_score in pillar_scores.items():
-                                progress = pillar_score / 100  # Normalize to 0-1
-                                st.write(f"**{pillar}:** {pillar_score:.1f}")
-                                st.progress(progress)
-                        
-                        with col2:
-                            # Show score range and strengths/weaknesses
-                            min_score = min(pillar_scores.values())
-                            max_score = max(pillar_scores.values())
-                            st.write(f"**Faixa de Pontuação:** {min_score:.1f} - {max_score:.1f}")
-                            st.write(f"**Pontuação Média:** {sum(pillar_scores.values()) / len(pillar_scores):.1f}")
-                            
-                            # Show strengths and weaknesses
-                            sorted_pillars = sorted(pillar_scores.items(), key=lambda x: x[1], reverse=True)
-                            st.write("**Principal Ponto Forte:** " + sorted_pillars[0][0])
-                            st.write("**Área para Melhorar:** " + sorted_pillars[-1][0])
-                    else:
-                        # Fallback for old format
-                        col1, col2 = st.columns(2)
-                        
-                        with col1:
-                            for pillar, pillar_score in pillar_scores.items():
+                    with col2:
+                        st.write("**Pontuações dos Pilares de Avaliação do Líder:**")
+                        for pillar, pillar_score in manager_pillar_scores.items():
+                            if pillar_score > 0:
                                 progress = pillar_score / 100  # Normalize to 0-1
                                 st.write(f"**{pillar}:** {pillar_score:.1f}")
                                 st.progress(progress)
-                        
-                        with col2:
-                            # Show score range and strengths/weaknesses
-                            min_score = min(pillar_scores.values())
-                            max_score = max(pillar_scores.values())
-                            st.write(f"**Score Range:** {min_score:.1f} - {max_score:.1f}")
-                            st.write(f"**Average Score:** {sum(pillar_scores.values()) / len(pillar_scores):.1f}")
-                            
-                            # Show strengths and weaknesses
-                            sorted_pillars = sorted(pillar_scores.items(), key=lambda x: x[1], reverse=True)
-                            st.write("**🏆 Top Strength:** " + sorted_pillars[0][0])
-                            st.write("**📈 Area to Improve:** " + sorted_pillars[-1][0])
-                    
-                    # Show top 5 gaps if available
-                    if 'top5_gaps' in detailed_data and detailed_data['top5_gaps']:
-                        st.subheader("Principais Habilidades para Desenvolver")
-                        st.write("**Foque em seguida:**")
-                        for i, gap in enumerate(detailed_data['top5_gaps'][:5], 1):
-                            st.write(f"{i}. **{gap['question']}** ({gap['pillar']}) - Atual: {gap['user_rating']}/5")
+                            else:
+                                st.write(f"**{pillar}:** Não avaliado")
+                                st.progress(0)
                     
-                    # Show career progression
-                    career_progression = ["Estagiário", "Júnior", "Pleno", "Sênior", "Especialista", "PM", "Gestor"]
-                    current_idx = career_progression.index(career_level) if career_level in career_progression else 0
-                    next_level = career_progression[min(current_idx + 1, len(career_progression) - 1)]
+                    # Combined scores
+                    st.subheader("Pontuações Combinadas dos Pilares")
+                    col1, col2 = st.columns(2)
                     
-                    st.subheader("Progressão de Carreira")
-                    st.write(f"**Nível Atual:** {career_level}")
-                    if career_level != "Gestor":
-                        st.write(f"**Próximo Nível:** {next_level}")
+                    with col1:
+                        for pillar, pillar_score in pillar_scores.items():
+                            progress = pillar_score / 100  # Normalize to 0-1
+                            st.write(f"**{pillar}:** {pillar_score:.1f}")
+                            st.progress(progress)
                     
-                    # Show previous results
-                    if len(ask_results) > 1:
-                        st.subheader("Evolução de Carreira")
-                        st.write("**Resultados Anteriores do ASK:**")
-                        for i, result in enumerate(ask_results[1:4], 1):  # Show last 3 previous results
-                            prev_test_type, prev_score, prev_completed_at, prev_answers = result
-                            st.write(f"Tentativa {i}: {prev_score:.1f} - {prev_completed_at}")
-                
+                    with col2:
+                        # Show score range and strengths/weaknesses
+                        min_score = min(pillar_scores.values())
+                        max_score = max(pillar_scores.values())
+                        st.write(f"**Faixa de Pontuação:** {min_score:.1f} - {max_score:.1f}")
+                        st.write(f"**Pontuação Média:** {sum(pillar_scores.values()) / len(pillar_scores):.1f}")
+                        
+                        # Show strengths and weaknesses
+                        sorted_pillars = sorted(pillar_scores.items(), key=lambda x: x[1], reverse=True)
+                        st.write("**Principal Ponto Forte:** " + sorted_pillars[0][0])
+                        st.write("**Área para Melhorar:** " + sorted_pillars[-1][0])
                 else:
-                    st.write("**Nível de Carreira:** Resultado padrão do ASK")
-                    st.write(f"**Pontuação:** {score:.1f}")
+                    # Fallback for results saved without separate scores
+                    col1, col2 = st.columns(2)
+                    
+                    with col1:
+                        for pillar, pillar_score in pillar_scores.items():
+                            progress = pillar_score / 100  # Normalize to 0-1
+                            st.write(f"**{pillar}:** {pillar_score:.1f}")
+                            st.progress(progress)
                     
-            except (json.JSONDecodeError, KeyError):
+                    with col2:
+                        # Show score range and strengths/weaknesses
+                        min_score = min(pillar_scores.values())
+                        max_score = max(pillar_scores.values())
+                        st.write(f"**Score Range:** {min_score:.1f} - {max_score:.1f}")
+                        st.write(f"**Average Score:** {sum(pillar_scores.values()) / len(pillar_scores):.1f}")
+                        
+                        # Show strengths and weaknesses
+                        sorted_pillars = sorted(pillar_scores.items(), key=lambda x: x[1], reverse=True)
+                        st.write("**🏆 Top Strength:** " + sorted_pillars[0][0])
+                        st.write("**📈 Area to Improve:** " + sorted_pillars[-1][0])
+                
+                # Show career progression
+                career_progression = ["Estagiário", "Júnior", "Pleno", "Sênior", "Especialista", "PM", "Gestor"]
+                current_idx = career_progression.index(career_level) if career_level in career_progression else 0
+                next_level = career_progression[min(current_idx + 1, len(career_progression) - 1)]
+                
+                st.subheader("Progressão de Carreira")
+                st.write(f"**Nível Atual:** {career_level}")
+                if career_level != "Gestor":
+                    st.write(f"**Próximo Nível:** {next_level}")
+                
+                # Show previous results
+                if len(ask_results) > 1:
+                    st.subheader("Evolução de Carreira")
+                    st.write("**Resultados Anteriores do ASK:**")
+                    for i, result in enumerate(ask_results[1:4], 1):  # Show last 3 previous results
+                        prev_score, prev_completed_at = result[2], result[3]
+                        st.write(f"Tentativa {i}: {prev_score:.1f} - {format_timestamp(prev_completed_at)}")
+            
+            else:
                 st.write("**Nível de Carreira:** Resultado padrão do ASK")
                 st.write(f"**Pontuação:** {score:.1f}")
         
@@ -292,92 +267,81 @@ def profile_page():
             
             # Show latest ADTI result with detailed analysis
             latest_adti = adti_results[0]  # Most recent result
-            test_type, score, completed_at, answers_str = latest_adti
+            result_id, test_type, score, completed_at, career_level, primary_type = latest_adti
             
-            st.write(f"**Latest Test:** {completed_at}")
+            st.write(f"**Latest Test:** {format_timestamp(completed_at)}")
             
-            # Parse detailed results if available
-            try:
-                detailed_data = json.loads(answers_str)
-                if isinstance(detailed_data, dict) and 'all_scores' in detailed_data:
-                    all_scores = detailed_data['all_scores']
-                    primary_type = detailed_data.get('primary_type', 'Unknown')
-                    
-                    # Get the primary type name from the code
-                    primary_type_name = personality_types.get(primary_type, {}).get('type', primary_type)
-                    
-                    st.write(f"**Primary Type:** {primary_type_name}")
-                    st.write(f"**Primary Type Score:** {score:.1f}")
-                    
-                    # Show score range information
-                    min_score = min(all_scores.values())
-                    max_score = max(all_scores.values())
-                    st.write(f"**Score Range:** {min_score:.1f} - {max_score:.1f}")
-                    
-                    # Sort personalities by score
-                    sorted_scores = sorted(all_scores.items(), key=lambda x: x[1], reverse=True)
-                    top_5 = sorted_scores[:5]
-                    least_5 = sorted_scores[-5:]
-                    
-                    # Display detailed analysis
-                    st.subheader("🎯 Personality Analysis")
-                    
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.markdown("**🏆 Top 5 Personality Matches:**")
-                        for i, (code, score_val) in enumerate(top_5, 1):
-                            personality = personality_types.get(code, {"type": code, "category": "Unknown"})
-                            st.markdown(f"{i}. **{personality['type']}** ({code}) - Score: {score_val:.1f}")
-                            st.markdown(f"   Category: {personality['category']}")
-                    
-                    with col2:
-                        st.markdown("**📉 Least 5 Personality Matches:**")
-                        for i, (code, score_val) in enumerate(least_5, 1):
-                            personality = personality_types.get(code, {"type": code, "category": "Unknown"})
-                            st.markdown(f"{i}. **{personality['type']}** ({code}) - Score: {score_val:.1f}")
-                            st.markdown(f"   Category: {personality['category']}")
-                    
-                    # Show category breakdown
-                    st.subheader("📈 Category Analysis")
-                    category_scores = {}
-                    for code, score_val in all_scores.items():
-                        personality = personality_types.get(code, {"category": "Unknown"})
-                        category = personality['category']
-                        if category not in category_scores:
-                            category_scores[category] = []
-                        category_scores[category].append((code, score_val))
-                    
-                    for category, scores in category_scores.items():
-                        avg_score = sum(score for _, score in scores) / len(scores)
-                        max_score = max(scores, key=lambda x: x[1])
-                        st.write(f"**{category}:** Average: {avg_score:.1f}, Highest: {personality_types[max_score[0]]['type']} ({max_score[1]:.1f})")
-                    
-                    # Show personality evolution over time
-                    if len(adti_results) > 1:
-                        st.subheader("📊 Personality Evolution")
-                        st.write("**Previous ADTI Results:**")
-                        for i, result in enumerate(adti_results[1:4], 1):  # Show last 3 previous results
-                            prev_test_type, prev_score, prev_completed_at, prev_answers = result
-                            st.write(f"Attempt {i+1}: {prev_score} - {prev_completed_at}")
+            # Type scores of the latest result were loaded with the page data
+            all_scores = adti_type_scores
+            if all_scores:
+                primary_type = primary_type or 'Unknown'
                 
-                else:
-                    st.write("**Primary Type:** Standard ADTI result")
-                    st.write(f"**Primary Type Score:** {score:.1f}")
-                    
-            except (json.JSONDecodeError, KeyError):
+                # Get the primary type name from the code
+                primary_type_name = personality_types.get(primary_type, {}).get('type', primary_type)
+                
+                st.write(f"**Primary Type:** {primary_type_name}")
+                st.write(f"**Primary Type Score:** {score:.1f}")
+                
+                # Show score range information
+                min_score = min(all_scores.values())
+                max_score = max(all_scores.values())
+                st.write(f"**Score Range:** {min_score:.1f} - {max_score:.1f}")
+                
+                # Sort personalities by score
+                sorted_scores = sorted(all_scores.items(), key=lambda x: x[1], reverse=True)
+                top_5 = sorted_scores[:5]
+                least_5 = sorted_scores[-5:]
+                
+                # Display detailed analysis
+                st.subheader("🎯 Personality Analysis")
+                
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    st.markdown("**🏆 Top 5 Personality Matches:**")
+                    for i, (code, score_val) in enumerate(top_5, 1):
+                        personality = personality_types.get(code, {"type": code, "category": "Unknown"})
+                        st.markdown(f"{i}. **{personality['type']}** ({code}) - Score: {score_val:.1f}")
+                        st.markdown(f"   Category: {personality['category']}")
+                
+                with col2:
+                    st.markdown("**📉 Least 5 Personality Matches:**")
+                    for i, (code, score_val) in enumerate(least_5, 1):
+                        personality = personality_types.get(code, {"type": code, "category": "Unknown"})
+                        st.markdown(f"{i}. **{personality['type']}** ({code}) - Score: {score_val:.1f}")
+                        st.markdown(f"   Category: {personality['category']}")
+                
+                # Show category breakdown
+                st.subheader("📈 Category Analysis")
+                category_scores = {}
+                for code, score_val in all_scores.items():
+                    personality = personality_types.get(code, {"category": "Unknown"})
+                    category = personality['category']
+                    if category not in category_scores:
+                        category_scores[category] = []
+                    category_scores[category].append((code, score_val))
+                
+                for category, scores in category_scores.items():
+                    avg_score = sum(score for _, score in scores) / len(scores)
+                    max_score = max(scores, key=lambda x: x[1])
+                    st.write(f"**{category}:** Average: {avg_score:.1f}, Highest: {personality_types[max_score[0]]['type']} ({max_score[1]:.1f})")
+                
+                # Show personality evolution over time
+                if len(adti_results) > 1:
+                    st.subheader("📊 Personality Evolution")
+                    st.write("**Previous ADTI Results:**")
+                    for i, result in enumerate(adti_results[1:4], 1):  # Show last 3 previous results
+                        prev_score, prev_completed_at = result[2], result[3]
+                        st.write(f"Attempt {i+1}: {prev_score} - {format_timestamp(prev_completed_at)}")
+            
+            else:
                 st.write("**Primary Type:** Standard ADTI result")
                 st.write(f"**Primary Type Score:** {score:.1f}")
         
         # Performance insights
         st.subheader("💡 Performance Insights")
         
-        if len(test_data) > 0:
-            # Calculate insights
-            avg_score = df['Score'].mean()
-            best_score = df['Score'].max()
-            test_count = len(df)
-            
+        if total_tests > 0:
             col1, col2, col3 = st.columns(3)
             
             with col1:
@@ -387,7 +351,7 @@ def profile_page():
                 st.metric("Best Score", f"{best_score:.1f}")
             
             with col3:
-                st.metric("Tests Taken", test_count)
+                st.metric("Tests Taken", total_tests)
             
             # Recommendations
             st.write("**🎯 Recommendations:**")
@@ -397,7 +361,7 @@ def profile_page():
                 st.info("Good performance! Consider exploring advanced topics in AI and Data Science.")
             else:
                 st.success("Excellent performance! You have a strong foundation in AI and Data Science.")
-        
+    
     else:
         st.info("No test results found. Take some tests to see your results here!")
         
@@ -427,13 +391,15 @@ def profile_page():
     
     with col2:
         if st.button("🚪 Logout"):
-            # Clear all sessions
+            # End this browser's session only
             import sys
             import os
             sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
             from session_manager import SessionManager
             session_manager = SessionManager()
-            session_manager.clear_all_sessions()
+            if st.session_state.get('session_token'):
+                session_manager.delete_session(st.session_state['session_token'])
+            st.experimental_set_query_params()
             
             # Clear session state
             for key in ['logged_in', 'username', 'is_admin', 'session_token']:
@@ -0,0 +1,16 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Empty working directory holding the question framework the database seeds from"""
+    shutil.copy(os.path.join(ROOT, 'framework.json'), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('DS_EVAL_HASH_WORKERS', '0')
+    return tmp_path
@@ -0,0 +1,59 @@
+import sqlite3
+
+import pytest
+
+from database import Database, RESULT_REMOVAL_ORDER
+from timestamps import MS_PER_MONTH, now_ms
+
+ANSWERS = {
+    1: {'selected_options': [0, 2], 'user_rating': 4, 'user_notes': 'liderança em projetos', 'manager_rating': 4},
+    2: {'selected_options': [1], 'user_rating': 3, 'user_notes': '', 'manager_rating': 3},
+}
+
+def count_user_rows(path):
+    """Rows of every per-result table of one file"""
+    with sqlite3.connect(path) as conn:
+        return {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] for table, _ in RESULT_REMOVAL_ORDER}
+
+@pytest.mark.parametrize('shard_count', [1, 2])
+def test_delete_user_removes_results_sessions_and_tokens_in_every_tier(workdir, shard_count):
+    db = Database(str(workdir / 'app.db'), shard_count=shard_count, signed_sessions=True)
+    db.create_user('alice')
+    # An old ASK result (evaluated, so it can be archived), a recent ASK result and an ADTI result
+    db.bulk_import_results([
+        *({'test_type': 'ASK', 'username': 'alice', 'career_level': 'Data Analyst', 'pillar_scores': {'Technical': 70},
+           'answers': ANSWERS, 'completed_at': completed_at} for completed_at in (now_ms() - 24 * MS_PER_MONTH, now_ms())),
+        {'test_type': 'ADTI', 'username': 'alice', 'primary_type': 'DSTA', 'all_scores': {'DSTA': 80, 'DVRT': 20}},
+    ])
+    assert db.archive_old_results(older_than_months=12) == 1
+    
+    signed_token = db.create_session('alice', False)
+    db.signed_sessions = False
+    session_token = db.create_session('alice', False)
+    assert db.validate_session(signed_token) and db.validate_session(session_token)
+    assert db.get_ask_option_frequencies(1)[0] == 1
+    assert db.search_notes('lideranca')
+    
+    assert db.delete_user('alice')
+    
+    for path in db.shard_paths() + db.archive_paths():
+        assert set(count_user_rows(path).values()) == {0}, path
+    assert db.get_ask_option_frequencies(1)[0] == 0
+    assert db.search_notes('lideranca') == []
+    assert db.validate_session(session_token) is None
+    assert db.validate_session(signed_token) is None
+    assert not db.user_exists('alice')
+
+def test_recreated_user_gets_valid_signed_tokens(workdir, monkeypatch):
+    db = Database(str(workdir / 'app.db'), signed_sessions=True)
+    db.create_user('bob')
+    assert db.delete_user('bob')
+    
+    db.create_user('bob')
+    monkeypatch.setattr('database.now_ms', lambda: now_ms() + 1)
+    assert db.validate_session(db.create_session('bob', False)) is not None
+
+def test_delete_user_keeps_admin(workdir):
+    db = Database(str(workdir / 'app.db'))
+    assert not db.delete_user('admin')
+    assert db.user_exists('admin')
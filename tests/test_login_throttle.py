@@ -0,0 +1,57 @@
+import pytest
+
+import password_hashing
+from password_hashing import LoginThrottle, LoginThrottledError, forwarded_client_address
+
+def test_forwarded_client_address_ignores_client_supplied_hops():
+    header = "6.6.6.6, 203.0.113.7, 10.0.0.2"
+    assert forwarded_client_address(header, 0) is None
+    assert forwarded_client_address(header, 1) == "10.0.0.2"
+    assert forwarded_client_address(header, 2) == "203.0.113.7"
+    assert forwarded_client_address("203.0.113.7", 2) is None
+    assert forwarded_client_address(None, 1) is None
+
+def test_username_is_slowed_down_not_locked(monkeypatch):
+    clock = [1_000_000]
+    monkeypatch.setattr(password_hashing, 'now_ms', lambda: clock[0])
+    throttle = LoginThrottle(max_failures=3, window_seconds=300)
+    
+    for _ in range(3):
+        throttle.check('alice')
+        throttle.record_failure('alice')
+    
+    with pytest.raises(LoginThrottledError):
+        throttle.check('alice')
+    
+    # One second after the last failure the owner may try again
+    clock[0] += 1000
+    throttle.check('alice')
+    throttle.record_failure('alice')
+    
+    clock[0] += 1000
+    with pytest.raises(LoginThrottledError):
+        throttle.check('alice')
+    clock[0] += 1000
+    throttle.check('alice')
+    
+    # The wait never grows past the cap
+    for _ in range(20):
+        throttle.record_failure('alice')
+    clock[0] += password_hashing.USERNAME_BACKOFF_MS << password_hashing.USERNAME_BACKOFF_STEPS
+    throttle.check('alice')
+
+def test_address_is_locked_for_the_window(monkeypatch):
+    clock = [1_000_000]
+    monkeypatch.setattr(password_hashing, 'now_ms', lambda: clock[0])
+    throttle = LoginThrottle(max_failures=3, window_seconds=300)
+    
+    for index in range(3):
+        throttle.record_failure(f'user{index}', '203.0.113.7')
+    
+    clock[0] += 60_000
+    with pytest.raises(LoginThrottledError):
+        throttle.check('someone', '203.0.113.7')
+    throttle.check('someone', '198.51.100.1')
+    
+    clock[0] += 240_000
+    throttle.check('someone', '203.0.113.7')
@@ -0,0 +1,25 @@
+import sqlite3
+
+from migrations import MIGRATIONS, convert_timestamps_to_epoch_ms, legacy_timestamp_to_ms, run_migrations
+
+def test_legacy_timestamps():
+    assert legacy_timestamp_to_ms('2024-05-01 10:00:00') == 1714557600000
+    assert legacy_timestamp_to_ms('not a date') is None
+
+def test_applied_at_is_epoch_ms(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'app.db', isolation_level=None)
+    run_migrations(conn)
+    rows = conn.execute('SELECT typeof(applied_at) FROM schema_version').fetchall()
+    assert len(rows) == len(MIGRATIONS)
+    assert {row[0] for row in rows} == {'integer'}
+
+def test_unparseable_timestamps_are_not_epoch(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'app.db', isolation_level=None)
+    run_migrations(conn)
+    conn.execute("INSERT INTO users (username, password_hash, created_at) VALUES ('ana', 'x', 'garbage')")
+    conn.execute("INSERT INTO temp_passwords (username, password, expires_at) VALUES ('ana', 'x', 'garbage')")
+    
+    convert_timestamps_to_epoch_ms(conn.cursor())
+    
+    assert conn.execute("SELECT created_at FROM users WHERE username = 'ana'").fetchone() == (None,)
+    assert conn.execute("SELECT expires_at FROM temp_passwords WHERE username = 'ana'").fetchone() == (0,)
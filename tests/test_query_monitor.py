@@ -0,0 +1,15 @@
+from database import Database
+from query_monitor import get_query_monitor
+
+def test_statements_are_attributed_to_the_public_database_method(workdir):
+    db = Database(str(workdir / 'app.db'), shard_count=2)
+    monitor = get_query_monitor()
+    monitor.reset()
+    
+    db.get_user_test_results_page('admin')
+    # Shard workers run nested query functions on threads that never saw the public method
+    db.search_notes('lideranca')
+    
+    methods = {statement['method'] for statement in monitor.top_statements(limit=100)}
+    assert {'get_user_test_results_page', 'search_notes'} <= methods
+    assert 'unknown' not in methods
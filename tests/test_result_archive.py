@@ -0,0 +1,59 @@
+from database import ConnectionManager, Database
+from timestamps import MS_PER_MONTH, now_ms
+
+def test_profile_reads_skip_the_archive_unless_asked(workdir, monkeypatch):
+    db = Database(str(workdir / 'app.db'))
+    db.create_user('carol')
+    db.bulk_import_results({'test_type': 'ADTI', 'username': 'carol', 'primary_type': 'DSTA',
+                            'all_scores': {'DSTA': 10 * age + 1}, 'completed_at': now_ms() - age * MS_PER_MONTH}
+                           for age in [0, 1, 24, 25, 26])
+    assert db.archive_old_results(older_than_months=12) == 3
+    
+    # Any read of the archive opens a cursor on its connection manager
+    archive_reads = []
+    archive_path = db.archive_paths()[0]
+    original_cursor = ConnectionManager.cursor
+    def tracking_cursor(self, *args, **kwargs):
+        if self.db_path == archive_path or archive_path in (kwargs.get('attach') or {}).values():
+            archive_reads.append(self.db_path)
+        return original_cursor(self, *args, **kwargs)
+    monkeypatch.setattr(ConnectionManager, 'cursor', tracking_cursor)
+    
+    assert db.get_user_result_stats('carol')[0] == 2
+    assert archive_reads == []
+    
+    # The first page holds the hot results and a cursor into the archived ones
+    results, next_cursor = db.get_user_test_results_page('carol', limit=4)
+    assert [score for _, _, score, *_ in results] == [1, 11]
+    assert next_cursor is not None
+    results, next_cursor = db.get_user_test_results_page('carol', after_completed_at=next_cursor[0],
+                                                         after_id=next_cursor[1], limit=4)
+    assert [score for _, _, score, *_ in results] == [241, 251, 261]
+    assert next_cursor is None
+    
+    results, next_cursor = db.get_user_test_results_page('carol', limit=4, include_archived=True)
+    assert len(results) == 4 and next_cursor is not None
+    assert db.get_user_test_results_page('carol', after_completed_at=next_cursor[0], after_id=next_cursor[1],
+                                         limit=4)[0] == [db.get_user_test_results('carol')[-1]]
+    total, average, best, adti = db.get_user_result_stats('carol', include_archived=True)
+    assert (total, best, adti) == (5, 261, 5)
+    assert archive_reads
+
+def test_paging_continues_from_hot_into_archived_results(workdir):
+    db = Database(str(workdir / 'app.db'))
+    db.create_user('dave')
+    db.bulk_import_results({'test_type': 'ADTI', 'username': 'dave', 'primary_type': 'DSTA',
+                            'all_scores': {'DSTA': age}, 'completed_at': now_ms() - age * MS_PER_MONTH}
+                           for age in range(6))
+    assert db.archive_old_results(keep_latest=2) == 4
+    
+    pages, cursor = [], (None, None)
+    while True:
+        results, next_cursor = db.get_user_test_results_page('dave', after_completed_at=cursor[0],
+                                                             after_id=cursor[1], limit=2)
+        pages.append([score for _, _, score, *_ in results])
+        if next_cursor is None:
+            break
+        cursor = next_cursor
+    
+    assert pages == [[0, 1], [2, 3], [4, 5]]
@@ -0,0 +1,31 @@
+import pytest
+
+import session_manager
+from session_manager import SessionManager
+
+@pytest.mark.parametrize('signed', [False, True])
+def test_restore_rotates_url_token(workdir, monkeypatch, signed):
+    if signed:
+        monkeypatch.setenv('DS_EVAL_SESSION_TOKENS', 'signed')
+    manager = SessionManager()
+    url_token = manager.create_session('admin', True, 'profile')
+    
+    restored = manager.get_current_session(url_token)
+    
+    assert restored['username'] == 'admin' and restored['current_page'] == 'profile'
+    assert restored['token'] != url_token
+    assert manager.validate_session(url_token) is None
+    assert manager.get_current_session(url_token) is None
+    assert manager.validate_session(restored['token']) is not None
+
+def test_old_url_tokens_do_not_restore(workdir, monkeypatch):
+    manager = SessionManager()
+    url_token = manager.create_session('admin', True)
+    user_info = manager.validate_session(url_token)
+    assert not manager.needs_rotation(user_info)
+    
+    clock = user_info['created_at'] + manager.url_token_ttl_ms + 1
+    monkeypatch.setattr(session_manager, 'now_ms', lambda: clock)
+    
+    assert manager.needs_rotation(user_info)
+    assert manager.get_current_session(url_token) is None
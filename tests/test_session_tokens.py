@@ -0,0 +1,19 @@
+import database
+from database import Database
+from session_tokens import RevocationList
+
+def test_revoke_all_covers_tokens_issued_in_the_same_millisecond():
+    revocations = RevocationList()
+    revocations.revoke_all(1000)
+    assert revocations.is_revoked({'u': 'alice', 'iat': 1000, 'jti': 'a'})
+    assert not revocations.is_revoked({'u': 'alice', 'iat': 1001, 'jti': 'a'})
+
+def test_delete_all_sessions_revokes_signed_token_issued_in_the_same_millisecond(workdir, monkeypatch):
+    db = Database(str(workdir / 'app.db'), signed_sessions=True)
+    monkeypatch.setattr(database, 'now_ms', lambda: 1_800_000_000_000)
+    
+    session_token = db.create_session('admin', True)
+    assert db.validate_session(session_token) is not None
+    
+    db.delete_all_sessions()
+    assert db.validate_session(session_token) is None
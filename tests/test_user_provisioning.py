@@ -0,0 +1,26 @@
+from database import Database
+from user_provisioning import decode_csv, parse_users_csv
+
+def test_semicolon_separated_excel_export():
+    data = 'Usuário;Senha\nana;segredo123\nbia;\n'.encode('cp1252')
+    assert parse_users_csv(decode_csv(data)) == ([(2, 'ana', 'segredo123'), (3, 'bia', None)], [])
+
+def test_utf8_with_bom_and_commas():
+    data = '\ufeffusername,password\nana,segredo123\n'.encode('utf-8')
+    assert parse_users_csv(decode_csv(data)) == ([(2, 'ana', 'segredo123')], [])
+
+def test_concurrently_created_username_fails_only_its_row(workdir, monkeypatch):
+    db = Database(str(workdir / 'app.db'))
+    
+    # Another admin creates 'bia' after the existence check, while the batch is being prepared
+    temp_password_key = db._temp_password_key
+    def create_meanwhile():
+        db.create_user('bia')
+        return temp_password_key()
+    monkeypatch.setattr(db, '_temp_password_key', create_meanwhile)
+    
+    created, failures = db.create_users([(1, 'ana', None), (2, 'bia', None), (3, 'caio', None)])
+    
+    assert [username for username, _, _ in created] == ['ana', 'caio']
+    assert failures == [(2, 'bia', "Username already exists")]
+    assert db.user_exists('ana') and db.user_exists('caio')
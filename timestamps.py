@@ -0,0 +1,39 @@
+"""
+Epoch-millisecond timestamp helpers.
+
+Timestamps are stored as INTEGER milliseconds since the Unix epoch (UTC), so
+range filters compare integers on indexes and nothing is parsed when rows are
+read. format_timestamp is the one place where they become display strings.
+"""
+
+import time
+from datetime import datetime
+
+MS_PER_HOUR = 60 * 60 * 1000
+MS_PER_DAY = 24 * MS_PER_HOUR
+MS_PER_WEEK = 7 * MS_PER_DAY
+MS_PER_MONTH = 30 * MS_PER_DAY
+
+# Current time in epoch milliseconds, for column defaults and SQL-side writes
+EPOCH_MS_NOW_SQL = "CAST((julianday('now') - 2440587.5) * 86400000 AS INTEGER)"
+
+def now_ms():
+    """Return the current time in epoch milliseconds"""
+    return time.time_ns() // 1_000_000
+
+def to_epoch_ms(value):
+    """Convert a datetime, ISO string or epoch-ms number to epoch milliseconds (naive values are local time)"""
+    if value is None or isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value)
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    
+    return round(value.timestamp() * 1000)
+
+def format_timestamp(value, fmt='%Y-%m-%d %H:%M', default='N/A'):
+    """Format an epoch-ms timestamp in local time for display"""
+    if value is None:
+        return default
+    return datetime.fromtimestamp(value / 1000).strftime(fmt)
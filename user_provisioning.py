@@ -0,0 +1,108 @@
+"""
+Bulk user provisioning from CSV.
+
+decode_csv reads uploaded bytes as UTF-8 or, failing that, as the cp1252 that
+Excel writes in pt-BR locales. parse_users_csv reads a CSV of usernames
+separated by commas or semicolons, with an optional column of permanent
+passwords, and validates every row without stopping at the first bad one. Database.create_users inserts the valid rows in one transaction and
+reports the rows it could not create. credentials_csv turns the result into
+the sheet handed to the cohort. Both the admin panel and provision_users.py
+use this module.
+"""
+
+import csv
+import io
+import re
+
+from timestamps import format_timestamp
+
+# Letters, digits and . _ @ - only, so usernames stay safe in URLs, tokens and file names
+USERNAME_PATTERN = re.compile(r'[\w.@-]{1,64}')
+
+MIN_PASSWORD_LENGTH = 8
+
+# Accepted header names of the username and password columns
+USERNAME_HEADERS = ('username', 'usuario', 'usuário', 'user')
+PASSWORD_HEADERS = ('password', 'senha')
+
+# Encodings tried in turn on uploaded files: UTF-8 (with or without BOM), then Excel's Western European ANSI
+CSV_ENCODINGS = ('utf-8-sig', 'cp1252')
+
+# Delimiters recognised in CSV files; Excel uses ';' where ',' is the decimal separator
+CSV_DELIMITERS = ',;'
+
+def validate_username(username):
+    """Return why a username cannot be used, or None when it is valid"""
+    if not username:
+        return "Empty username"
+    if not USERNAME_PATTERN.fullmatch(username):
+        return "Username may only contain letters, digits and . _ @ - (at most 64 characters)"
+    return None
+
+def decode_csv(data):
+    """Decode the bytes of a CSV file, raising UnicodeDecodeError when no known encoding fits"""
+    for encoding in CSV_ENCODINGS[:-1]:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+    return data.decode(CSV_ENCODINGS[-1])
+
+def parse_users_csv(text):
+    """Return ([(line, username, password or None)], [(line, username, reason)]) for a CSV document"""
+    text = text.lstrip('\ufeff')
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=CSV_DELIMITERS)
+    except csv.Error:
+        # A single column (or anything the sniffer cannot tell) is read as plain CSV
+        dialect = csv.excel
+    rows = list(csv.reader(io.StringIO(text), dialect))
+    
+    # A header row names the columns; without one the first column holds usernames
+    username_column, password_column, first_line = 0, None, 1
+    if rows:
+        header = [cell.strip().lower() for cell in rows[0]]
+        if any(name in header for name in USERNAME_HEADERS):
+            username_column = next(header.index(name) for name in USERNAME_HEADERS if name in header)
+            password_column = next((header.index(name) for name in PASSWORD_HEADERS if name in header), None)
+            rows, first_line = rows[1:], 2
+    
+    valid, failures = [], []
+    seen = set()
+    for line, row in enumerate(rows, start=first_line):
+        if not any(cell.strip() for cell in row):
+            continue
+        
+        username = row[username_column].strip() if username_column < len(row) else ''
+        password = row[password_column].strip() if password_column is not None and password_column < len(row) else ''
+        
+        reason = validate_username(username)
+        if reason is None and username in seen:
+            reason = "Duplicate username in file"
+        if reason is None and password and len(password) < MIN_PASSWORD_LENGTH:
+            reason = f"Password shorter than {MIN_PASSWORD_LENGTH} characters"
+        
+        if reason is None:
+            seen.add(username)
+            valid.append((line, username, password or None))
+        else:
+            failures.append((line, username, reason))
+    
+    return valid, failures
+
+def credentials_csv(created):
+    """CSV sheet of the created users and their temporary passwords"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['username', 'temporary_password', 'expires_at'])
+    for username, temp_password, expires_at in created:
+        writer.writerow([username, temp_password or '', format_timestamp(expires_at, default='')])
+    return output.getvalue()
+
+def failures_csv(failures):
+    """CSV report of the rows that were not provisioned"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['line', 'username', 'reason'])
+    writer.writerows(failures)
+    return output.getvalue()